@@ -0,0 +1,54 @@
+"""
+Measure the throughput of the batch uploads of AwsBucketManager by number of workers
+A tar archive of images is streamed to upload_batch, against an in memory s3 stand-in
+Usage : python -m benchmarks.bench_batch_upload
+"""
+import asyncio
+import io
+import os
+import tarfile
+import time
+
+from benchmarks.s3_stand_in import S3StandIn
+from flaskr.api.helpers.archive_stream import iter_tar
+from flaskr.api.managers.aws_bucket_manager import AwsBucketManager
+
+FILES = 128
+LATENCY = 0.05
+
+
+def make_archive():
+    archive = io.BytesIO()
+
+    with tarfile.open(fileobj=archive, mode='w') as tar:
+        for index in range(FILES):
+            content = os.urandom(64 * 1024)
+            info = tarfile.TarInfo('photos/%03d.jpg' % index)
+            info.size = len(content)
+            tar.addfile(info, io.BytesIO(content))
+
+    return archive.getvalue()
+
+
+async def run(concurrency, archive):
+    s3 = S3StandIn(latency=LATENCY)
+    s3.buckets['benchmark'] = {}
+    bucket_manager = AwsBucketManager(s3_client=s3)
+
+    start = time.perf_counter()
+    results, _ = await bucket_manager.upload_batch('benchmark', iter_tar(io.BytesIO(archive)), concurrency)
+
+    assert all(result['status'] == 200 for result in results)
+    return len(results) / (time.perf_counter() - start)
+
+
+def main():
+    archive = make_archive()
+
+    for concurrency in (1, 2, 4, 8, 16, 32):
+        throughput = asyncio.run(run(concurrency, archive))
+        print('workers=%2d  %7.1f files/s' % (concurrency, throughput))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,45 @@
+"""
+Measure the upload throughput of AwsBucketManager against an in memory s3 stand-in
+Usage : python -m benchmarks.bench_bucket_manager_concurrency
+"""
+import asyncio
+import os
+import tempfile
+import time
+
+from benchmarks.s3_stand_in import S3StandIn
+from flaskr.api.managers.aws_bucket_manager import AwsBucketManager
+
+UPLOADS = 64
+LATENCY = 0.05
+
+
+async def run(concurrency, file_path):
+    bucket_manager = AwsBucketManager(s3_client=S3StandIn(latency=LATENCY))
+    await bucket_manager.create_object(bucket_name='benchmark')
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def upload():
+        async with semaphore:
+            await bucket_manager.create_object(bucket_name='benchmark', object_file_path=file_path)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[upload() for _ in range(UPLOADS)])
+
+    return UPLOADS / (time.perf_counter() - start)
+
+
+def main():
+    with tempfile.NamedTemporaryFile(suffix='.jpg', delete=False) as file:
+        file.write(os.urandom(64 * 1024))
+
+    try:
+        for concurrency in (1, 2, 4, 8, 16, 32):
+            throughput = asyncio.run(run(concurrency, file.name))
+            print('concurrency=%2d  %7.1f uploads/s' % (concurrency, throughput))
+    finally:
+        os.remove(file.name)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+"""
+Compare the in memory parallel ranged fetch of AwsBucketManager with the download to disk
+Each image is fetched from an in memory s3 stand-in with a limited bandwidth per connection,
+then a RekognitionImage is built from it.
+Usage : python -m benchmarks.bench_parallel_download
+"""
+import asyncio
+import os
+import shutil
+import tempfile
+import time
+
+from benchmarks.s3_stand_in import S3StandIn
+from flaskr.api.managers.aws_bucket_manager import AwsBucketManager
+from flaskr.api.managers.rekognition_image_detection import RekognitionImage
+
+LATENCY = 0.02
+BANDWIDTH = 40 * 1024 * 1024
+ROUNDS = 5
+
+
+class Image(RekognitionImage):
+    image_optimizer = None
+
+
+async def download_to_disk(bucket_manager, object_name):
+    # the local object cache would serve the next rounds without downloading
+    bucket_manager.local_cache.clear()
+    file_path, _ = await bucket_manager.download_object('benchmark', object_name)
+    return Image.from_file(file_path, None)
+
+
+async def fetch_in_memory(bucket_manager, object_name):
+    view, _ = await bucket_manager.fetch_object('benchmark', object_name)
+    return Image.from_bytes(view, object_name, None)
+
+
+async def run(fetch, size, storage_folder):
+    s3 = S3StandIn(latency=LATENCY, bandwidth=BANDWIDTH)
+    s3.buckets['benchmark'] = {'image.jpg': os.urandom(size)}
+    bucket_manager = AwsBucketManager(s3_client=s3)
+    bucket_manager.storage_folder = storage_folder
+
+    start = time.perf_counter()
+    for _ in range(ROUNDS):
+        await fetch(bucket_manager, 'image.jpg')
+
+    return (time.perf_counter() - start) / ROUNDS
+
+
+def main():
+    storage_folder = tempfile.mkdtemp() + os.sep
+
+    try:
+        for size in (1, 8, 32, 128):
+            disk = asyncio.run(run(download_to_disk, size * 1024 * 1024, storage_folder))
+            memory = asyncio.run(run(fetch_in_memory, size * 1024 * 1024, storage_folder))
+            print('%4d MB  download_object %7.1f ms  fetch_object %7.1f ms  x%.1f' % (
+                size, disk * 1000, memory * 1000, disk / memory))
+    finally:
+        shutil.rmtree(storage_folder)
+
+
+if __name__ == '__main__':
+    main()
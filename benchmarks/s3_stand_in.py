@@ -0,0 +1,96 @@
+import io
+import threading
+import time
+
+
+class S3StandIn:
+    """
+    In memory stand-in for the boto3 s3 client used by the benchmarks
+    Every call sleeps for a fixed latency to simulate the network round trip, the
+    transfers also sleep for their size divided by the bandwidth of a connection
+    """
+
+    def __init__(self, latency=0.05, bandwidth=None):
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.buckets = {}
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def _round_trip(self, size=0):
+        with self._lock:
+            self.calls += 1
+        time.sleep(self.latency + (size / self.bandwidth if self.bandwidth else 0))
+
+    def head_bucket(self, Bucket):
+        self._round_trip()
+        if Bucket not in self.buckets:
+            raise Exception('Not found')
+
+    def head_object(self, Bucket, Key):
+        self._round_trip()
+        if Key not in self.buckets.get(Bucket, {}):
+            raise Exception('Not found')
+        return {'ContentLength': len(self.buckets[Bucket][Key]), 'ETag': '"%s"' % id(self.buckets[Bucket][Key])}
+
+    def create_bucket(self, Bucket, CreateBucketConfiguration=None):
+        self._round_trip()
+        self.buckets.setdefault(Bucket, {})
+
+    def upload_file(self, Filename, Bucket, Key, **kwargs):
+        self._round_trip()
+        with open(Filename, 'rb') as file:
+            self.buckets[Bucket][Key] = file.read()
+
+    def upload_fileobj(self, Fileobj, Bucket, Key, **kwargs):
+        self._round_trip()
+        self.buckets[Bucket][Key] = Fileobj.read()
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        self._round_trip()
+        self.buckets[Bucket][Key] = bytes(Body)
+        return {}
+
+    def get_object(self, Bucket, Key, Range=None, **kwargs):
+        data = self.buckets[Bucket][Key]
+        response = {'ETag': '"%s"' % id(data)}
+        if Range is not None:
+            start, end = (int(value) for value in Range[len('bytes='):].split('-'))
+            end = min(end, len(data) - 1)
+            response['ContentRange'] = 'bytes %s-%s/%s' % (start, end, len(data))
+            data = data[start:end + 1]
+        self._round_trip()
+        response.update({'Body': _StreamedBody(data, self.bandwidth), 'ContentLength': len(data)})
+        return response
+
+    def download_file(self, Bucket, Key, Filename, **kwargs):
+        data = self.buckets[Bucket][Key]
+        self._round_trip(len(data))
+        with open(Filename, 'wb') as file:
+            file.write(data)
+
+    def generate_presigned_url(self, ClientMethod, Params, ExpiresIn=3600):
+        return 'https://%s.s3.local/%s?expires=%s' % (Params['Bucket'], Params['Key'], ExpiresIn)
+
+
+class _StreamedBody(io.BytesIO):
+    """
+    Body of a get, the headers are received after the round trip and the body is
+    read at the bandwidth of the connection
+    """
+
+    def __init__(self, data, bandwidth=None):
+        super().__init__(data)
+        self.bandwidth = bandwidth
+
+    def read(self, size=-1):
+        data = super().read(size)
+        if self.bandwidth:
+            time.sleep(len(data) / self.bandwidth)
+        return data
+
+    def readinto(self, buffer):
+        read = super().readinto(buffer)
+        if self.bandwidth:
+            time.sleep(read / self.bandwidth)
+        return read
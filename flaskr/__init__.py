@@ -1,14 +1,45 @@
 from enum import Enum
+import asyncio
+import atexit
+import hashlib
+import logging
 import os
 import datetime
 import tempfile
 import json as js
 import pandas as pd
 import re
+import sys
+import click
 from pypika import MySQLQuery as Query, Table, CustomFunction
 from flask import Flask, request, jsonify, json
+from werkzeug.http import http_date
+from werkzeug.utils import secure_filename
+from flaskr.api.helpers.archive_stream import ARCHIVE_READERS
+from flaskr.api.helpers.async_io_helper import run_blocking
+from flaskr.api.helpers.aws_client_registry import client_registry, DEFAULT_MAX_POOL_CONNECTIONS
+from flaskr.api.helpers.hedging import hedger
+from flaskr.api.helpers.image_fetcher import image_fetcher
+from flaskr.api.helpers.multipart_stream import MultipartFileReader
+from flaskr.api.helpers.rate_limiter import RateLimitExceeded, rate_limiter
+from flaskr.api.helpers.region_router import region_router
+from flaskr.api.helpers.stage_timer import StageTimer
 from flaskr.api.interfaces.i_bucket_manager import IBucketManager
-from flaskr.api.managers.rekognition_image_detection import face_from_url, face_from_local_file
+from flaskr.api.managers import analysis_queue as aq
+from flaskr.api.managers.analysis_queue import AnalysisQueue, AnalysisQueueFull, InvalidCallbackUrl
+from flaskr.api.managers import upload_notifier as un
+from flaskr.api.managers.upload_notifier import UploadNotifier, confirm_sns_subscription, events_token_matches
+from flaskr.api.managers.aws_bucket_manager import AwsBucketManager
+from flaskr.api.managers.content_addressing import ObjectAliasTable
+from flaskr.api.managers.bulk_analysis import BulkAnalysisJob, JsonLinesSink, DEFAULT_CONCURRENCY, MAX_CONCURRENCY
+from flaskr.api.managers.bulk_job_manager import BulkJobJournal, BulkJobManager
+from flaskr.api.helpers.image_optimizer import image_optimizer
+from flaskr.api.managers.rekognition_image_detection import ANALYSIS_OPERATIONS, RekognitionImage, analyse_image, face_from_url, face_from_bytes, get_rekognition_client, single_flight
+from flaskr.api.managers.rekognition_objects import RekognitionFace
+from flaskr.api.managers.rekognition_pipeline import AnalysisPipeline, default_pipeline, pipeline_stats
+from flaskr.api.managers.rekognition_result_cache import result_cache
+
+logger = logging.getLogger(__name__)
 
 
 class AttributeType(Enum):
@@ -30,13 +61,31 @@ class AttributeType(Enum):
 
 
 def create_app(test_config=None):
-    i_aws_bucket_manager = IBucketManager()
-
     # create and configure the app
     app = Flask(__name__, instance_relative_config=True)
     app.config.from_mapping(
         SECRET_KEY='dev',
         DATABASE=os.path.join(app.instance_path, 'flaskr.sqlite'),
+        AWS_MAX_POOL_CONNECTIONS=int(os.getenv('AWS_MAX_POOL_CONNECTIONS', DEFAULT_MAX_POOL_CONNECTIONS)),
+        AWS_WARM_CLIENTS=True,
+        ANALYSIS_QUEUE_WORKERS=int(os.getenv('ANALYSIS_QUEUE_WORKERS', aq.DEFAULT_WORKERS)),
+        ANALYSIS_QUEUE_MAX_SIZE=int(os.getenv('ANALYSIS_QUEUE_MAX_SIZE', aq.DEFAULT_MAX_SIZE)),
+        ANALYSIS_QUEUE_RESULT_TTL=int(os.getenv('ANALYSIS_QUEUE_RESULT_TTL', aq.DEFAULT_RESULT_TTL)),
+        ANALYSIS_CALLBACK_WORKERS=int(os.getenv('ANALYSIS_CALLBACK_WORKERS', aq.DEFAULT_CALLBACK_WORKERS)),
+        ANALYSIS_CALLBACK_ALLOWED_HOSTS=[host for host in os.getenv('ANALYSIS_CALLBACK_ALLOWED_HOSTS', '').split(',')
+                                         if host],
+        UPLOAD_NOTIFIER_MODE=os.getenv('UPLOAD_NOTIFIER_MODE', un.EVENTS),
+        UPLOAD_POLL_INTERVAL=int(os.getenv('UPLOAD_POLL_INTERVAL', un.DEFAULT_POLL_INTERVAL)),
+        UPLOAD_NOTIFIER_ANALYSE_ALL=os.getenv('UPLOAD_NOTIFIER_ANALYSE_ALL', '0') == '1',
+        S3_EVENTS_TOKEN=os.getenv('S3_EVENTS_TOKEN'),
+        S3_EVENTS_TOPIC_ARNS=[arn for arn in os.getenv('S3_EVENTS_TOPIC_ARNS', '').split(',') if arn],
+        # amazon rekognition analyses the images stored in s3 up to 15MB
+        PRESIGNED_POST_MAX_SIZE=int(os.getenv('PRESIGNED_POST_MAX_SIZE', 15 * 1024 * 1024)),
+        CONTENT_ADDRESSED_STORAGE=os.getenv('CONTENT_ADDRESSED_STORAGE', '0') == '1',
+        DOWNLOAD_CHUNK_SIZE=int(os.getenv('DOWNLOAD_CHUNK_SIZE', 64 * 1024)),
+        BATCH_UPLOAD_CONCURRENCY=int(os.getenv('BATCH_UPLOAD_CONCURRENCY', 8)),
+        BATCH_UPLOAD_MAX_FILE_SIZE=int(os.getenv('BATCH_UPLOAD_MAX_FILE_SIZE', 15 * 1024 * 1024)),
+        BATCH_UPLOAD_MAX_ARCHIVE_SIZE=int(os.getenv('BATCH_UPLOAD_MAX_ARCHIVE_SIZE', 1024 * 1024 * 1024)),
     )
 
     if test_config is None:
@@ -52,14 +101,151 @@ def create_app(test_config=None):
     except OSError:
         pass
 
+    # the aws clients are created once per process and shared by every request
+    client_registry.configure(max_pool_connections=app.config['AWS_MAX_POOL_CONNECTIONS'])
+    if app.config['AWS_WARM_CLIENTS']:
+        client_registry.warm('s3', 'rekognition')
+
+    # in content addressed mode, the names of the objects are aliases stored in the database
+    alias_table = ObjectAliasTable(app.config['DATABASE']) if app.config['CONTENT_ADDRESSED_STORAGE'] else None
+    bucket_manager = AwsBucketManager(alias_table=alias_table)
+    i_aws_bucket_manager = IBucketManager(bucket_manager)
+    bulk_job_manager = BulkJobManager(BulkJobJournal(app.config['DATABASE']), i_aws_bucket_manager)
+    analysis_queue = AnalysisQueue(workers=app.config['ANALYSIS_QUEUE_WORKERS'],
+                                   max_size=app.config['ANALYSIS_QUEUE_MAX_SIZE'],
+                                   result_ttl=app.config['ANALYSIS_QUEUE_RESULT_TTL'],
+                                   callback_workers=app.config['ANALYSIS_CALLBACK_WORKERS'],
+                                   callback_hosts=app.config['ANALYSIS_CALLBACK_ALLOWED_HOSTS'])
+    atexit.register(analysis_queue.stop)
+    upload_notifier = UploadNotifier(analysis_queue, i_aws_bucket_manager, mode=app.config['UPLOAD_NOTIFIER_MODE'],
+                                     poll_interval=app.config['UPLOAD_POLL_INTERVAL'],
+                                     analyse_all=app.config['UPLOAD_NOTIFIER_ANALYSE_ALL'])
+    atexit.register(upload_notifier.stop)
+    if upload_notifier.mode == un.EVENTS and not app.config['S3_EVENTS_TOKEN']:
+        logger.warning("S3_EVENTS_TOKEN is not set, the S3 event notifications posted to /api/s3_events are refused.")
+
     @app.route('/api/upload/<bucket>', methods=['POST'])
     async def upload(bucket):
-        if 'file' not in request.files:
+        # the body is parsed while it is sent to s3, request.files would spool it to a temporary file
+        reader = MultipartFileReader.from_request(request)
+
+        try:
+            if reader is None or not await run_blocking(reader.open):
+                return 'No file.', 400
+        except ValueError as e:
+            return str(e), 400
+
+        return await i_aws_bucket_manager.upload_stream(bucket, secure_filename(reader.filename), reader)
+
+    @app.route('/api/batch_upload/<bucket>', methods=['POST'])
+    async def batch_upload(bucket):
+        max_size = app.config['BATCH_UPLOAD_MAX_FILE_SIZE']
+
+        # an archive body is read as it is received, like the files of a multipart body
+        if request.mimetype in ARCHIVE_READERS:
+            max_archive_size = app.config['BATCH_UPLOAD_MAX_ARCHIVE_SIZE']
+            if request.content_length and request.content_length > max_archive_size:
+                return 'The archive is larger than %s bytes' % max_archive_size, 413
+            files = ARCHIVE_READERS[request.mimetype](request.stream, max_size, max_archive_size)
+        else:
+            reader = MultipartFileReader.from_request(request, file_field=None)
+            if reader is None:
+                return 'No file.', 400
+            files = ((secure_filename(filename), data) for filename, data in reader.iter_files(max_size))
+
+        results, status = await i_aws_bucket_manager.upload_batch(
+            bucket, files, app.config['BATCH_UPLOAD_CONCURRENCY'])
+        if not isinstance(results, list):
+            return results, status
+        if not results:
             return 'No file.', 400
 
-        file = request.files['file']
+        return jsonify({
+            'uploaded': sum(result['status'] == 200 for result in results),
+            'failed': sum(result['status'] != 200 for result in results),
+            'files': results,
+        }), status
+
+    @app.route('/api/presigned_upload/<bucket>', methods=['POST'])
+    async def presigned_upload(bucket):
+        content = request.get_json(silent=True) or request.values
+        filename = secure_filename(content.get('filename', ''))
+
+        if not filename:
+            return 'No filename.', 400
+
+        result = await i_aws_bucket_manager.presigned_post(bucket, filename, app.config['PRESIGNED_POST_MAX_SIZE'])
+        if result[1] != 200:
+            return result
+
+        # the analysis is queued by the notifier once the object arrives
+        upload_notifier.watch(bucket, filename)
+
+        return jsonify({
+            'url': result[0]['url'],
+            'fields': result[0]['fields'],
+            'key': filename,
+            'status_url': '/api/presigned_upload/%s/%s' % (bucket, filename),
+        })
+
+    @app.route('/api/presigned_upload/<bucket>/<object>', methods=['GET'])
+    def presigned_upload_status(bucket, object):
+        job_id = upload_notifier.job_id(bucket, object)
+
+        if job_id is None:
+            return jsonify({'status': 'awaiting_upload'}), 202
+
+        job = analysis_queue.status(job_id)
+
+        if job is None:
+            return 'Not found', 404
+
+        return jsonify(job)
+
+    @app.route('/api/s3_events', methods=['POST'])
+    def s3_events():
+        # the endpoint starts paid analyses, only the holders of the shared secret can post to it
+        token = app.config['S3_EVENTS_TOKEN']
+        if not token:
+            return 'The S3 event notifications are disabled, set S3_EVENTS_TOKEN to receive them.', 403
+
+        authorization = request.authorization
+        if not events_token_matches(token, (request.headers.get('X-S3-Events-Token'), request.args.get('token'),
+                                            authorization.password if authorization is not None else None)):
+            return 'Forbidden', 403
 
-        return await i_aws_bucket_manager.upload_file(bucket, file)
+        # SNS posts its messages as text/plain
+        notification = request.get_json(silent=True, force=True)
+
+        if not isinstance(notification, dict):
+            return 'No S3 event notification.', 400
+
+        message_type = notification.get('Type')
+        topic_arns = app.config['S3_EVENTS_TOPIC_ARNS']
+        if message_type is not None and topic_arns and notification.get('TopicArn') not in topic_arns:
+            return 'The topic %s is not allowed' % notification.get('TopicArn'), 403
+
+        if message_type == 'SubscriptionConfirmation':
+            try:
+                confirm_sns_subscription(notification)
+            except ValueError as e:
+                return str(e), 400
+            return jsonify({'confirmed': notification.get('TopicArn')})
+
+        if message_type == 'UnsubscribeConfirmation':
+            return jsonify({'queued': 0})
+
+        # the notifications forwarded by SNS are wrapped in its own message
+        if isinstance(notification.get('Message'), str):
+            try:
+                notification = js.loads(notification['Message'])
+            except ValueError:
+                return 'No S3 event notification.', 400
+
+        if not isinstance(notification, dict):
+            return 'No S3 event notification.', 400
+
+        return jsonify({'queued': upload_notifier.receive(notification)}), 202
 
     @app.route('/api/delete/<bucket>', methods=['DELETE'])
     async def remove_bucket(bucket):
@@ -69,19 +255,72 @@ def create_app(test_config=None):
     async def remove_object(bucket, object):
         return await i_aws_bucket_manager.remove_object(bucket_name=bucket, object_name=object)
 
+    @app.route('/api/bulk_delete/<bucket>', methods=['POST'])
+    async def bulk_delete(bucket):
+        arguments = request.get_json(silent=True) or {}
+        keys = arguments.get('keys') or []
+        prefixes = arguments.get('prefixes') or []
+
+        if not keys and not prefixes:
+            return 'Give the keys or the prefixes of the objects to delete.', 400
+
+        stats, status = await i_aws_bucket_manager.delete_objects(
+            bucket, keys, prefixes, arguments.get('versions', True))
+        if not isinstance(stats, dict):
+            return stats, status
+
+        return jsonify(stats), status
+
     @app.route('/api/download/<bucket>/<object>', methods=['GET'])
     async def download(bucket, object):
-        return await i_aws_bucket_manager.download_object(bucket, object)
+        # s3 only serves single ranges, the other requests get the whole object
+        byte_range = request.headers.get('Range')
+        if byte_range is not None and (not byte_range.startswith('bytes=') or ',' in byte_range):
+            byte_range = None
+
+        if_none_match = request.headers.get('If-None-Match')
+        s3_object, status = await i_aws_bucket_manager.get_object_stream(bucket, object, byte_range, if_none_match)
+
+        # the If-None-Match header may list several ETags, the client is given the one of the object
+        if status == 304:
+            return '', 304, {'ETag': s3_object['ETag']} if s3_object.get('ETag') else {}
+        if status == 416:
+            return 'Invalid range', 416, {'Content-Range': s3_object['ContentRange']} if s3_object.get('ContentRange') else {}
+        if status not in (200, 206):
+            return s3_object, status
+
+        headers = {
+            'Accept-Ranges': 'bytes',
+            'Content-Length': str(s3_object['ContentLength']),
+            'ETag': s3_object['ETag'],
+            'Content-Disposition': 'attachment; filename="%s"' % secure_filename(object),
+        }
+        if s3_object.get('ContentRange'):
+            headers['Content-Range'] = s3_object['ContentRange']
+        if s3_object.get('LastModified'):
+            headers['Last-Modified'] = http_date(s3_object['LastModified'])
+
+        body = s3_object['Body']
+
+        # the body is sent chunk by chunk while it is read from s3, so the memory used stays flat
+        def chunks():
+            try:
+                yield from body.iter_chunks(app.config['DOWNLOAD_CHUNK_SIZE'])
+            finally:
+                body.close()
+
+        return app.response_class(chunks(), status=status, headers=headers,
+                                  content_type=s3_object.get('ContentType', 'application/octet-stream'))
 
     @app.route('/api/request_analysis', methods=['POST'])
     async def RequestAnalysis(shouldDisplayImage=False):
         
         # Replace with AwsImageAnalyserHelper.MakeAnalysisRequest()
 
-        i_aws_bucket_manager = IBucketManager()
-
         arguments = request.values.get('arguments')
         bucket = request.values.get('bucket')
+        run_async = request.values.get('async', 'false').lower() in ('1', 'true')
+        callback_url = request.values.get('callback_url')
 
         if 'file' not in request.files:
             return 'No file.', 400
@@ -91,17 +330,129 @@ def create_app(test_config=None):
 
 
         file = request.files['file']
+        filename = secure_filename(file.filename)
+        timer = StageTimer()
+
+        # the upload is buffered and hashed once, then the same bytes are sent
+        # to s3 and rekognition at the same time
+        with timer.stage('read'):
+            image_bytes = file.read()
+
+        with timer.stage('hash'):
+            digest = hashlib.sha256(image_bytes).hexdigest()
+
+        if arguments is not None:
+            try:
+                RekognitionFace.required_attributes(arguments.split(','))
+            except ValueError as e:
+                return str(e), 400
+
+        if run_async:
+            def analyse_in_background():
+                analysis = asyncio.run(analyse_upload(bucket, filename, image_bytes, digest,
+                                                      shouldDisplayImage, arguments, StageTimer()))
+                return js.loads(analysis) if isinstance(analysis, str) else [js.loads(face) for face in analysis]
+
+            try:
+                job_id = analysis_queue.submit(analyse_in_background, callback_url)
+            except AnalysisQueueFull as e:
+                return str(e), 429, {'Retry-After': str(e.retry_after)}
+            except InvalidCallbackUrl as e:
+                return str(e), 400
+
+            return jsonify({'id': job_id, 'status_url': '/api/request_analysis/jobs/%s' % job_id}), 202
+
+        analysis = await analyse_upload(bucket, filename, image_bytes, digest, shouldDisplayImage, arguments, timer)
 
-        file_exists = await i_aws_bucket_manager.upload_file(bucket, file)
+        response = app.response_class(response=analysis,
+                                      status=200,
+                                      mimetype='application/json')
+        response.headers['Server-Timing'] = timer.server_timing()
 
-        saveResult = await i_aws_bucket_manager.create_object(bucket, file)
+        return response
 
-        downloadResult = await download(bucket, file)
+    async def analyse_upload(bucket, filename, image_bytes, digest, shouldDisplayImage, arguments, timer):
+        upload_result, analysis = await asyncio.gather(
+            timer.measure('upload', i_aws_bucket_manager.upload_bytes(bucket, filename, image_bytes, digest)),
+            timer.measure('analysis', run_blocking(face_from_bytes, image_bytes, filename, shouldDisplayImage,
+                                                   arguments, source=(bucket, filename), digest=digest)))
 
-        return app.response_class(response=face_from_local_file(file.filename, shouldDisplayImage, arguments),
-                                    status=200,
-                                    mimetype='application/json')
+        if upload_result[1] != 200:
+            logger.warning("Couldn't upload %s to %s : %s", filename, bucket, upload_result[0])
 
+        timer.log('request_analysis')
+
+        return analysis
+
+    @app.route('/api/request_analysis/jobs/<job_id>', methods=['GET'])
+    def RequestAnalysisStatus(job_id):
+        job = analysis_queue.status(job_id)
+
+        if job is None:
+            return 'Not found', 404
+
+        return jsonify(job)
+
+
+    @app.route('/api/request_analysis/combined', methods=['POST'])
+    async def RequestCombinedAnalysis():
+        operations = request.values.get('operations')
+        max_labels = request.values.get('max_labels', 10, type=int)
+
+        if 'file' not in request.files:
+            return 'No file.', 400
+
+        if not operations:
+            return 'You have to choose the operations to run, for example : detect_faces,detect_labels', 400
+
+        file = request.files['file']
+        timer = StageTimer()
+
+        with timer.stage('read'):
+            image_bytes = file.read()
+
+        image = RekognitionImage.from_bytes(image_bytes, secure_filename(file.filename), get_rekognition_client())
+
+        try:
+            results, errors = await analyse_image(image, operations.split(','), max_labels, timer)
+        except ValueError as e:
+            return str(e), 400
+
+        timer.log('request_combined_analysis')
+        response = jsonify({'results': results, 'errors': errors})
+        response.status_code = 200 if results else 500
+        response.headers['Server-Timing'] = timer.server_timing()
+
+        return response
+
+    @app.route('/api/request_analysis/pipeline', methods=['POST'])
+    async def RequestPipelineAnalysis():
+        pipeline_config = request.values.get('pipeline')
+        max_labels = request.values.get('max_labels', 10, type=int)
+
+        if 'file' not in request.files:
+            return 'No file.', 400
+
+        try:
+            pipeline = AnalysisPipeline.from_config(js.loads(pipeline_config)) if pipeline_config else default_pipeline()
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            return 'Invalid pipeline : %s' % e, 400
+
+        file = request.files['file']
+        timer = StageTimer()
+
+        with timer.stage('read'):
+            image_bytes = file.read()
+
+        image = RekognitionImage.from_bytes(image_bytes, secure_filename(file.filename), get_rekognition_client())
+        report = await pipeline.run(image, max_labels, timer)
+
+        timer.log('request_pipeline_analysis')
+        response = jsonify(report)
+        response.status_code = 500 if report['errors'] and not report['ran'] else 200
+        response.headers['Server-Timing'] = timer.server_timing()
+
+        return response
 
     @app.route('/api/request_analysis/display_image', methods=['POST'])
     async def RequestAnalysisShowImage():
@@ -214,8 +565,135 @@ def create_app(test_config=None):
 
         return message
 
+    @app.route('/api/metrics', methods=['GET'])
+    def metrics():
+        return jsonify({
+            'rekognition_result_cache': result_cache.stats() if result_cache is not None else None,
+            'rekognition_single_flight': single_flight.stats(),
+            'rekognition_pipeline': pipeline_stats.to_dict(),
+            'image_optimizer': image_optimizer.stats() if image_optimizer is not None else None,
+            'analysis_queue': analysis_queue.stats(),
+            'rekognition_rate_limiter': rate_limiter.stats() if rate_limiter is not None else None,
+            'rekognition_hedging': hedger.stats() if hedger is not None else None,
+            'rekognition_regions': region_router.stats() if region_router is not None else None,
+            'upload_notifier': upload_notifier.stats(),
+            'deduplicated_uploads': bucket_manager.deduplicated if alias_table is not None else None,
+            's3_metadata_cache': bucket_manager.metadata_cache.stats(),
+            'local_object_cache': bucket_manager.local_cache.stats(),
+            'image_fetcher': image_fetcher.stats(),
+        })
+
+    @app.route('/api/jobs', methods=['POST'])
+    def submit_bulk_job():
+        content = request.get_json(silent=True) or request.values
+        bucket = content.get('bucket')
+        operations = content.get('operations', 'detect_faces')
+
+        if not bucket:
+            return 'You have to choose a bucket before start', 400
+
+        if isinstance(operations, str):
+            operations = operations.split(',')
+
+        unknown = [operation for operation in operations if operation not in ANALYSIS_OPERATIONS]
+        if unknown:
+            return 'Unknown operations : %s' % ', '.join(unknown), 400
+
+        try:
+            concurrency = int(content.get('concurrency', DEFAULT_CONCURRENCY))
+        except (TypeError, ValueError):
+            concurrency = 0
+        if not 1 <= concurrency <= MAX_CONCURRENCY:
+            return 'The concurrency must be an integer between 1 and %s' % MAX_CONCURRENCY, 400
+
+        job_id = bulk_job_manager.submit(bucket, content.get('prefix', ''), operations, concurrency)
+
+        return jsonify(bulk_job_manager.status(job_id)), 202
+
+    @app.route('/api/jobs', methods=['GET'])
+    def list_bulk_jobs():
+        return jsonify(bulk_job_manager.journal.list_jobs())
+
+    @app.route('/api/jobs/<job_id>', methods=['GET'])
+    def bulk_job_status(job_id):
+        job = bulk_job_manager.status(job_id)
+
+        if job is None:
+            return 'Not found', 404
+
+        return jsonify(job)
+
+    @app.route('/api/jobs/<job_id>/results', methods=['GET'])
+    def bulk_job_results(job_id):
+        if bulk_job_manager.journal.get_status(job_id) is None:
+            return 'Not found', 404
+
+        return jsonify(bulk_job_manager.journal.results(
+            job_id, request.args.get('offset', 0, type=int), min(request.args.get('limit', 100, type=int), 1000)))
+
+    @app.route('/api/jobs/<job_id>/cancel', methods=['POST'])
+    def cancel_bulk_job(job_id):
+        if not bulk_job_manager.cancel(job_id):
+            return 'The job is not running', 409
+
+        return jsonify(bulk_job_manager.status(job_id))
+
+    @app.route('/api/jobs/<job_id>/resume', methods=['POST'])
+    def resume_bulk_job(job_id):
+        if not bulk_job_manager.resume(job_id):
+            return 'The job can not be resumed', 409
+
+        return jsonify(bulk_job_manager.status(job_id)), 202
+
+    @app.cli.command('bulk-analyse')
+    @click.argument('bucket')
+    @click.option('--prefix', default='', help='Prefix of the objects to analyse.')
+    @click.option('--operations', default='detect_faces', help='Operations to run, written as : op1,op2.')
+    @click.option('--concurrency', default=DEFAULT_CONCURRENCY, type=click.IntRange(1, MAX_CONCURRENCY),
+                  help='Number of images analysed at the same time.')
+    @click.option('--output', type=click.File('w'), default='-', help='Json lines file receiving the results.')
+    def bulk_analyse(bucket, prefix, operations, concurrency, output):
+        """
+        Analyse every image of a bucket prefix by s3 reference
+        """
+        job = BulkAnalysisJob(i_aws_bucket_manager, bucket, prefix, operations.split(','), concurrency,
+                              JsonLinesSink(output))
+        stats = asyncio.run(job.run())
+
+        click.echo(js.dumps(stats), file=sys.stderr)
+
+    @app.cli.command('bulk-delete')
+    @click.argument('bucket')
+    @click.option('--prefix', 'prefixes', multiple=True, help='Prefix of the objects to delete, can be repeated.')
+    @click.option('--keys', type=click.File('r'), help='File of the keys to delete, one per line.')
+    @click.option('--versions/--no-versions', default=True, help='Delete every version and delete marker.')
+    @click.option('--remove-bucket', is_flag=True, help='Delete every object, then the bucket.')
+    def bulk_delete_command(bucket, prefixes, keys, versions, remove_bucket):
+        """
+        Delete the objects of a bucket in batches of 1000 keys, printing the progress
+        """
+        last_report = [0.0]
+
+        def progress(stats):
+            if stats['elapsed_s'] - last_report[0] >= 1:
+                last_report[0] = stats['elapsed_s']
+                click.echo('%(deleted)s deleted, %(failed)s failed, %(keys_per_second)s keys/s' % stats, file=sys.stderr)
+
+        if remove_bucket:
+            prefixes = ['']
+        stats, status = asyncio.run(i_aws_bucket_manager.delete_objects(
+            bucket, [line.strip() for line in keys or [] if line.strip()], list(prefixes), versions, progress))
+        click.echo(js.dumps(stats), file=sys.stderr)
+
+        if remove_bucket and status == 200:
+            click.echo(asyncio.run(i_aws_bucket_manager.remove_object(bucket_name=bucket))[0], file=sys.stderr)
+
     @app.errorhandler(404)
     def handle_404(e):
         return 'Not found', 404
 
+    @app.errorhandler(RateLimitExceeded)
+    def handle_rate_limit_exceeded(e):
+        return str(e), 503, {'Retry-After': str(e.retry_after)}
+
     return app
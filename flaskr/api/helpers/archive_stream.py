@@ -0,0 +1,111 @@
+import posixpath
+import tarfile
+import tempfile
+import zipfile
+
+from werkzeug.utils import secure_filename
+
+# The zip archives smaller than this are spooled in memory, the larger ones to a temporary file
+DEFAULT_SPOOL_SIZE = 16 * 1024 * 1024
+
+
+class ArchiveTooLarge(ValueError):
+    """
+    Raised when an archive is larger than the maximum size allowed
+    """
+
+    status = 413
+
+
+class _LimitedReader:
+    """
+    Read a file object, raise ArchiveTooLarge once more than limit bytes were read
+    """
+
+    def __init__(self, fileobj, limit):
+        self.fileobj = fileobj
+        self.limit = limit
+        self.read_bytes = 0
+
+    def read(self, size=-1):
+        data = self.fileobj.read(size)
+        self.read_bytes += len(data)
+        if self.read_bytes > self.limit:
+            raise ArchiveTooLarge("The archive is larger than %s bytes" % self.limit)
+        return data
+
+
+def member_name(name):
+    """
+    Make an archive member path safe to use as an object key, its folders are kept
+    """
+    parts = [secure_filename(part) for part in posixpath.normpath(name.replace('\\', '/')).split('/')]
+
+    return '/'.join(part for part in parts if part)
+
+
+def iter_tar(fileobj, max_size=None, max_archive_size=None):
+    """
+    Read the files of a tar archive, compressed or not, while it is received
+    The archive is read as a stream, it is never seeked nor written to disk
+    Yield (name, bytes) pairs, the bytes are None for a file larger than max_size
+    Raise ArchiveTooLarge once more than max_archive_size bytes are read
+    """
+    if max_archive_size:
+        fileobj = _LimitedReader(fileobj, max_archive_size)
+
+    with tarfile.open(fileobj=fileobj, mode='r|*') as archive:
+        for member in archive:
+            name = member_name(member.name)
+
+            if not member.isfile() or not name:
+                continue
+
+            if max_size and member.size > max_size:
+                yield name, None
+                continue
+
+            yield name, archive.extractfile(member).read()
+
+
+def iter_zip(fileobj, max_size=None, max_archive_size=None, spool_size=DEFAULT_SPOOL_SIZE):
+    """
+    Read the files of a zip archive
+    The table of contents of a zip is at its end, so the archive is spooled first
+    Yield (name, bytes) pairs, the bytes are None for a file larger than max_size
+    Raise ArchiveTooLarge while it is spooled when it is larger than max_archive_size
+    """
+    if max_archive_size:
+        fileobj = _LimitedReader(fileobj, max_archive_size)
+
+    with tempfile.SpooledTemporaryFile(max_size=spool_size) as spool:
+        while True:
+            chunk = fileobj.read(1024 * 1024)
+            if not chunk:
+                break
+            spool.write(chunk)
+
+        spool.seek(0)
+        with zipfile.ZipFile(spool) as archive:
+            for info in archive.infolist():
+                name = member_name(info.filename)
+
+                if info.is_dir() or not name:
+                    continue
+
+                if max_size and info.file_size > max_size:
+                    yield name, None
+                    continue
+
+                yield name, archive.read(info)
+
+
+# The archive readers by content type of the request body
+ARCHIVE_READERS = {
+    'application/x-tar': iter_tar,
+    'application/x-gtar': iter_tar,
+    'application/gzip': iter_tar,
+    'application/x-gzip': iter_tar,
+    'application/zip': iter_zip,
+    'application/x-zip-compressed': iter_zip,
+}
@@ -0,0 +1,62 @@
+import asyncio
+import functools
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+DEFAULT_MAX_WORKERS = 32
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """
+    Get the process wide thread pool used to run blocking aws calls
+    The size of the pool is bounded by the AWS_IO_MAX_WORKERS env variable
+    """
+    global _executor
+
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                max_workers = int(os.getenv('AWS_IO_MAX_WORKERS', DEFAULT_MAX_WORKERS))
+                _executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='aws-io')
+
+    return _executor
+
+
+def shutdown_executor(wait=True):
+    """
+    Shutdown the shared thread pool, a new one is created on next use
+    """
+    global _executor
+
+    with _executor_lock:
+        executor, _executor = _executor, None
+
+    if executor is not None:
+        executor.shutdown(wait=wait)
+
+
+async def run_blocking(function, *args, **kwargs):
+    """
+    Run a blocking function on the shared thread pool without blocking the event loop
+    """
+    loop = asyncio.get_running_loop()
+
+    return await loop.run_in_executor(get_executor(), functools.partial(function, *args, **kwargs))
+
+
+def _reset_after_fork():
+    """
+    A forked child doesn't inherit the threads of its parent, so it needs its own pool
+    """
+    global _executor, _executor_lock
+
+    _executor = None
+    _executor_lock = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
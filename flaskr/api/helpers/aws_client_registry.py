@@ -0,0 +1,143 @@
+import logging
+import os
+import threading
+
+import boto3
+from botocore.config import Config
+from botocore.exceptions import BotoCoreError
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_POOL_CONNECTIONS = 50
+
+# A single attempt per call : the call is retried by the caller instead of botocore
+NO_RETRIES = {'mode': 'standard', 'total_max_attempts': 1}
+
+
+class AwsClientRegistry:
+    """
+    Process wide registry of boto3 clients
+    Each client is created once and shared, so requests reuse its warm connection pool
+    instead of reloading the botocore service models for every call.
+    boto3 clients are thread safe, but their connections must not be shared with a
+    forked child : the registry is emptied when it is used from a new process.
+    """
+
+    def __init__(self, max_pool_connections=DEFAULT_MAX_POOL_CONNECTIONS, retries=None):
+        self.max_pool_connections = max_pool_connections
+        self.retries = dict(retries or {})
+        self._clients = {}
+        self._session = None
+        self._credentials = None
+        self._credentials_resolved = False
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+
+    def configure(self, max_pool_connections=None):
+        """
+        Change the client configuration, the clients already created are dropped
+        """
+        with self._lock:
+            if max_pool_connections is not None:
+                self.max_pool_connections = int(max_pool_connections)
+
+            self._clients = {}
+
+    def client(self, service_name, region_name=None, endpoint_url=None):
+        """
+        Get the shared client of a service, it is created on first use
+        """
+        if self._pid != os.getpid():
+            self.reset()
+
+        key = (service_name, region_name, endpoint_url)
+        client = self._clients.get(key)
+
+        if client is None:
+            with self._lock:
+                client = self._clients.get(key)
+
+                if client is None:
+                    # boto3 sessions are not thread safe, clients are only created under the lock
+                    client = self._get_session().client(service_name, region_name=region_name, endpoint_url=endpoint_url, config=Config(
+                        max_pool_connections=self.max_pool_connections, retries=self.retries.get(service_name)))
+                    self._clients[key] = client
+
+        return client
+
+    def credentials(self):
+        """
+        Get the credentials the clients sign their requests with, None when there are none
+        They are resolved once by the shared session, then refreshed by botocore
+        """
+        if self._pid != os.getpid():
+            self.reset()
+
+        with self._lock:
+            if not self._credentials_resolved:
+                self._credentials = self._get_session().get_credentials()
+                self._credentials_resolved = True
+
+            return self._credentials
+
+    def _get_session(self):
+        if self._session is None:
+            self._session = boto3.session.Session()
+
+        return self._session
+
+    def warm(self, *service_names):
+        """
+        Create the clients of the given services ahead of the first request
+        A client that can't be created yet, such as without a configured region, is
+        left to be created on first use, where the error reaches the caller
+        """
+        for service_name in service_names:
+            try:
+                self.client(service_name)
+            except BotoCoreError as e:
+                logger.warning("Couldn't warm the %s client: %s", service_name, e)
+
+    def reset(self):
+        """
+        Drop every client, used after a fork so the child opens its own connections
+        """
+        self._lock = threading.Lock()
+        self._clients = {}
+        self._session = None
+        self._credentials = None
+        self._credentials_resolved = False
+        self._pid = os.getpid()
+
+
+def _retries_from_env():
+    """
+    The rate limiter retries the rekognition calls itself : it must see every throttled
+    call to adapt its rate, and the botocore retries would multiply its attempts
+    """
+    if os.getenv('REKOGNITION_RATE_LIMITER_ENABLED', '1') == '0':
+        return {}
+
+    return {'rekognition': NO_RETRIES}
+
+
+client_registry = AwsClientRegistry(
+    max_pool_connections=int(os.getenv('AWS_MAX_POOL_CONNECTIONS', DEFAULT_MAX_POOL_CONNECTIONS)),
+    retries=_retries_from_env())
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=client_registry.reset)
+
+
+def get_client(service_name, region_name=None, endpoint_url=None):
+    """
+    Get the shared boto3 client of a service
+    """
+    return client_registry.client(service_name, region_name=region_name, endpoint_url=endpoint_url)
+
+
+def get_credentials():
+    """
+    Get the credentials of the shared boto3 clients
+    """
+    return client_registry.credentials()
@@ -0,0 +1,190 @@
+import logging
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from flaskr.api.helpers.latency_recorder import LatencyRecorder
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PERCENTILE = 95
+DEFAULT_MIN_SAMPLES = 20
+DEFAULT_WINDOW = 200
+DEFAULT_MAX_RATIO = 0.1
+DEFAULT_MAX_WORKERS = 64
+
+
+class _OperationHedging:
+    """
+    The recent latencies and the counters of an operation
+    """
+
+    def __init__(self, window):
+        self.latencies = LatencyRecorder(window=window)
+        self.calls = 0
+        self.fired = 0
+        self.won = 0
+        self.denied = 0
+
+
+class Hedger:
+    """
+    Send a duplicate of a slow call and keep the first response
+    A call that didn't return within the given percentile of the recent latencies of
+    its operation is sent again. The first successful response wins, the other call is
+    cancelled if it didn't start yet, otherwise its response is dropped.
+    At most max_ratio of the calls are hedged, and a hedge is only sent when may_hedge
+    allows it, so the duplicates stay within the rate limiter budget.
+    The latencies are recorded by the functions wrapped with timed(), so they only
+    measure the service call, not the waits for a token or the retry backoffs.
+    The hedging delay starts when the primary call starts, not while it waits for a
+    thread of the pool.
+    """
+
+    def __init__(self, percentile=DEFAULT_PERCENTILE, min_samples=DEFAULT_MIN_SAMPLES, window=DEFAULT_WINDOW,
+                 max_ratio=DEFAULT_MAX_RATIO, max_workers=DEFAULT_MAX_WORKERS):
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.window = window
+        self.max_ratio = max_ratio
+        self.max_workers = max_workers
+        self._operations = {}
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _operation(self, operation):
+        with self._lock:
+            hedging = self._operations.get(operation)
+
+            if hedging is None:
+                hedging = _OperationHedging(self.window)
+                self._operations[operation] = hedging
+
+            return hedging
+
+    def _get_executor(self):
+        # a forked child doesn't inherit the threads of the pool
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='hedge')
+                self._pid = os.getpid()
+
+            return self._executor
+
+    def delay(self, operation):
+        """
+        Get the number of seconds after which a call of the operation is hedged, None while too few calls are recorded
+        """
+        latencies = self._operation(operation).latencies
+
+        if latencies.count < self.min_samples:
+            return None
+
+        return latencies.percentile(self.percentile)
+
+    def timed(self, operation, function):
+        """
+        Wrap a service call so its latency is recorded when it succeeds
+        """
+        latencies = self._operation(operation).latencies
+
+        def timed_function(*args, **kwargs):
+            start = time.perf_counter()
+            response = function(*args, **kwargs)
+            latencies.record(time.perf_counter() - start)
+
+            return response
+
+        return timed_function
+
+    def call(self, operation, send, may_hedge=None):
+        """
+        Call send(hedge=False), and send(hedge=True) as well if it is too slow
+        Return the first successful response, or raise the error of the primary call when both fail
+        """
+        hedging = self._operation(operation)
+        with self._lock:
+            hedging.calls += 1
+        delay = self.delay(operation)
+
+        if delay is None:
+            return send(hedge=False)
+
+        started = threading.Event()
+
+        def send_primary():
+            started.set()
+            return send(hedge=False)
+
+        executor = self._get_executor()
+        primary = executor.submit(send_primary)
+        started.wait()
+        done, _ = wait([primary], timeout=delay)
+
+        if done:
+            return primary.result()
+
+        with self._lock:
+            within_ratio = hedging.fired < self.max_ratio * hedging.calls
+
+        # the budget is only taken once the ratio allows the hedge
+        if not within_ratio or (may_hedge is not None and not may_hedge()):
+            with self._lock:
+                hedging.denied += 1
+            return primary.result()
+
+        with self._lock:
+            hedging.fired += 1
+        logger.info("%s is slower than %.3f s, sending a hedge.", operation, delay)
+        hedge = executor.submit(send, hedge=True)
+
+        pending = {primary, hedge}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    for loser in pending:
+                        loser.cancel()
+                    if future is hedge:
+                        with self._lock:
+                            hedging.won += 1
+                    return future.result()
+
+        return primary.result()
+
+    def stats(self):
+        """
+        Get how often the hedges are sent and win for each operation
+        """
+        with self._lock:
+            operations = {operation: (hedging, hedging.calls, hedging.fired, hedging.won, hedging.denied)
+                          for operation, hedging in self._operations.items()}
+
+        def render(operation, hedging, calls, fired, won, denied):
+            delay = self.delay(operation)
+
+            return {
+                'calls': calls,
+                'fired': fired,
+                'won': won,
+                'denied': denied,
+                'delay_ms': round(delay * 1000, 3) if delay is not None else None,
+                'latency': hedging.latencies.summary(),
+            }
+
+        return {operation: render(operation, *counters) for operation, counters in sorted(operations.items())}
+
+
+def _hedger_from_env():
+    if os.getenv('REKOGNITION_HEDGING_ENABLED', '0') != '1':
+        return None
+
+    return Hedger(
+        percentile=float(os.getenv('REKOGNITION_HEDGING_PERCENTILE', DEFAULT_PERCENTILE)),
+        min_samples=int(os.getenv('REKOGNITION_HEDGING_MIN_SAMPLES', DEFAULT_MIN_SAMPLES)),
+        max_ratio=float(os.getenv('REKOGNITION_HEDGING_MAX_RATIO', DEFAULT_MAX_RATIO)))
+
+
+hedger = _hedger_from_env()
@@ -0,0 +1,170 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import requests
+from requests.adapters import HTTPAdapter
+
+DEFAULT_CONNECT_TIMEOUT = 3.05
+DEFAULT_READ_TIMEOUT = 10
+DEFAULT_TOTAL_TIMEOUT = 30
+# amazon rekognition analyses the images sent as bytes up to 5MB, larger ones are shrunk by the optimizer
+DEFAULT_MAX_BYTES = 15 * 1024 * 1024
+DEFAULT_POOL_SIZE = 32
+DEFAULT_CACHE_MAX_BYTES = 64 * 1024 * 1024
+DEFAULT_CHUNK_SIZE = 64 * 1024
+
+
+class ImageTooLarge(Exception):
+    pass
+
+
+class ImageFetcher:
+    """
+    Fetch the remote images through a pooled keep-alive session
+    The images are read as a stream and refused once they exceed max_bytes, and a
+    download slower than the timeouts is abandoned. The images served with an ETag or
+    a Last-Modified date are kept in a small LRU cache, bounded by its total size, and
+    fetched again with a conditional GET : an unchanged image is not downloaded again.
+    """
+
+    def __init__(self, connect_timeout=DEFAULT_CONNECT_TIMEOUT, read_timeout=DEFAULT_READ_TIMEOUT,
+                 total_timeout=DEFAULT_TOTAL_TIMEOUT, max_bytes=DEFAULT_MAX_BYTES, pool_size=DEFAULT_POOL_SIZE,
+                 cache_max_bytes=DEFAULT_CACHE_MAX_BYTES, chunk_size=DEFAULT_CHUNK_SIZE):
+        self.timeout = (connect_timeout, read_timeout)
+        self.total_timeout = total_timeout
+        self.max_bytes = max_bytes
+        self.pool_size = pool_size
+        self.cache_max_bytes = cache_max_bytes
+        self.chunk_size = chunk_size
+        self.requests = 0
+        self.not_modified = 0
+        self.too_large = 0
+        self.downloaded_bytes = 0
+        self._cache = OrderedDict()
+        self._cached_bytes = 0
+        self._lock = threading.Lock()
+        self._session = None
+        self._pid = None
+
+    def _get_session(self):
+        """
+        A forked child doesn't share the connections of its parent, so it opens its own pool
+        """
+        with self._lock:
+            if self._session is None or self._pid != os.getpid():
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=self.pool_size, pool_maxsize=self.pool_size)
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                self._session, self._pid = session, os.getpid()
+
+            return self._session
+
+    def fetch(self, url):
+        """
+        Fetch an image
+        Return a tuple of its bytes and of their SHA-256, raise ImageTooLarge when it is
+        larger than max_bytes and a requests exception when it can't be fetched
+        """
+        with self._lock:
+            self.requests += 1
+            cached = self._cache.get(url)
+
+        headers = {}
+        if cached is not None:
+            if cached['etag']:
+                headers['If-None-Match'] = cached['etag']
+            if cached['last_modified']:
+                headers['If-Modified-Since'] = cached['last_modified']
+
+        with self._get_session().get(url, headers=headers, stream=True, timeout=self.timeout) as response:
+            if response.status_code == 304 and cached is not None:
+                with self._lock:
+                    self.not_modified += 1
+                    if url in self._cache:
+                        self._cache.move_to_end(url)
+                return cached['data'], cached['digest']
+
+            response.raise_for_status()
+            data = self._read(response)
+
+        digest = hashlib.sha256(data).hexdigest()
+        etag, last_modified = response.headers.get('ETag'), response.headers.get('Last-Modified')
+        if etag or last_modified:
+            self._remember(url, {'etag': etag, 'last_modified': last_modified, 'data': data, 'digest': digest})
+        else:
+            self._forget(url)
+
+        return data, digest
+
+    def _read(self, response):
+        content_length = response.headers.get('Content-Length')
+        if content_length is not None and content_length.isdigit() and int(content_length) > self.max_bytes:
+            self._refuse()
+
+        deadline = time.monotonic() + self.total_timeout
+        data = bytearray()
+        for chunk in response.iter_content(self.chunk_size):
+            data += chunk
+            if len(data) > self.max_bytes:
+                self._refuse()
+            if time.monotonic() > deadline:
+                raise requests.Timeout('The image took more than %s seconds to download' % self.total_timeout)
+
+        with self._lock:
+            self.downloaded_bytes += len(data)
+
+        return bytes(data)
+
+    def _refuse(self):
+        with self._lock:
+            self.too_large += 1
+        raise ImageTooLarge('The image is larger than %s bytes' % self.max_bytes)
+
+    def _remember(self, url, entry):
+        size = len(entry['data'])
+        with self._lock:
+            self._forget_locked(url)
+            if size > self.cache_max_bytes:
+                return
+            self._cache[url] = entry
+            self._cached_bytes += size
+            while self._cached_bytes > self.cache_max_bytes:
+                _, evicted = self._cache.popitem(last=False)
+                self._cached_bytes -= len(evicted['data'])
+
+    def _forget(self, url):
+        with self._lock:
+            self._forget_locked(url)
+
+    def _forget_locked(self, url):
+        entry = self._cache.pop(url, None)
+        if entry is not None:
+            self._cached_bytes -= len(entry['data'])
+
+    def stats(self):
+        with self._lock:
+            return {
+                'requests': self.requests,
+                'not_modified': self.not_modified,
+                'too_large': self.too_large,
+                'downloaded_bytes': self.downloaded_bytes,
+                'cached_images': len(self._cache),
+                'cached_bytes': self._cached_bytes,
+            }
+
+
+def _fetcher_from_env():
+    return ImageFetcher(
+        connect_timeout=float(os.getenv('IMAGE_FETCH_CONNECT_TIMEOUT', DEFAULT_CONNECT_TIMEOUT)),
+        read_timeout=float(os.getenv('IMAGE_FETCH_READ_TIMEOUT', DEFAULT_READ_TIMEOUT)),
+        total_timeout=float(os.getenv('IMAGE_FETCH_TOTAL_TIMEOUT', DEFAULT_TOTAL_TIMEOUT)),
+        max_bytes=int(os.getenv('IMAGE_FETCH_MAX_BYTES', DEFAULT_MAX_BYTES)),
+        pool_size=int(os.getenv('IMAGE_FETCH_POOL_SIZE', DEFAULT_POOL_SIZE)),
+        cache_max_bytes=int(os.getenv('IMAGE_FETCH_CACHE_MAX_BYTES', DEFAULT_CACHE_MAX_BYTES)))
+
+
+image_fetcher = _fetcher_from_env()
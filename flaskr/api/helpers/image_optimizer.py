@@ -0,0 +1,128 @@
+import io
+import logging
+import os
+import threading
+import time
+
+from PIL import Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_DIMENSION = 1920
+DEFAULT_JPEG_QUALITY = 85
+
+
+class ImageOptimizer:
+    """
+    Shrink the images before sending them to rekognition
+    Large images are downscaled (using the JPEG draft mode to decode them at a lower
+    resolution), heavy formats are transcoded to JPEG and the metadata are stripped.
+    Rekognition bounding boxes are ratios of the image size, so they stay valid on
+    the original image. The EXIF orientation is applied before the metadata are
+    stripped so the boxes match the image as it is displayed.
+    """
+
+    def __init__(self, max_dimension=DEFAULT_MAX_DIMENSION, jpeg_quality=DEFAULT_JPEG_QUALITY):
+        self.max_dimension = max_dimension
+        self.jpeg_quality = jpeg_quality
+        self.images = 0
+        self.optimized = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.cpu_time = 0.0
+        self._lock = threading.Lock()
+
+    def optimize(self, image_bytes):
+        """
+        Optimize an image
+        Return a tuple of the bytes to send to rekognition and of the optimization stats
+        """
+        cpu_start = time.thread_time()
+        optimized_bytes = image_bytes
+
+        try:
+            optimized_bytes = self._optimize(image_bytes)
+        except (OSError, ValueError, Image.DecompressionBombError) as e:
+            # an image too large to decode safely is left to rekognition, which refuses it
+            logger.warning("Couldn't optimize the image, the original is used : %s", e)
+
+        cpu_time = time.thread_time() - cpu_start
+        stats = {
+            'original_bytes': len(image_bytes),
+            'optimized_bytes': len(optimized_bytes),
+            'saved_bytes': len(image_bytes) - len(optimized_bytes),
+            'cpu_time_ms': round(cpu_time * 1000, 3),
+        }
+
+        with self._lock:
+            self.images += 1
+            self.optimized += optimized_bytes is not image_bytes
+            self.bytes_in += len(image_bytes)
+            self.bytes_out += len(optimized_bytes)
+            self.cpu_time += cpu_time
+
+        logger.info("Image optimized : %s", stats)
+
+        return optimized_bytes, stats
+
+    def _optimize(self, image_bytes):
+        image = Image.open(io.BytesIO(image_bytes))
+        original_format = image.format
+        has_metadata = bool(image.info.get('exif') or image.info.get('icc_profile') or image.info.get('xmp'))
+        too_large = max(image.size) > self.max_dimension
+
+        if original_format == 'JPEG' and not too_large and not has_metadata:
+            return image_bytes
+
+        if original_format == 'JPEG' and too_large:
+            # decode at the smallest power of two scale still larger than the target
+            image.draft('RGB', (self.max_dimension, self.max_dimension))
+
+        image = ImageOps.exif_transpose(image)
+
+        if max(image.size) > self.max_dimension:
+            image.thumbnail((self.max_dimension, self.max_dimension), Image.LANCZOS)
+
+        if image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info):
+            image = image.convert('RGBA')
+            background = Image.new('RGB', image.size, (255, 255, 255))
+            background.paste(image, mask=image.getchannel('A'))
+            image = background
+        elif image.mode != 'RGB':
+            image = image.convert('RGB')
+
+        output = io.BytesIO()
+        image.save(output, format='JPEG', quality=self.jpeg_quality, optimize=True)
+        optimized_bytes = output.getvalue()
+
+        # a small image can grow when it is transcoded, the original is kept then
+        if len(optimized_bytes) >= len(image_bytes) and not too_large:
+            return image_bytes
+
+        return optimized_bytes
+
+    def stats(self):
+        """
+        Get the counters of the optimized images
+        """
+        with self._lock:
+            return {
+                'images': self.images,
+                'optimized': self.optimized,
+                'bytes_in': self.bytes_in,
+                'bytes_out': self.bytes_out,
+                'saved_bytes': self.bytes_in - self.bytes_out,
+                'cpu_time_ms': round(self.cpu_time * 1000, 3),
+            }
+
+
+def _optimizer_from_env():
+    if os.getenv('IMAGE_OPTIMIZER_ENABLED', '1') == '0':
+        return None
+
+    return ImageOptimizer(
+        max_dimension=int(os.getenv('IMAGE_MAX_DIMENSION', DEFAULT_MAX_DIMENSION)),
+        jpeg_quality=int(os.getenv('IMAGE_JPEG_QUALITY', DEFAULT_JPEG_QUALITY)))
+
+
+image_optimizer = _optimizer_from_env()
@@ -0,0 +1,60 @@
+import math
+import threading
+from collections import deque
+
+
+class LatencyRecorder:
+    """
+    Record durations and compute their percentiles
+    Only the last window durations are kept when a window is given
+    """
+
+    def __init__(self, window=None):
+        self.count = 0
+        self._durations = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, duration):
+        """
+        Record a duration in seconds
+        """
+        with self._lock:
+            self.count += 1
+            self._durations.append(duration)
+
+    def percentile(self, percent):
+        """
+        Get the percentile of the recorded durations using the nearest rank, None if nothing is recorded
+        """
+        return _nearest_rank(self._sorted(), percent)
+
+    def summary(self):
+        """
+        Get the usual percentiles in milliseconds, the durations are sorted once
+        """
+        durations = self._sorted()
+
+        def milliseconds(percent):
+            duration = _nearest_rank(durations, percent)
+            return round(duration * 1000, 3) if duration is not None else None
+
+        return {
+            'count': self.count,
+            'p50_ms': milliseconds(50),
+            'p90_ms': milliseconds(90),
+            'p99_ms': milliseconds(99),
+            'max_ms': milliseconds(100),
+        }
+
+    def _sorted(self):
+        with self._lock:
+            return sorted(self._durations)
+
+
+def _nearest_rank(durations, percent):
+    if not durations:
+        return None
+
+    rank = max(1, math.ceil(percent / 100 * len(durations)))
+
+    return durations[rank - 1]
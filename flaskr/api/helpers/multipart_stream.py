@@ -0,0 +1,200 @@
+import hashlib
+
+from werkzeug.sansio.multipart import Data, Epilogue, Field, File, MultipartDecoder, NeedData
+
+DEFAULT_CHUNK_SIZE = 64 * 1024
+
+
+class MultipartFileReader:
+    """
+    Read the file of a multipart/form-data body while it is received
+    The body is parsed from the raw request stream, so the file is neither buffered in
+    memory nor spooled to a temporary file. The form fields sent before the file are
+    available in fields once the file is opened. With no file_field, every file of the
+    body is read in turn : open moves to the next file once the current one is read.
+    """
+
+    def __init__(self, stream, boundary, file_field='file', chunk_size=DEFAULT_CHUNK_SIZE):
+        self.file_field = file_field
+        self.chunk_size = chunk_size
+        self.filename = None
+        self.fields = {}
+        self._stream = stream
+        self._decoder = MultipartDecoder(boundary.encode() if isinstance(boundary, str) else boundary)
+        self._exhausted = False
+        self._buffer = bytearray()
+        self._file_done = False
+
+    @classmethod
+    def from_request(cls, request, file_field='file'):
+        """
+        Create a reader of the body of a flask request, None when it is not a multipart/form-data request
+        The request form and files must not be accessed, they would consume the stream
+        """
+        boundary = request.mimetype_params.get('boundary')
+
+        if request.mimetype != 'multipart/form-data' or not boundary:
+            return None
+
+        return cls(request.stream, boundary, file_field)
+
+    def _next_event(self):
+        while True:
+            event = self._decoder.next_event()
+
+            if not isinstance(event, NeedData):
+                return event
+
+            if self._exhausted:
+                raise ValueError('The multipart body is truncated')
+
+            chunk = self._stream.read(self.chunk_size)
+
+            if chunk:
+                self._decoder.receive_data(chunk)
+            else:
+                self._exhausted = True
+                self._decoder.receive_data(None)
+
+    def open(self):
+        """
+        Parse the body up to the start of the file
+        Return False when the body has no file
+        """
+        field_name = None
+        value = bytearray()
+        self._buffer = bytearray()
+        self._file_done = False
+
+        while True:
+            event = self._next_event()
+
+            if isinstance(event, Epilogue):
+                return False
+
+            if isinstance(event, File) and self.file_field in (None, event.name):
+                self.filename = event.filename
+
+                return True
+
+            if isinstance(event, (Field, File)):
+                field_name = event.name if isinstance(event, Field) else None
+                value = bytearray()
+            elif isinstance(event, Data) and field_name is not None:
+                value += event.data
+                if not event.more_data:
+                    self.fields[field_name] = value.decode()
+
+    def read(self, size=-1):
+        """
+        Read at most size bytes of the file, everything left when size is negative
+        """
+        while not self._file_done and (size < 0 or len(self._buffer) < size):
+            event = self._next_event()
+
+            if not isinstance(event, Data):
+                raise ValueError('The file part ended unexpectedly')
+
+            self._buffer += event.data
+            self._file_done = not event.more_data
+
+        if size < 0:
+            size = len(self._buffer)
+
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+
+        return data
+
+    def iter_files(self, max_size=None):
+        """
+        Read the files of the body one after the other
+        Yield (filename, bytes) pairs, the bytes are None for a file larger than max_size,
+        which is skipped without being kept in memory
+        """
+        while self.open():
+            data = self.read(max_size + 1 if max_size else -1)
+
+            if max_size and len(data) > max_size:
+                while self.read(self.chunk_size):
+                    pass
+                data = None
+
+            yield self.filename, data
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return False
+
+
+class PrefixedReader:
+    """
+    Wrap a file object to read bytes already read from it before the rest of it
+    """
+
+    def __init__(self, prefix, fileobj):
+        self._prefix = memoryview(prefix)
+        self._fileobj = fileobj
+
+    def read(self, size=-1):
+        if not self._prefix:
+            return self._fileobj.read(size)
+
+        if size is None or size < 0:
+            data = bytes(self._prefix) + self._fileobj.read()
+            self._prefix = memoryview(b'')
+            return data
+
+        data = bytes(self._prefix[:size])
+        self._prefix = self._prefix[size:]
+        return data
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return False
+
+
+def read_up_to(fileobj, size):
+    """
+    Read size bytes from a file object, fewer only when it ends first
+    """
+    data = bytearray()
+
+    while len(data) < size:
+        chunk = fileobj.read(size - len(data))
+        if not chunk:
+            break
+        data += chunk
+
+    return bytes(data)
+
+
+class HashingReader:
+    """
+    Wrap a file object to compute the SHA-256 and the size of the bytes read from it
+    """
+
+    def __init__(self, fileobj):
+        self.size = 0
+        self._fileobj = fileobj
+        self._sha256 = hashlib.sha256()
+
+    def read(self, size=-1):
+        data = self._fileobj.read(size)
+        self._sha256.update(data)
+        self.size += len(data)
+
+        return data
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return False
+
+    def hexdigest(self):
+        return self._sha256.hexdigest()
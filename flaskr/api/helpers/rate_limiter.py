@@ -0,0 +1,374 @@
+import logging
+import os
+import random
+import threading
+import time
+
+from botocore.exceptions import ClientError, ConnectionError as BotocoreConnectionError, HTTPClientError
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_RATE = 50.0
+DEFAULT_MIN_RATE = 0.5
+DEFAULT_MAX_ATTEMPTS = 4
+DEFAULT_BASE_DELAY = 0.1
+DEFAULT_MAX_DELAY = 5.0
+DEFAULT_ACQUIRE_TIMEOUT = 30.0
+DEFAULT_FAILURE_THRESHOLD = 5
+DEFAULT_RESET_TIMEOUT = 30.0
+
+THROTTLING_CODES = ('ProvisionedThroughputExceededException', 'ThrottlingException')
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class RateLimitExceeded(Exception):
+    """
+    Raised when a call is refused because its circuit is open or no token was available in time
+    """
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def is_throttling(error):
+    return isinstance(error, ClientError) and error.response.get('Error', {}).get('Code') in THROTTLING_CODES
+
+
+def is_retryable(error):
+    """
+    Throttling, server side and connection errors are worth retrying, the errors of the request are not
+    """
+    if isinstance(error, (BotocoreConnectionError, HTTPClientError)):
+        return True
+
+    if not isinstance(error, ClientError):
+        return False
+
+    return is_throttling(error) or error.response.get('ResponseMetadata', {}).get('HTTPStatusCode', 0) >= 500
+
+
+class TokenBucket:
+    """
+    Token bucket whose rate adapts to the throttling of the service (AIMD)
+    The rate decreases multiplicatively when a call is throttled and increases
+    additively, by about increase tokens per second every second, while calls succeed.
+    """
+
+    def __init__(self, rate, min_rate=DEFAULT_MIN_RATE, increase=1.0, decrease=0.5):
+        self.max_rate = float(rate)
+        self.min_rate = min(float(min_rate), self.max_rate)
+        self.increase = increase
+        self.decrease = decrease
+        self.rate = self.max_rate
+        self.waiting = 0
+        self._tokens = self.max_rate
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, timeout=None):
+        """
+        Take a token, waiting for it at most timeout seconds
+        Return False when no token was available in time
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        with self._lock:
+            self.waiting += 1
+
+        try:
+            while True:
+                with self._lock:
+                    now = time.monotonic()
+                    # the burst is one second of calls, and at least one call
+                    self._tokens = min(max(self.rate, 1.0), self._tokens + (now - self._updated_at) * self.rate)
+                    self._updated_at = now
+
+                    if self._tokens >= 1:
+                        self._tokens -= 1
+                        return True
+
+                    wait = (1 - self._tokens) / self.rate
+
+                if deadline is not None:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return False
+                    wait = min(wait, remaining)
+
+                # a little jitter so the waiting threads don't all wake up together
+                time.sleep(wait * random.uniform(1.0, 1.2))
+        finally:
+            with self._lock:
+                self.waiting -= 1
+
+    def on_success(self):
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.increase / self.rate)
+
+    def on_throttled(self):
+        with self._lock:
+            self.rate = max(self.min_rate, self.rate * self.decrease)
+            self._tokens = min(self._tokens, 0.0)
+
+
+class CircuitBreaker:
+    """
+    Stop calling a failing service for a while
+    The circuit opens after failure_threshold consecutive failures, then lets one
+    trial call through after reset_timeout seconds : the circuit closes again when
+    it succeeds and stays open when it fails.
+    """
+
+    def __init__(self, failure_threshold=DEFAULT_FAILURE_THRESHOLD, reset_timeout=DEFAULT_RESET_TIMEOUT):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.failures = 0
+        self.opened = 0
+        self._opened_at = 0.0
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """
+        Return 0 when a call may run, otherwise the number of seconds before the next trial
+        """
+        with self._lock:
+            if self.state == CLOSED:
+                return 0
+
+            retry_after = self._opened_at + self.reset_timeout - time.monotonic()
+            if self.state == OPEN and retry_after <= 0:
+                self.state = HALF_OPEN
+
+            if self.state == HALF_OPEN and not self._trial_running:
+                self._trial_running = True
+                return 0
+
+            return max(retry_after, 1.0)
+
+    def release(self):
+        """
+        Give back the trial allowed by allow() when the call didn't run
+        """
+        with self._lock:
+            self._trial_running = False
+
+    def on_success(self):
+        with self._lock:
+            self.state = CLOSED
+            self.failures = 0
+            self._trial_running = False
+
+    def on_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._trial_running = False
+
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != OPEN:
+                    self.opened += 1
+                self.state = OPEN
+                self._opened_at = time.monotonic()
+
+
+class _OperationLimiter:
+    """
+    The bucket, the circuit and the counters of an operation
+    """
+
+    def __init__(self, rate, failure_threshold, reset_timeout):
+        self.bucket = TokenBucket(rate)
+        self.circuit = CircuitBreaker(failure_threshold, reset_timeout)
+        self.calls = 0
+        self.throttled = 0
+        self.retries = 0
+        self.failures = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+
+    def count(self, counter):
+        """
+        Increment a counter, the same operation is called from several threads
+        """
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def to_dict(self):
+        with self._lock:
+            counters = {
+                'calls': self.calls,
+                'throttled': self.throttled,
+                'retries': self.retries,
+                'failures': self.failures,
+                'rejected': self.rejected,
+            }
+        return {
+            'rate': round(self.bucket.rate, 3),
+            'max_rate': self.bucket.max_rate,
+            'queued': self.bucket.waiting,
+            **counters,
+            'circuit': self.circuit.state,
+        }
+
+
+class AdaptiveRateLimiter:
+    """
+    Shared rate limiter of the calls to a service
+    Each operation has its own token bucket, so the operations with different quotas
+    don't slow each other, and its own circuit breaker. The throttled and server side
+    errors are retried with a jittered exponential backoff.
+    An operation sent to a region is written operation@region, see region_operation :
+    it gets its own bucket and circuit, with the rate of the operation.
+    """
+
+    def __init__(self, default_rate=DEFAULT_RATE, rates=None, max_attempts=DEFAULT_MAX_ATTEMPTS,
+                 base_delay=DEFAULT_BASE_DELAY, max_delay=DEFAULT_MAX_DELAY, acquire_timeout=DEFAULT_ACQUIRE_TIMEOUT,
+                 failure_threshold=DEFAULT_FAILURE_THRESHOLD, reset_timeout=DEFAULT_RESET_TIMEOUT):
+        self.default_rate = default_rate
+        self.rates = dict(rates or {})
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.acquire_timeout = acquire_timeout
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._operations = {}
+        self._lock = threading.Lock()
+
+    def _operation(self, operation):
+        with self._lock:
+            limiter = self._operations.get(operation)
+
+            if limiter is None:
+                limiter = _OperationLimiter(self.rates.get(operation.partition('@')[0], self.default_rate),
+                                            self.failure_threshold, self.reset_timeout)
+                self._operations[operation] = limiter
+
+            return limiter
+
+    def acquire(self, operation):
+        """
+        Wait for the permission to call an operation once
+        Raise RateLimitExceeded when its circuit is open or no token was available in time
+        """
+        limiter = self._operation(operation)
+
+        retry_after = limiter.circuit.allow()
+        if retry_after:
+            limiter.count('rejected')
+            raise RateLimitExceeded("The calls to %s are suspended after repeated failures" % operation,
+                                    int(retry_after + 0.999))
+
+        if not limiter.bucket.acquire(self.acquire_timeout):
+            # the trial of a half open circuit didn't run, the next call may try it
+            limiter.circuit.release()
+            limiter.count('rejected')
+            raise RateLimitExceeded("Too many calls to %s are waiting" % operation,
+                                    int(limiter.bucket.waiting / limiter.bucket.rate + 1))
+
+    def try_acquire(self, operation):
+        """
+        Take a token of an operation only if one is available right away and its circuit is closed
+        """
+        limiter = self._operation(operation)
+
+        return limiter.circuit.state == CLOSED and limiter.bucket.acquire(timeout=0)
+
+    def record(self, operation, error=None):
+        """
+        Adapt the rate and the circuit of an operation to the outcome of a call
+        """
+        limiter = self._operation(operation)
+
+        if error is None:
+            limiter.bucket.on_success()
+            limiter.circuit.on_success()
+        elif is_throttling(error):
+            limiter.count('throttled')
+            limiter.bucket.on_throttled()
+        elif not is_retryable(error):
+            # the service answered, the request itself was wrong
+            limiter.circuit.on_success()
+
+    def call(self, operation, function, *args, **kwargs):
+        """
+        Call the function within the limits of the operation, retrying the throttled and server side errors
+        """
+        limiter = self._operation(operation)
+        limiter.count('calls')
+
+        for attempt in range(self.max_attempts):
+            self.acquire(operation)
+
+            try:
+                result = function(*args, **kwargs)
+            except Exception as error:
+                self.record(operation, error)
+
+                if not is_retryable(error):
+                    raise
+
+                # a failed trial call opens the circuit again without retrying
+                if attempt + 1 == self.max_attempts or limiter.circuit.state == HALF_OPEN:
+                    limiter.count('failures')
+                    limiter.circuit.on_failure()
+                    raise
+
+                limiter.count('retries')
+                delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+                logger.warning("%s failed with %s, retry %s in %.3f s.", operation, error, attempt + 1, delay)
+                time.sleep(delay)
+            else:
+                self.record(operation)
+
+                return result
+
+    def stats(self):
+        """
+        Get the live rate, the queue depth and the counters of each operation
+        """
+        with self._lock:
+            operations = dict(self._operations)
+
+        return {operation: limiter.to_dict() for operation, limiter in sorted(operations.items())}
+
+
+def region_operation(operation, region_name):
+    """
+    Name an operation sent to a region, so each region is limited on its own
+    """
+    return '%s@%s' % (operation, region_name)
+
+
+def parse_rates(value):
+    """
+    Parse the rates of the operations written as : operation=rate,operation=rate
+    """
+    rates = {}
+
+    for item in filter(None, (item.strip() for item in (value or '').split(','))):
+        operation, _, rate = item.partition('=')
+        rates[operation.strip()] = float(rate)
+
+    return rates
+
+
+def _limiter_from_env():
+    if os.getenv('REKOGNITION_RATE_LIMITER_ENABLED', '1') == '0':
+        return None
+
+    return AdaptiveRateLimiter(
+        default_rate=float(os.getenv('REKOGNITION_RATE_LIMIT', DEFAULT_RATE)),
+        rates=parse_rates(os.getenv('REKOGNITION_RATE_LIMITS')),
+        max_attempts=int(os.getenv('REKOGNITION_MAX_ATTEMPTS', DEFAULT_MAX_ATTEMPTS)),
+        acquire_timeout=float(os.getenv('REKOGNITION_ACQUIRE_TIMEOUT', DEFAULT_ACQUIRE_TIMEOUT)),
+        failure_threshold=int(os.getenv('REKOGNITION_CIRCUIT_FAILURES', DEFAULT_FAILURE_THRESHOLD)),
+        reset_timeout=float(os.getenv('REKOGNITION_CIRCUIT_RESET_TIMEOUT', DEFAULT_RESET_TIMEOUT)))
+
+
+rate_limiter = _limiter_from_env()
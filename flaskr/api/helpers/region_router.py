@@ -0,0 +1,292 @@
+import functools
+import logging
+import os
+import threading
+import time
+
+from flaskr.api.helpers.aws_client_registry import get_client
+from flaskr.api.helpers.rate_limiter import RateLimitExceeded, is_retryable, is_throttling, rate_limiter, region_operation
+
+logger = logging.getLogger(__name__)
+
+LEAST_OUTSTANDING = 'least_outstanding'
+WEIGHTED_ROUND_ROBIN = 'weighted_round_robin'
+STRATEGIES = (LEAST_OUTSTANDING, WEIGHTED_ROUND_ROBIN)
+
+DEFAULT_FAILURE_THRESHOLD = 3
+DEFAULT_COOLDOWN = 30.0
+
+# A bucket whose region couldn't be found is looked up again after this number of seconds
+BUCKET_REGION_RETRY_INTERVAL = 60.0
+
+
+class Region:
+    """
+    A region the calls are spread to, with its health and its counters
+    """
+
+    def __init__(self, name, weight=1.0, endpoint_url=None):
+        self.name = name
+        self.weight = float(weight)
+        self.endpoint_url = endpoint_url
+        self.outstanding = 0
+        self.calls = 0
+        self.errors = 0
+        self.throttled = 0
+        self.consecutive_failures = 0
+        self.unhealthy_until = 0.0
+        self.current_weight = 0.0
+
+    def healthy(self, now):
+        return self.unhealthy_until <= now
+
+    def to_dict(self, now):
+        return {
+            'weight': self.weight,
+            'endpoint_url': self.endpoint_url,
+            'healthy': self.healthy(now),
+            'outstanding': self.outstanding,
+            'calls': self.calls,
+            'errors': self.errors,
+            'throttled': self.throttled,
+        }
+
+
+def parse_regions(value):
+    """
+    Parse the regions written as : region=weight@endpoint_url,region
+    The weight and the endpoint url are optional
+    """
+    regions = []
+
+    for item in filter(None, (item.strip() for item in (value or '').split(','))):
+        item, _, endpoint_url = item.partition('@')
+        name, _, weight = item.partition('=')
+        regions.append(Region(name.strip(), float(weight) if weight else 1.0, endpoint_url or None))
+
+    return regions
+
+
+def s3_bucket_region(bucket_name):
+    """
+    Get the region of a bucket, the buckets of us-east-1 have no location constraint
+    """
+    location = get_client('s3').get_bucket_location(Bucket=bucket_name).get('LocationConstraint')
+
+    return {None: 'us-east-1', '': 'us-east-1', 'EU': 'eu-west-1'}.get(location, location)
+
+
+class RegionRouter:
+    """
+    Client spreading the calls of a service over several regions
+    It is used like a boto3 client : each operation is sent to the region with the
+    least outstanding calls for its weight, or picked by weighted round robin.
+    A call that is throttled or fails on the service side is sent to the next region.
+    A region failing failure_threshold times in a row is left out for cooldown seconds.
+    Rekognition only reads the images stored in Amazon S3 from a bucket of its own
+    region, so they are always analysed in the region of their bucket, even when it
+    is not one of the regions, and never failed over : their throttled calls are
+    retried by the rate limiter instead.
+    The calls are paced by rate_limiter in each region, as each region has its own
+    quota : a call whose region has no token left in time is sent to the next one.
+    """
+
+    def __init__(self, service_name, regions, strategy=LEAST_OUTSTANDING, client_factory=None,
+                 bucket_region=s3_bucket_region, failure_threshold=DEFAULT_FAILURE_THRESHOLD,
+                 cooldown=DEFAULT_COOLDOWN, rate_limiter=None):
+        if not regions:
+            raise ValueError("At least one region is needed")
+        if strategy not in STRATEGIES:
+            raise ValueError("Unknown strategy %s, use one of : %s" % (strategy, ', '.join(STRATEGIES)))
+
+        self.service_name = service_name
+        self.regions = list(regions)
+        self.strategy = strategy
+        self.client_factory = client_factory or functools.partial(get_client, service_name)
+        self.bucket_region = bucket_region
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.rate_limiter = rate_limiter
+        self.failovers = 0
+        self._bucket_regions = {}
+        self._outside_regions = {}
+        self._lock = threading.Lock()
+
+    def __getattr__(self, operation):
+        if operation.startswith('_'):
+            raise AttributeError(operation)
+
+        return functools.partial(self.call, operation)
+
+    def client(self, region):
+        return self.client_factory(region_name=region.name, endpoint_url=region.endpoint_url)
+
+    def _bucket_region_of(self, s3_object):
+        bucket_name = s3_object['Bucket']
+        region_name, expires_at = self._bucket_regions.get(bucket_name, (None, 0.0))
+        if expires_at > time.monotonic():
+            return region_name
+
+        try:
+            self._bucket_regions[bucket_name] = (self.bucket_region(bucket_name), float('inf'))
+        except Exception:
+            # a failure is only remembered for a while, the bucket may just be unreachable for now
+            logger.warning("Couldn't get the region of the bucket %s.", bucket_name, exc_info=True)
+            self._bucket_regions[bucket_name] = (None, time.monotonic() + BUCKET_REGION_RETRY_INTERVAL)
+
+        return self._bucket_regions[bucket_name][0]
+
+    def _candidates(self, params):
+        """
+        Get the regions a call can be sent to, in the order they are tried
+        """
+        s3_object = params.get('Image', {}).get('S3Object')
+
+        if s3_object is None or self.bucket_region is None:
+            return self._order()
+
+        # an unknown bucket region falls back on the default region of the clients
+        region_name = self._bucket_region_of(s3_object)
+        with self._lock:
+            region = next((region for region in self.regions if region.name == region_name), None)
+            if region is None:
+                region = self._outside_regions.setdefault(region_name, Region(region_name))
+
+        return [region]
+
+    def _order(self):
+        """
+        Sort the regions in the order they are tried, the unhealthy ones last
+        """
+        now = time.monotonic()
+
+        with self._lock:
+            healthy = [region for region in self.regions if region.healthy(now)]
+
+            if self.strategy == WEIGHTED_ROUND_ROBIN and healthy:
+                # smooth weighted round robin, the picked region goes first
+                total = sum(region.weight for region in healthy)
+                for region in healthy:
+                    region.current_weight += region.weight
+                picked = max(healthy, key=lambda region: region.current_weight)
+                picked.current_weight -= total
+                healthy.sort(key=lambda region: (region is not picked, -region.weight))
+            else:
+                # the calls already sent break the ties, so an idle router still spreads them by weight
+                healthy.sort(key=lambda region: (region.outstanding / region.weight, region.calls / region.weight))
+
+            unhealthy = sorted((region for region in self.regions if not region.healthy(now)),
+                               key=lambda region: region.unhealthy_until)
+
+        return healthy + unhealthy
+
+    def call(self, operation, **params):
+        """
+        Send an operation to the best region, and to the next ones when it fails
+        """
+        error = None
+        candidates = self._candidates(params)
+
+        for attempt, region in enumerate(candidates):
+            if attempt:
+                logger.warning("%s failed in the previous region, failing over to %s.", operation, region.name)
+
+            with self._lock:
+                if attempt:
+                    self.failovers += 1
+                region.outstanding += 1
+                region.calls += 1
+
+            try:
+                response = self._send(region, operation, params, pinned=len(candidates) == 1)
+            except RateLimitExceeded as e:
+                # the region is busy or suspended, it is not a failure of the region
+                error = e
+            except Exception as e:
+                if not is_retryable(e):
+                    raise
+                error = e
+                self._on_failure(region, e)
+            else:
+                self._on_success(region)
+
+                return response
+            finally:
+                with self._lock:
+                    region.outstanding -= 1
+
+        raise error
+
+    def _send(self, region, operation, params, pinned):
+        """
+        Send an operation to a region through the rate limiter of the region
+        The calls pinned to a region are retried there, the others are failed over by call()
+        """
+        send = getattr(self.client(region), operation)
+        if self.rate_limiter is None:
+            return send(**params)
+
+        limited_operation = region_operation(operation, region.name)
+        if pinned:
+            return self.rate_limiter.call(limited_operation, send, **params)
+
+        self.rate_limiter.acquire(limited_operation)
+        try:
+            response = send(**params)
+        except Exception as e:
+            self.rate_limiter.record(limited_operation, e)
+            raise
+        self.rate_limiter.record(limited_operation)
+
+        return response
+
+    def _on_success(self, region):
+        with self._lock:
+            region.consecutive_failures = 0
+
+    def _on_failure(self, region, error):
+        with self._lock:
+            if is_throttling(error):
+                # a throttled region is healthy, it is only busy
+                region.throttled += 1
+                return
+
+            region.errors += 1
+            region.consecutive_failures += 1
+
+            if region.consecutive_failures >= self.failure_threshold:
+                logger.error("The region %s failed %s times in a row, it is left out for %s s.",
+                             region.name, region.consecutive_failures, self.cooldown)
+                region.unhealthy_until = time.monotonic() + self.cooldown
+                region.consecutive_failures = 0
+
+    def stats(self):
+        """
+        Get the health and the counters of each region
+        """
+        now = time.monotonic()
+
+        with self._lock:
+            return {
+                'strategy': self.strategy,
+                'failovers': self.failovers,
+                'regions': {region.name: region.to_dict(now) for region in self.regions},
+                'bucket_regions': {str(name): region.to_dict(now) for name, region in self._outside_regions.items()},
+            }
+
+
+def _router_from_env():
+    regions = parse_regions(os.getenv('REKOGNITION_REGIONS'))
+
+    if not regions:
+        return None
+
+    return RegionRouter(
+        'rekognition', regions,
+        strategy=os.getenv('REKOGNITION_ROUTING_STRATEGY', LEAST_OUTSTANDING),
+        failure_threshold=int(os.getenv('REKOGNITION_REGION_FAILURES', DEFAULT_FAILURE_THRESHOLD)),
+        cooldown=float(os.getenv('REKOGNITION_REGION_COOLDOWN', DEFAULT_COOLDOWN)),
+        rate_limiter=rate_limiter)
+
+
+region_router = _router_from_env()
@@ -0,0 +1,73 @@
+import threading
+
+
+class _Call:
+    """
+    A call in flight, shared by the callers waiting for its result
+    """
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Coalesce identical concurrent calls
+    The first caller of a key runs the function, the callers arriving while it is
+    running wait for it and get the same result or exception.
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.coalesced = 0
+        self._in_flight = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, function, *args, **kwargs):
+        """
+        Run the function once for all the concurrent callers of the key
+        """
+        with self._lock:
+            call = self._in_flight.get(key)
+            leader = call is None
+
+            if leader:
+                call = _Call()
+                self._in_flight[key] = call
+                self.calls += 1
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            call.done.wait()
+
+            if call.error is not None:
+                raise call.error
+
+            return call.result
+
+        try:
+            call.result = function(*args, **kwargs)
+
+            return call.result
+        except BaseException as error:
+            call.error = error
+            raise
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+
+            call.done.set()
+
+    def stats(self):
+        """
+        Get the counters of the calls run and coalesced
+        """
+        with self._lock:
+            return {
+                'calls': self.calls,
+                'coalesced': self.coalesced,
+                'in_flight': len(self._in_flight),
+            }
@@ -0,0 +1,59 @@
+import logging
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+
+class StageTimer:
+    """
+    Measure the duration of the stages of a request
+    The durations are reported with the Server-Timing header so the client can see
+    where the time of a request is spent
+    """
+
+    def __init__(self):
+        self.started_at = time.perf_counter()
+        self.durations = {}
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Measure the duration of the code run in the with block
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.durations[name] = time.perf_counter() - start
+
+    async def measure(self, name, awaitable):
+        """
+        Measure the time needed to await an awaitable, useful for stages running concurrently
+        """
+        with self.stage(name):
+            return await awaitable
+
+    def total(self):
+        """
+        Get the time elapsed since the timer creation in seconds
+        """
+        return time.perf_counter() - self.started_at
+
+    def to_dict(self):
+        """
+        Get the duration of each stage in milliseconds
+        """
+        durations = {name: round(duration * 1000, 3) for name, duration in self.durations.items()}
+        durations['total'] = round(self.total() * 1000, 3)
+
+        return durations
+
+    def server_timing(self):
+        """
+        Get the value of the Server-Timing header
+        """
+        return ', '.join('%s;dur=%s' % (name, duration) for name, duration in self.to_dict().items())
+
+    def log(self, request_name):
+        logger.info("%s timings (ms) : %s", request_name, self.to_dict())
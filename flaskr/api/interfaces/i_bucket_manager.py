@@ -2,12 +2,24 @@ from abc import ABC
 from flaskr.api.managers.aws_bucket_manager import AwsBucketManager
 
 class IBucketManager(ABC):
-    def __init__(self):
-        self.bucket_manager = AwsBucketManager()
+    def __init__(self, bucket_manager=None):
+        self.bucket_manager = bucket_manager if bucket_manager is not None else AwsBucketManager()
 
     async def upload_file(self, bucket_name, file):
         return await self.bucket_manager.upload_file(bucket_name, file)
 
+    async def upload_stream(self, bucket_name, object_name, fileobj):
+        return await self.bucket_manager.upload_stream(bucket_name, object_name, fileobj)
+
+    async def upload_bytes(self, bucket_name, object_name, data, digest=None):
+        return await self.bucket_manager.upload_bytes(bucket_name, object_name, data, digest)
+
+    async def upload_batch(self, bucket_name, files, concurrency=None):
+        return await self.bucket_manager.upload_batch(bucket_name, files, concurrency)
+
+    async def presigned_post(self, bucket_name, object_name, max_size=None):
+        return await self.bucket_manager.presigned_post(bucket_name, object_name, max_size)
+
     async def create_object(self, bucket_name=None, object_file_path=None):
         return await self.bucket_manager.create_object(bucket_name=bucket_name, object_file_path=object_file_path)
     
@@ -17,5 +29,17 @@ class IBucketManager(ABC):
     async def remove_object(self, bucket_name=None, object_name=None):
         return await self.bucket_manager.remove_object(bucket_name=bucket_name, object_name=object_name)
 
+    async def delete_objects(self, bucket_name, keys=None, prefixes=None, versions=True, progress=None):
+        return await self.bucket_manager.delete_objects(bucket_name, keys, prefixes, versions, progress)
+
+    def list_objects(self, bucket_name, prefix=''):
+        return self.bucket_manager.list_objects(bucket_name, prefix)
+
     async def download_object(self, bucket_name, object_name):
-        return await self.bucket_manager.download_object(bucket_name, object_name)
\ No newline at end of file
+        return await self.bucket_manager.download_object(bucket_name, object_name)
+
+    async def fetch_object(self, bucket_name, object_name):
+        return await self.bucket_manager.fetch_object(bucket_name, object_name)
+
+    async def get_object_stream(self, bucket_name, object_name, byte_range=None, if_none_match=None):
+        return await self.bucket_manager.get_object_stream(bucket_name, object_name, byte_range, if_none_match)
@@ -0,0 +1,311 @@
+"""
+Purpose
+
+Runs analyses in the background so the HTTP request returns as soon as the image
+is queued. The clients poll the status of their job or receive it on a webhook.
+The queue is bounded : when it is full, new jobs are refused instead of waiting.
+The webhooks are delivered by their own threads, so a slow callback url never holds
+a worker, and they are only posted to public addresses or to the allowed hosts.
+The workers are started by the first job of each process, so the app can be loaded
+before the server forks its workers.
+"""
+
+import ipaddress
+import logging
+import os
+import queue
+import socket
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+import requests
+
+from flaskr.api.helpers.latency_recorder import LatencyRecorder
+
+logger = logging.getLogger(__name__)
+
+QUEUED = 'queued'
+RUNNING = 'running'
+COMPLETED = 'completed'
+FAILED = 'failed'
+
+DEFAULT_WORKERS = 4
+DEFAULT_MAX_SIZE = 100
+DEFAULT_RESULT_TTL = 60 * 60
+DEFAULT_CALLBACK_WORKERS = 4
+CALLBACK_ATTEMPTS = 3
+CALLBACK_TIMEOUT = 10
+CALLBACK_SCHEMES = ('http', 'https')
+
+
+class AnalysisQueueFull(Exception):
+    """Raised when a job is submitted to a full queue."""
+
+    def __init__(self, retry_after):
+        super().__init__("The analysis queue is full, retry in %s seconds" % retry_after)
+        self.retry_after = retry_after
+
+
+class InvalidCallbackUrl(ValueError):
+    """Raised when a callback url is not allowed to receive the status of a job."""
+
+
+def check_callback_url(callback_url, allowed_hosts=None):
+    """
+    Checks that a callback url can be posted to, so the service can't be used to
+    reach the addresses of its own network, such as the instance metadata.
+
+    :param callback_url: The url to check.
+    :param allowed_hosts: The only hosts allowed, if any. Otherwise any host whose
+                          addresses are all public is allowed.
+    :raises InvalidCallbackUrl: When the url is not allowed.
+    """
+    parsed = urlsplit(callback_url)
+    if parsed.scheme not in CALLBACK_SCHEMES or not parsed.hostname:
+        raise InvalidCallbackUrl("The callback url must be an http or https url")
+
+    if allowed_hosts:
+        if parsed.hostname.lower() not in allowed_hosts:
+            raise InvalidCallbackUrl("The callback host %s is not allowed" % parsed.hostname)
+        return
+
+    try:
+        addresses = {info[4][0] for info in socket.getaddrinfo(parsed.hostname, parsed.port or 443,
+                                                                proto=socket.IPPROTO_TCP)}
+    except (socket.gaierror, UnicodeError, ValueError):
+        raise InvalidCallbackUrl("The callback host %s can't be resolved" % parsed.hostname)
+
+    for address in addresses:
+        address = ipaddress.ip_address(address.split('%')[0])
+        if not address.is_global or address.is_multicast:
+            raise InvalidCallbackUrl("The callback host %s is not a public address" % parsed.hostname)
+
+
+class AnalysisQueue:
+    """A bounded queue of analysis jobs processed by a pool of worker threads."""
+
+    def __init__(self, workers=DEFAULT_WORKERS, max_size=DEFAULT_MAX_SIZE, result_ttl=DEFAULT_RESULT_TTL,
+                 callback_workers=DEFAULT_CALLBACK_WORKERS, callback_hosts=None):
+        """
+        Initializes the queue, its workers are started with the first job.
+
+        :param workers: The number of jobs processed at the same time.
+        :param max_size: The maximum number of jobs waiting in the queue.
+        :param result_ttl: The number of seconds the status of a finished job is kept.
+        :param callback_workers: The number of callbacks delivered at the same time.
+        :param callback_hosts: The only hosts the callbacks can be posted to, if any.
+                               Otherwise the callbacks can only be posted to public
+                               addresses.
+        """
+        self.workers = workers
+        self.max_size = max_size
+        self.result_ttl = result_ttl
+        self.callback_hosts = {host.lower() for host in callback_hosts or ()}
+        self.submitted = 0
+        self.rejected = 0
+        self.callbacks_pending = 0
+        self.callbacks_failed = 0
+        self.durations = LatencyRecorder(window=100)
+        self._queue = queue.Queue(maxsize=max_size)
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._session = requests.Session()
+        self._callback_workers = callback_workers
+        self._callbacks = None
+        self._threads = []
+        self._pid = None
+        self._stopped = False
+
+    def submit(self, function, callback_url=None):
+        """
+        Queues a job.
+
+        :param function: The function run by the job, its return value is the
+                         result of the job and must be json serializable.
+        :param callback_url: The url receiving the status of the job with a POST
+                             request when it is finished, if any.
+        :return: The id of the job.
+        :raises AnalysisQueueFull: When the queue is full.
+        :raises InvalidCallbackUrl: When the callback url is not allowed.
+        :raises RuntimeError: When the queue is stopped.
+        """
+        if callback_url:
+            check_callback_url(callback_url, self.callback_hosts)
+
+        self._start()
+
+        self._expire()
+        job = {
+            'id': uuid.uuid4().hex,
+            'status': QUEUED,
+            'result': None,
+            'error': None,
+            'created_at': time.time(),
+            'finished_at': None,
+        }
+
+        with self._lock:
+            try:
+                self._queue.put_nowait((job['id'], function, callback_url))
+            except queue.Full:
+                self.rejected += 1
+                raise AnalysisQueueFull(self.retry_after())
+            self._jobs[job['id']] = job
+            self.submitted += 1
+
+        return job['id']
+
+    def stop(self, timeout=5):
+        """
+        Stops the workers once their running job is finished, the queued jobs fail.
+
+        :param timeout: The number of seconds to wait for each worker.
+        """
+        with self._lock:
+            self._stopped = True
+            threads = self._threads if self._pid == os.getpid() else []
+            self._threads = []
+
+        while True:
+            try:
+                job_id, _, _ = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            self._update(job_id, status=FAILED, error='The analysis queue was stopped', finished_at=time.time())
+
+        for thread in threads:
+            try:
+                self._queue.put(None, timeout=timeout)
+            except queue.Full:
+                break
+        for thread in threads:
+            thread.join(timeout)
+
+        if self._callbacks is not None:
+            self._callbacks.shutdown(wait=False)
+
+    def status(self, job_id):
+        """
+        Gets the status of a job.
+
+        :return: A copy of the job, None when it doesn't exist or has expired.
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job is not None else None
+
+    def retry_after(self):
+        """
+        Estimates the number of seconds before the queue has room again.
+        """
+        duration = self.durations.percentile(50) or 1.0
+        return max(1, int(duration * self._queue.qsize() / self.workers + 0.999))
+
+    def stats(self):
+        with self._lock:
+            running = sum(job['status'] == RUNNING for job in self._jobs.values())
+        return {
+            'workers': self.workers,
+            'max_size': self.max_size,
+            'queued': self._queue.qsize(),
+            'running': running,
+            'submitted': self.submitted,
+            'rejected': self.rejected,
+            'callbacks_pending': self.callbacks_pending,
+            'callbacks_failed': self.callbacks_failed,
+            'duration': self.durations.summary(),
+        }
+
+    def _start(self):
+        """
+        Starts the workers in the current process, a forked child doesn't run the threads of its parent
+        """
+        if self._stopped:
+            raise RuntimeError('The analysis queue is stopped')
+        if self._pid == os.getpid():
+            return
+
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            if self._pid is not None:
+                # the jobs queued in the parent are run by the parent
+                self._queue = queue.Queue(maxsize=self.max_size)
+                self._session = requests.Session()
+
+            self._callbacks = ThreadPoolExecutor(max_workers=self._callback_workers,
+                                                 thread_name_prefix='analysis-callback')
+            self._threads = [threading.Thread(target=self._work, name='analysis-worker-%s' % index, daemon=True)
+                             for index in range(self.workers)]
+            for thread in self._threads:
+                thread.start()
+            self._pid = os.getpid()
+
+    def _work(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            job_id, function, callback_url = item
+            self._update(job_id, status=RUNNING)
+            start = time.perf_counter()
+
+            try:
+                self._update(job_id, status=COMPLETED, result=function())
+            except Exception as e:
+                logger.exception("Analysis job %s failed.", job_id)
+                self._update(job_id, status=FAILED, error=str(e))
+
+            self.durations.record(time.perf_counter() - start)
+            self._update(job_id, finished_at=time.time())
+
+            if callback_url:
+                with self._lock:
+                    self.callbacks_pending += 1
+                self._callbacks.submit(self._callback, callback_url, self.status(job_id))
+
+    def _update(self, job_id, **changes):
+        with self._lock:
+            if job_id in self._jobs:
+                self._jobs[job_id].update(changes)
+
+    def _callback(self, callback_url, job):
+        try:
+            if self._deliver(callback_url, job):
+                return
+        finally:
+            with self._lock:
+                self.callbacks_pending -= 1
+
+        with self._lock:
+            self.callbacks_failed += 1
+        logger.error("Gave up the callback of job %s to %s.", job['id'], callback_url)
+
+    def _deliver(self, callback_url, job):
+        for attempt in range(CALLBACK_ATTEMPTS):
+            try:
+                # the host is checked again, its addresses may have changed since the job was submitted
+                check_callback_url(callback_url, self.callback_hosts)
+                response = self._session.post(callback_url, json=job, timeout=CALLBACK_TIMEOUT,
+                                              allow_redirects=False)
+                if response.status_code < 500:
+                    return True
+            except InvalidCallbackUrl as e:
+                logger.warning("Callback of job %s refused : %s", job['id'], e)
+                return False
+            except requests.RequestException as e:
+                logger.warning("Callback of job %s to %s failed : %s", job['id'], callback_url, e)
+            time.sleep(2 ** attempt)
+
+        return False
+
+    def _expire(self):
+        expired_before = time.time() - self.result_ttl
+        with self._lock:
+            for job_id in [job_id for job_id, job in self._jobs.items()
+                           if job['finished_at'] is not None and job['finished_at'] < expired_before]:
+                del self._jobs[job_id]
+
@@ -1,31 +1,250 @@
-import boto3
+import asyncio
+import hashlib
+import logging
 import os
+import tempfile
+import time
+import uuid
+from datetime import datetime
 
+from boto3.s3.transfer import TransferConfig
+from botocore.credentials import RefreshableCredentials
+from botocore.exceptions import BotoCoreError, ClientError
 from werkzeug.utils import secure_filename
+from flaskr.api.helpers.async_io_helper import run_blocking
+from flaskr.api.helpers.aws_client_registry import get_client, get_credentials
+from flaskr.api.helpers.multipart_stream import HashingReader, PrefixedReader, read_up_to
+from flaskr.api.managers.bulk_delete import BulkDeleteJob, DEFAULT_CONCURRENCY
+from flaskr.api.managers.content_addressing import CONTENT_PREFIX, DEFAULT_BUFFER_SIZE, INCOMING_PREFIX, content_key
+from flaskr.api.managers.local_object_cache import DEFAULT_MAX_BYTES, LocalObjectCache
+from flaskr.api.managers.rekognition_result_cache import result_cache
+from flaskr.api.managers.s3_metadata_cache import S3MetadataCache
+
+
+logger = logging.getLogger(__name__)
+
+# How often an upload checks whether the deletion of its content is done
+DELETION_POLL_INTERVAL = 0.05
 
 
 class AwsBucketManager:
     """
-    Aws Bucket Manager using s3 resource
+    Aws Bucket Manager using s3 client
     Useful link : https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/s3.html#client
+    Every boto3 call is blocking, so it is run on the shared aws io thread pool
+    to let concurrent requests overlap instead of stalling the event loop
+    When an alias table is given, the objects are content addressed : they are stored
+    under the hash of their content, an upload whose content is already stored is
+    skipped, and their names are aliases resolved through the table
+    The buckets known to exist and the presigned urls are kept in a metadata cache, so
+    an upload to a known bucket doesn't check it again
+    The downloaded objects are kept in a bounded local object cache in STORAGE_FOLDER
     """
 
-    def __init__(self) -> None:
-        self.s3 = boto3.client('s3')
+    def __init__(self, s3_client=None, alias_table=None, metadata_cache=None, local_cache=None) -> None:
+        self.s3 = s3_client if s3_client is not None else get_client('s3')
         self.storage_folder = os.getenv('STORAGE_FOLDER')
         self.s3_default_region = os.getenv('AWS_DEFAULT_REGION')
+        self.transfer_config = self._transfer_config()
+        self.delete_concurrency = int(os.getenv('S3_DELETE_CONCURRENCY', DEFAULT_CONCURRENCY))
+        self.alias_table = alias_table
+        self.content_buffer_size = int(os.getenv('CONTENT_ADDRESSED_BUFFER_SIZE', DEFAULT_BUFFER_SIZE))
+        self.metadata_cache = metadata_cache if metadata_cache is not None else S3MetadataCache.from_env()
+        self._local_cache = local_cache
+        self.deduplicated = 0
+
+    @property
+    def local_cache(self):
+        """
+        The cache of the downloaded objects, its folder is only created once it is used
+        """
+        if self._local_cache is None:
+            self._local_cache = LocalObjectCache(
+                self.storage_folder or os.path.join(tempfile.gettempdir(), 'flaskr-objects'),
+                int(os.getenv('LOCAL_CACHE_MAX_BYTES', DEFAULT_MAX_BYTES)))
+
+        return self._local_cache
+
+    @staticmethod
+    def _transfer_config():
+        """
+        Tune the multipart uploads, the parts kept in memory are bounded by the concurrency
+        """
+        max_concurrency = int(os.getenv('S3_MAX_CONCURRENCY', 10))
+        transfer_config = TransferConfig(
+            multipart_threshold=int(os.getenv('S3_MULTIPART_THRESHOLD', 8 * 1024 * 1024)),
+            multipart_chunksize=int(os.getenv('S3_MULTIPART_CHUNKSIZE', 8 * 1024 * 1024)),
+            max_concurrency=max_concurrency)
+        transfer_config.max_in_memory_upload_chunks = max_concurrency
+
+        return transfer_config
 
     async def upload_file(self, bucket_name, file):
         """
-        Create an object on s3 using a multipart upload
+        Create an object on s3 from an uploaded file, streamed without writing it to disk
+        """
+        return await self.upload_stream(bucket_name, secure_filename(file.filename), file.stream)
+
+    async def upload_stream(self, bucket_name, object_name, fileobj):
         """
-        filename = secure_filename(file.filename)
-        file.save(os.path.join(self.storage_folder, filename))
-        file_path = '%s%s' % (self.storage_folder, filename)
+        Create an object on s3 from a file object using a concurrent multipart upload
+        The parts are read from the file object while the previous ones are sent, so files
+        larger than the memory can be uploaded. The SHA-256 of the object is computed on the
+        fly and returned with the X-Content-SHA256 header.
+        When the objects are content addressed, a file up to content_buffer_size bytes is
+        read in memory first, so it isn't uploaded when its content is already stored. A
+        larger file is uploaded under a temporary key then moved to its content key.
+        """
+        if not await self.object_exists(bucket_name=bucket_name):
+            if not await self._create_bucket(bucket_name):
+                return "Error while creating the bucket and uploading the file", 500
+
+        if self.alias_table is None:
+            reader = HashingReader(fileobj)
+            object_key = object_name
+        else:
+            try:
+                head = await run_blocking(read_up_to, fileobj, self.content_buffer_size + 1)
+                if len(head) <= self.content_buffer_size:
+                    digest = hashlib.sha256(head).hexdigest()
+                    presigned_url = await self._put_bytes(bucket_name, object_name, head, digest)
+                    if presigned_url:
+                        return presigned_url, 200, {'X-Content-SHA256': digest}
+                    return "Error while uploading the object", 500
+            except:
+                self.metadata_cache.forget_bucket(bucket_name)
+                return "Error while uploading the object", 500
 
-        result = await self.create_object(bucket_name=bucket_name, object_file_path=file_path)
+            reader = HashingReader(PrefixedReader(head, fileobj))
+            # the hash is only known once the stream is read, the object is moved to its content key then
+            object_key = INCOMING_PREFIX + uuid.uuid4().hex
+
+        try:
+            await run_blocking(self.s3.upload_fileobj, reader, bucket_name, object_key, Config=self.transfer_config)
 
-        return result
+            if self.alias_table is not None:
+                incoming_key = object_key
+                try:
+                    object_key = await self._store_content(
+                        bucket_name, object_name, reader.hexdigest(),
+                        lambda key: run_blocking(self.s3.copy, {'Bucket': bucket_name, 'Key': incoming_key},
+                                                 bucket_name, key, Config=self.transfer_config))
+                finally:
+                    await run_blocking(self.s3.delete_object, Bucket=bucket_name, Key=incoming_key)
+        except:
+            # the bucket may have been deleted behind the cache
+            self.metadata_cache.forget_bucket(bucket_name)
+            return "Error while uploading the object", 500
+
+        presigned_url = await self._get_presigned_url(bucket_name, object_key)
+
+        if presigned_url:
+            return presigned_url, 200, {'X-Content-SHA256': reader.hexdigest()}
+        else:
+            return "Error while uploading the object", 500
+
+    async def upload_bytes(self, bucket_name, object_name, data, digest=None):
+        """
+        Create an object on s3 from bytes already in memory, without writing them to disk
+        The SHA-256 of the bytes can be given when it is already known
+        """
+        if not await self.object_exists(bucket_name=bucket_name):
+            if not await self._create_bucket(bucket_name):
+                return "Error while creating the bucket and uploading the file", 500
+
+        try:
+            presigned_url = await self._put_bytes(bucket_name, object_name, data, digest)
+        except:
+            self.metadata_cache.forget_bucket(bucket_name)
+            return "Error while uploading the object", 500
+
+        if presigned_url:
+            return presigned_url, 200
+        else:
+            return "Error while uploading the object", 500
+
+    async def upload_batch(self, bucket_name, files, concurrency=None):
+        """
+        Create many objects on s3 from an iterator of (name, bytes) pairs
+        The bucket is checked once for the whole batch. The iterator is read on the aws io
+        thread pool, so it can parse a request body as it is received, while concurrency
+        workers upload the files already read. A pair whose bytes are None is a file
+        rejected because it is too large. Return the result of each file, in the order of
+        the iterator, with the status 207 when some files failed. When the iterator fails
+        before its first file, its error is returned with its status, 400 by default
+        """
+        if not await self.object_exists(bucket_name=bucket_name):
+            if not await self._create_bucket(bucket_name):
+                return "Error while creating the bucket and uploading the files", 500
+
+        concurrency = concurrency or self.transfer_config.max_concurrency
+        queue = asyncio.Queue(maxsize=concurrency)
+        results = []
+
+        async def upload(index, object_name, data):
+            result = {'name': object_name}
+            if data is None:
+                result.update(status=413, error="The file is too large")
+            else:
+                result['size'] = len(data)
+                result['sha256'] = await run_blocking(_bytes_digest, data)
+                try:
+                    presigned_url = await self._put_bytes(bucket_name, object_name, data, result['sha256'])
+                except:
+                    self.metadata_cache.forget_bucket(bucket_name)
+                    presigned_url = False
+                if presigned_url:
+                    result.update(status=200, url=presigned_url)
+                else:
+                    result.update(status=500, error="Error while uploading the object")
+            results[index] = result
+
+        async def work():
+            while True:
+                item = await queue.get()
+                if item is None:
+                    return
+                await upload(*item)
+
+        workers = [asyncio.ensure_future(work()) for _ in range(concurrency)]
+        files = iter(files)
+        try:
+            while True:
+                try:
+                    item = await run_blocking(next, files, None)
+                except Exception as e:
+                    # a truncated or invalid body, the files read before it are still uploaded
+                    results.append({'name': None, 'status': getattr(e, 'status', 400), 'error': str(e)})
+                    break
+                if item is None:
+                    break
+                results.append(None)
+                await queue.put((len(results) - 1,) + tuple(item))
+        finally:
+            for _ in workers:
+                await queue.put(None)
+            await asyncio.gather(*workers)
+
+        if len(results) == 1 and results[0]['name'] is None:
+            return results[0]['error'], results[0]['status']
+
+        return results, 207 if any(result['status'] != 200 for result in results) else 200
+
+    async def presigned_post(self, bucket_name, object_name, max_size=None):
+        """
+        Get the url and the form fields a client posts to upload an object straight to s3
+        The bucket is created if it does not exist, only images are accepted
+        """
+        if not await self.object_exists(bucket_name=bucket_name):
+            if not await self._create_bucket(bucket_name):
+                return "Error while creating the bucket", 500
+
+        presigned_post = await self._get_presigned_post(bucket_name, object_name, max_size)
+
+        if presigned_post:
+            return presigned_post, 200
+        else:
+            return "Error while presigning the upload", 500
 
     async def create_object(self, bucket_name=None, object_file_path=None):
         """
@@ -66,8 +285,12 @@ class AwsBucketManager:
         Check if the bucket or the object exists on s3
         """
         if bucket_name and not object_name:
+            if self.metadata_cache.bucket_exists(bucket_name):
+                return True
+
             try:
-                self.s3.head_bucket(Bucket=bucket_name)
+                await run_blocking(self.s3.head_bucket, Bucket=bucket_name)
+                self.metadata_cache.remember_bucket(bucket_name)
 
                 return True
             except:
@@ -75,7 +298,7 @@ class AwsBucketManager:
 
         if bucket_name and object_name:
             try:
-                self.s3.head_object(Bucket=bucket_name, Key=object_name)
+                await run_blocking(self.s3.head_object, Bucket=bucket_name, Key=object_name)
 
                 return True
             except:
@@ -83,28 +306,187 @@ class AwsBucketManager:
         
         return False
 
+    async def list_objects(self, bucket_name, prefix=''):
+        """
+        List the objects of a bucket, page by page
+        This is an async generator of the object descriptions returned by list_objects_v2
+        """
+        paginator = self.s3.get_paginator('list_objects_v2')
+        pages = iter(paginator.paginate(Bucket=bucket_name, Prefix=prefix))
+
+        while True:
+            page = await run_blocking(next, pages, None)
+
+            if page is None:
+                return
+
+            for s3_object in page.get('Contents', []):
+                yield s3_object
+
     async def download_object(self, bucket_name, object_name):
         """
-        Download an object from s3
+        Download an object from s3 to the local object cache, and return the path of its file
+        The file is named after the hash of its content and written atomically. It is reused
+        by the next downloads while the ETag of the object doesn't change.
+        """
+        try:
+            object_key = await self._object_key(bucket_name, object_name)
+            head = await run_blocking(self.s3.head_object, Bucket=bucket_name, Key=object_key)
+            local_cache = self.local_cache
+
+            path = await run_blocking(local_cache.get, bucket_name, object_key, head.get('ETag'))
+            if path is None:
+                path = await run_blocking(
+                    local_cache.put, bucket_name, object_key,
+                    lambda temporary_path: self.s3.download_file(bucket_name, object_key, temporary_path),
+                    head.get('ETag'), os.path.splitext(object_name)[1])
+
+            return path, 200
+        except:
+            return "Error while downloading the object", 500
+
+    async def fetch_object(self, bucket_name, object_name):
+        """
+        Fetch an object from s3 into memory, without writing it to disk
+        The object is split into ranges of the multipart chunk size, fetched concurrently
+        straight into one preallocated buffer. The size of the object is read from the
+        response of the first range, so a small object is fetched with a single get.
+        The other ranges are conditioned on the ETag of the first one, so an object
+        overwritten during the fetch fails instead of mixing two versions. A memoryview
+        of the buffer is returned, it is read by RekognitionImage.from_bytes without copy.
         """
+        object_key = await self._object_key(bucket_name, object_name)
+        part_size = self.transfer_config.multipart_chunksize
+
         try:
-            self.s3.download_file(bucket_name, object_name, '%s%s' % (
-                self.storage_folder, object_name))
+            first = await run_blocking(self.s3.get_object, Bucket=bucket_name, Key=object_key,
+                                       Range='bytes=0-%s' % (part_size - 1))
+        except ClientError as e:
+            code = e.response.get('Error', {}).get('Code')
+            if code in ('404', 'NoSuchKey', 'NoSuchBucket'):
+                return "Object not found", 404
+            if code == 'InvalidRange':
+                # the first range of an empty object is not satisfiable
+                return memoryview(bytearray()), 200
+            return "Error while downloading the object", 500
+        except:
+            return "Error while downloading the object", 500
+
+        content_range = first.get('ContentRange')
+        size = int(content_range.rsplit('/', 1)[1]) if content_range else first['ContentLength']
+        view = memoryview(bytearray(size))
+        semaphore = asyncio.Semaphore(self.transfer_config.max_concurrency)
+
+        async def read_first_range():
+            async with semaphore:
+                await run_blocking(self._read_into, first['Body'], view[:first['ContentLength']])
+
+        async def fetch_range(start):
+            end = min(start + part_size, size)
+            params = {'Bucket': bucket_name, 'Key': object_key, 'Range': 'bytes=%s-%s' % (start, end - 1)}
+            if first.get('ETag'):
+                params['IfMatch'] = first['ETag']
+            async with semaphore:
+                response = await run_blocking(self.s3.get_object, **params)
+                await run_blocking(self._read_into, response['Body'], view[start:end])
 
-            return "Object downloaded", 200
+        try:
+            await asyncio.gather(read_first_range(),
+                                 *[fetch_range(start) for start in range(first['ContentLength'], size, part_size)])
         except:
             return "Error while downloading the object", 500
 
+        return view, 200
+
+    @staticmethod
+    def _read_into(body, view):
+        """
+        Read the body of a get into a slice of a buffer
+        """
+        readinto = getattr(body, 'readinto', None)
+        position = 0
+
+        try:
+            while position < len(view):
+                if readinto is not None:
+                    read = readinto(view[position:])
+                else:
+                    chunk = body.read(len(view) - position)
+                    read = len(chunk)
+                    view[position:position + read] = chunk
+                if not read:
+                    raise IOError('The object ended before the end of the range')
+                position += read
+        finally:
+            body.close()
+
+    async def get_object_stream(self, bucket_name, object_name, byte_range=None, if_none_match=None):
+        """
+        Open the body of an object on s3 without downloading it
+        The byte range (a Range header value) is forwarded as a ranged GET, and the object
+        is not returned when its ETag matches if_none_match. The response of get_object is
+        returned with the status 200, or 206 for a range, its Body is read as it is streamed
+        An object not modified is returned as its ETag with the status 304, and a range out
+        of the object as its unsatisfied ContentRange with the status 416
+        """
+        params = {'Bucket': bucket_name, 'Key': await self._object_key(bucket_name, object_name)}
+        if byte_range:
+            params['Range'] = byte_range
+        if if_none_match:
+            params['IfNoneMatch'] = if_none_match
+
+        try:
+            response = await run_blocking(self.s3.get_object, **params)
+        except ClientError as e:
+            code = e.response.get('Error', {}).get('Code')
+            if code in ('304', 'NotModified'):
+                e_tag = e.response.get('ResponseMetadata', {}).get('HTTPHeaders', {}).get('etag')
+                if e_tag is None:
+                    e_tag = (await self._head_object(params['Bucket'], params['Key'])).get('ETag')
+                return {'ETag': e_tag}, 304
+            if code in ('404', 'NoSuchKey', 'NoSuchBucket'):
+                return "Object not found", 404
+            if code == 'InvalidRange':
+                size = e.response['Error'].get('ActualObjectSize')
+                if size is None:
+                    size = (await self._head_object(params['Bucket'], params['Key'])).get('ContentLength')
+                return {'ContentRange': 'bytes */%s' % size if size is not None else None}, 416
+            return "Error while downloading the object", 500
+        except:
+            return "Error while downloading the object", 500
+
+        return response, 206 if response.get('ContentRange') else 200
+
+    async def _head_object(self, bucket_name, object_key):
+        """
+        Get the metadata of an object, empty when it can't be read
+        """
+        try:
+            return await run_blocking(self.s3.head_object, Bucket=bucket_name, Key=object_key)
+        except:
+            return {}
+
     async def remove_object(self, bucket_name=None, object_name=None):
         """
         Delete a bucket or an object on s3
+        A bucket is emptied with a bulk delete of every version of its objects first
         """
-        s3_resource = boto3.resource('s3')
-
         if bucket_name and not object_name:
+            # the bucket is forgotten even when it is only partly deleted
+            self.metadata_cache.forget_bucket(bucket_name)
+
             try:
-                s3_resource.Bucket(bucket_name).objects.all().delete()
-                self.s3.delete_bucket(Bucket=bucket_name)
+                # every object is deleted, the content keys included
+                stats, status, _ = await self._delete_keys(bucket_name, prefixes=[''])
+                if status != 200:
+                    return "Error while deleting the bucket", 500
+                await run_blocking(self.s3.delete_bucket, Bucket=bucket_name)
+                self.metadata_cache.forget_bucket(bucket_name)
+                if self._local_cache is not None:
+                    await run_blocking(self._local_cache.remove, bucket_name)
+                if self.alias_table is not None:
+                    await run_blocking(self.alias_table.remove_bucket, bucket_name)
+                self._invalidate_results(bucket_name)
 
                 return "Bucket deleted", 200
             except:
@@ -112,7 +494,22 @@ class AwsBucketManager:
         
         if bucket_name and object_name:
             try:
-                s3_resource.Object(bucket_name, object_name).delete()
+                object_key, referenced = object_name, False
+                if self.alias_table is not None:
+                    object_key, referenced = await run_blocking(self.alias_table.remove, bucket_name, object_name)
+                    object_key = object_key or object_name
+
+                # a content shared with other names, or claimed by an upload, is kept
+                if not referenced:
+                    self.metadata_cache.forget_url(bucket_name, object_key)
+                    try:
+                        await run_blocking(self.s3.delete_object, Bucket=bucket_name, Key=object_key)
+                    finally:
+                        if self.alias_table is not None:
+                            await run_blocking(self.alias_table.deleted, bucket_name, object_key)
+                    if self._local_cache is not None:
+                        await run_blocking(self._local_cache.remove, bucket_name, object_key)
+                self._invalidate_results(bucket_name, object_name)
 
                 return "Object deleted", 200
             except:
@@ -120,15 +517,154 @@ class AwsBucketManager:
         
         return "Error while deleting the object", 500
 
+    async def delete_objects(self, bucket_name, keys=None, prefixes=None, versions=True, progress=None):
+        """
+        Delete many objects of a bucket with batches of 1000 keys, see BulkDeleteJob
+        The objects are given by their keys, or by prefixes listed in parallel. When the
+        objects are content addressed, the keys and the prefixes apply to the names : the
+        aliases of the names are removed, and their content is only deleted when no other
+        name references it. A name whose content couldn't be deleted is aliased again.
+        Return the stats of the delete, with the status 500 when some objects failed
+        """
+        keys = list(keys or [])
+        prefixes = list(prefixes or [])
+        names = keys
+
+        if self.alias_table is None:
+            stats, status, _ = await self._delete_keys(bucket_name, keys, prefixes, versions, progress)
+        else:
+            aliases = {}
+            for prefix in prefixes:
+                aliases.update(await run_blocking(self.alias_table.names, bucket_name, prefix))
+            names = list(dict.fromkeys(keys + list(aliases)))
+
+            # the names without alias are objects stored under their name, such as the presigned posts
+            removed, keys = {}, []
+            for name in names:
+                object_key, referenced = await run_blocking(self.alias_table.remove, bucket_name, name)
+                if object_key is None:
+                    keys.append(name)
+                elif not referenced:
+                    removed[name] = object_key
+                    keys.append(object_key)
+
+            # the listed content keys are reached through the aliases, the other names keep theirs
+            stats, status, failed_keys = await self._delete_keys(
+                bucket_name, list(dict.fromkeys(keys)), prefixes, versions, progress, excluded_prefix=CONTENT_PREFIX)
+
+            for name, object_key in removed.items():
+                if object_key in failed_keys:
+                    await run_blocking(self.alias_table.restore, bucket_name, name, object_key)
+            for object_key in removed.values():
+                await run_blocking(self.alias_table.deleted, bucket_name, object_key)
+
+        for name in names:
+            self._invalidate_results(bucket_name, name)
+        for prefix in prefixes:
+            self._invalidate_results(bucket_name, prefix=prefix)
+
+        return stats, status
+
+    async def _delete_keys(self, bucket_name, keys=None, prefixes=None, versions=True, progress=None,
+                           excluded_prefix=None):
+        """
+        Delete the stored keys and the objects under the prefixes with a BulkDeleteJob
+        Return the stats of the delete, its status and the keys that couldn't be deleted
+        """
+        for key in keys or []:
+            self.metadata_cache.forget_url(bucket_name, key)
+        for prefix in prefixes or []:
+            self.metadata_cache.forget_url(bucket_name, prefix=prefix)
+
+        job = BulkDeleteJob(self.s3, bucket_name, keys, prefixes, versions, self.delete_concurrency, progress,
+                            excluded_prefix)
+        try:
+            stats = await job.run()
+        except:
+            return "Error while deleting the objects", 500, set(keys or [])
+
+        return stats, 500 if stats['failed'] else 200, job.failed_keys
+
+    def _invalidate_results(self, bucket_name, object_name=None, prefix=None):
+        """
+        Forget the rekognition results computed from removed objects
+        """
+        if result_cache is not None:
+            result_cache.invalidate(bucket_name, object_name, prefix)
+
+    async def _put_bytes(self, bucket_name, object_name, data, digest=None):
+        """
+        Put bytes on s3 under the name, or under their content key, and get the presigned url of the object
+        """
+        if self.alias_table is None:
+            object_key = object_name
+            await run_blocking(self.s3.put_object, Bucket=bucket_name, Key=object_key, Body=data)
+        else:
+            object_key = await self._store_content(
+                bucket_name, object_name, digest or hashlib.sha256(data).hexdigest(),
+                lambda key: run_blocking(self.s3.put_object, Bucket=bucket_name, Key=key, Body=data))
+
+        return await self._get_presigned_url(bucket_name, object_key)
+
+    async def _object_key(self, bucket_name, object_name):
+        """
+        Resolve the name of an object to its content key, when the objects are content addressed
+        """
+        if self.alias_table is None:
+            return object_name
+
+        return await run_blocking(self.alias_table.get, bucket_name, object_name) or object_name
+
+    async def _store_content(self, bucket_name, object_name, digest, upload):
+        """
+        Store an object under its content key and alias its name to it
+        The upload coroutine function receives the content key, it is not called when the
+        content is already stored. The content key is claimed before it is checked, so a
+        removal doesn't delete a content found stored before the name is aliased to it,
+        and a content being deleted is stored again once its deletion is done. The content
+        the name pointed to before is deleted when no other name references it.
+        """
+        object_key = content_key(digest, object_name)
+
+        claim_id, deleting = await run_blocking(self.alias_table.claim, bucket_name, object_key)
+        try:
+            if deleting:
+                while await run_blocking(self.alias_table.deleting, bucket_name, object_key):
+                    await asyncio.sleep(DELETION_POLL_INTERVAL)
+                await upload(object_key)
+            elif await self.object_exists(bucket_name=bucket_name, object_name=object_key):
+                self.deduplicated += 1
+            else:
+                await upload(object_key)
+
+            orphan_key = await run_blocking(self.alias_table.set, bucket_name, object_name, object_key, claim_id)
+        except:
+            await run_blocking(self.alias_table.release, claim_id)
+            raise
+
+        if orphan_key is not None:
+            self.metadata_cache.forget_url(bucket_name, orphan_key)
+            try:
+                await run_blocking(self.s3.delete_object, Bucket=bucket_name, Key=orphan_key)
+            except:
+                logger.warning("Couldn't delete the orphan object %s of %s", orphan_key, bucket_name)
+            finally:
+                await run_blocking(self.alias_table.deleted, bucket_name, orphan_key)
+            self._invalidate_results(bucket_name, object_name)
+
+        return object_key
+
     async def _create_bucket(self, bucket_name):
         """
         Create a bucket on s3
         """
         try:
-            self.s3.create_bucket(Bucket=bucket_name, CreateBucketConfiguration={
+            await run_blocking(self.s3.create_bucket, Bucket=bucket_name, CreateBucketConfiguration={
                                         'LocationConstraint': self.s3_default_region})
+            self.metadata_cache.remember_bucket(bucket_name)
             return True
         except:
+            self.metadata_cache.forget_bucket(bucket_name)
             return False
     
     async def _upload_file(self, bucket_name, file_path):
@@ -137,24 +673,95 @@ class AwsBucketManager:
         """
         try:
             file_name = os.path.basename(file_path)
-            self.s3.upload_file(file_path, bucket_name, file_name)
 
-            presigned_url = await self._get_presigned_url(bucket_name, file_name)
+            if self.alias_table is None:
+                object_key = file_name
+                await run_blocking(self.s3.upload_file, file_path, bucket_name, object_key)
+            else:
+                object_key = await self._store_content(
+                    bucket_name, file_name, await run_blocking(_file_digest, file_path),
+                    lambda key: run_blocking(self.s3.upload_file, file_path, bucket_name, key))
+
+            presigned_url = await self._get_presigned_url(bucket_name, object_key)
             
             return presigned_url
+        except:
+            self.metadata_cache.forget_bucket(bucket_name)
+            return False
+
+    async def _get_presigned_post(self, bucket_name, object_name, max_size=None):
+        """
+        Get a presigned post to upload an object on s3
+        """
+        conditions = [['starts-with', '$Content-Type', 'image/']]
+        if max_size:
+            conditions.append(['content-length-range', 1, max_size])
+
+        try:
+            presigned_post = self.s3.generate_presigned_post(
+                bucket_name, object_name, Conditions=conditions, ExpiresIn=3600)
+
+            return presigned_post
         except:
             return False
 
     async def _get_presigned_url(self, bucket_name, object_name):
         """
         Get a presigned url to access an object on s3
+        The url of the object is reused until it gets close to its expiry, or to the expiry
+        of the temporary credentials that signed it
         """
+        presigned_url = self.metadata_cache.presigned_url(bucket_name, object_name)
+        if presigned_url:
+            return presigned_url
+
         try:
+            signed_at = time.time()
             presigned_url = self.s3.generate_presigned_url('get_object', Params={
                 'Bucket': bucket_name,
                 'Key': object_name
-            }, ExpiresIn=3600)
+            }, ExpiresIn=self.metadata_cache.url_expires_in)
+            self.metadata_cache.remember_url(bucket_name, object_name, presigned_url, signed_at,
+                                             _credentials_expiry())
 
             return presigned_url
         except:
-            return False
\ No newline at end of file
+            return False
+
+
+def _credentials_expiry():
+    """
+    The time the credentials of the aws clients expire at, None when they don't expire or it is unknown
+    botocore has no public accessor of the expiry of the refreshable credentials, so it is read
+    from their _expiry_time when it is there. Otherwise the presigned urls are only reused
+    until their own expiry, minus the refresh margin
+    """
+    try:
+        credentials = get_credentials()
+    except BotoCoreError:
+        return None
+
+    if not isinstance(credentials, RefreshableCredentials):
+        return None
+
+    expiry_time = getattr(credentials, '_expiry_time', None)
+    if not isinstance(expiry_time, datetime):
+        logger.warning("The expiry of the %s credentials is unknown, the presigned urls may outlive them.",
+                       credentials.method)
+        return None
+
+    return expiry_time.timestamp()
+
+
+def _bytes_digest(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def _file_digest(file_path):
+    sha256 = hashlib.sha256()
+
+    with open(file_path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1024 * 1024), b''):
+            sha256.update(chunk)
+
+    return sha256.hexdigest()
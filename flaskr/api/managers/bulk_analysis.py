@@ -0,0 +1,212 @@
+"""
+Purpose
+
+Analyses every image stored under an Amazon S3 bucket prefix. The images are
+passed to Amazon Rekognition by S3 reference, so their bytes are never downloaded
+by the service. A bounded number of workers analyse the images while the bucket
+is listed, and each result is written to a sink as soon as it is available.
+"""
+
+import asyncio
+import json
+import logging
+import threading
+import time
+from collections import namedtuple
+
+from flaskr.api.helpers.latency_recorder import LatencyRecorder
+from flaskr.api.managers.rekognition_image_detection import RekognitionImage, analyse_image, get_rekognition_client
+
+logger = logging.getLogger(__name__)
+
+# The image formats supported by Amazon Rekognition
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+# The number of latest objects whose latency is kept for the percentiles of a job
+LATENCY_WINDOW = 1000
+
+DEFAULT_CONCURRENCY = 8
+
+# Each image analysed at the same time holds a worker thread and a rekognition call
+MAX_CONCURRENCY = 64
+
+# Identifies an Amazon S3 object, as expected by RekognitionImage.from_bucket
+S3ObjectReference = namedtuple('S3ObjectReference', ['bucket_name', 'key', 'e_tag'], defaults=[None])
+
+
+class JsonLinesSink:
+    """Writes each analysis result as a json line to a file."""
+
+    def __init__(self, file):
+        """
+        Initializes the sink.
+
+        :param file: The text file the results are written to.
+        """
+        self.file = file
+        self._lock = threading.Lock()
+
+    def write(self, record):
+        line = json.dumps(record) + '\n'
+        with self._lock:
+            self.file.write(line)
+            self.file.flush()
+
+
+class BulkAnalysisStats:
+    """Counts the objects of a bulk analysis and measures its throughput."""
+
+    def __init__(self):
+        self.started_at = time.perf_counter()
+        self.finished_at = None
+        self.listed = 0
+        self.skipped = 0
+        self.unchanged = 0
+        self.analysed = 0
+        self.failed = 0
+        # the percentiles are computed on each status poll, from the last objects only
+        self.latencies = LatencyRecorder(window=LATENCY_WINDOW)
+
+    def to_dict(self):
+        """
+        Renders the counters to a dict.
+
+        :return: A dict that contains the counters, the throughput in images per
+                 second and the percentiles of the latency of the last LATENCY_WINDOW
+                 objects.
+        """
+        elapsed = (self.finished_at or time.perf_counter()) - self.started_at
+        processed = self.analysed + self.failed
+        return {
+            'listed': self.listed,
+            'skipped': self.skipped,
+            'unchanged': self.unchanged,
+            'analysed': self.analysed,
+            'failed': self.failed,
+            'elapsed_s': round(elapsed, 3),
+            'images_per_second': round(processed / elapsed, 3) if elapsed > 0 else 0.0,
+            'latency': self.latencies.summary(),
+        }
+
+
+class BulkAnalysisJob:
+    """Analyses the images of a bucket prefix with a bounded number of workers."""
+
+    def __init__(self, bucket_manager, bucket_name, prefix='', operations=('detect_faces',),
+                 concurrency=DEFAULT_CONCURRENCY, sink=None, rekognition_client=None, max_labels=10):
+        """
+        Initializes the job.
+
+        :param bucket_manager: The AwsBucketManager listing the objects.
+        :param bucket_name: The bucket to analyse.
+        :param prefix: The prefix of the objects to analyse.
+        :param operations: The Rekognition operations to run on each image, see
+                           ANALYSIS_OPERATIONS.
+        :param concurrency: The number of images analysed at the same time.
+        :param sink: The object whose write method receives each result, if any.
+        :param rekognition_client: A Boto3 Rekognition client. The shared client,
+                                   see get_rekognition_client, is used when this
+                                   is not specified.
+        :param max_labels: The maximum number of labels returned by detect_labels.
+        """
+        self.bucket_manager = bucket_manager
+        self.bucket_name = bucket_name
+        self.prefix = prefix
+        self.operations = list(operations)
+        self.concurrency = concurrency
+        self.sink = sink
+        self.rekognition_client = rekognition_client
+        self.max_labels = max_labels
+        self.stats = BulkAnalysisStats()
+        self.cancelled = False
+
+    async def should_analyse(self, s3_object):
+        """
+        Tells whether an object listed in the bucket must be analysed. The objects
+        not analysed are counted as skipped.
+
+        :param s3_object: The object description returned by list_objects_v2.
+        :return: True when the object is an image supported by Rekognition.
+        """
+        return s3_object['Key'].lower().endswith(IMAGE_EXTENSIONS)
+
+    def cancel(self):
+        """
+        Stops the job, the images being analysed are finished first and the
+        queued ones are dropped.
+        """
+        self.cancelled = True
+
+    async def run(self):
+        """
+        Runs the job.
+
+        :return: The stats of the job, see BulkAnalysisStats.to_dict.
+        """
+        queue = asyncio.Queue(maxsize=self.concurrency * 2)
+        workers = [asyncio.ensure_future(self._work(queue)) for _ in range(self.concurrency)]
+
+        try:
+            async for s3_object in self.bucket_manager.list_objects(self.bucket_name, self.prefix):
+                if self.cancelled:
+                    break
+                self.stats.listed += 1
+                if not await self.should_analyse(s3_object):
+                    self.stats.skipped += 1
+                    continue
+                await queue.put(s3_object)
+        finally:
+            for _ in workers:
+                await queue.put(None)
+            await asyncio.gather(*workers)
+            self.stats.finished_at = time.perf_counter()
+
+        stats = self.stats.to_dict()
+        logger.info("Bulk analysis of s3://%s/%s finished : %s", self.bucket_name, self.prefix, stats)
+        return stats
+
+    async def analyse_object(self, s3_object):
+        """
+        Analyses an object by S3 reference and writes its result to the sink.
+
+        :param s3_object: The object description returned by list_objects_v2.
+        :return: The result record of the object.
+        """
+        start = time.perf_counter()
+        client = self.rekognition_client or get_rekognition_client()
+        image = RekognitionImage.from_bucket(
+            S3ObjectReference(self.bucket_name, s3_object['Key'], s3_object.get('ETag')), client)
+
+        results, errors = await analyse_image(image, self.operations, self.max_labels)
+
+        latency = time.perf_counter() - start
+        self.stats.latencies.record(latency)
+        if results or not errors:
+            self.stats.analysed += 1
+        else:
+            self.stats.failed += 1
+
+        record = {
+            'bucket': self.bucket_name,
+            'key': s3_object['Key'],
+            'etag': s3_object.get('ETag'),
+            'results': results,
+            'errors': errors,
+            'latency_ms': round(latency * 1000, 3),
+        }
+        if self.sink is not None:
+            self.sink.write(record)
+        return record
+
+    async def _work(self, queue):
+        while True:
+            s3_object = await queue.get()
+            if s3_object is None:
+                return
+            if self.cancelled:
+                continue
+            try:
+                await self.analyse_object(s3_object)
+            except Exception:
+                self.stats.failed += 1
+                logger.exception("Couldn't analyse s3://%s/%s.", self.bucket_name, s3_object['Key'])
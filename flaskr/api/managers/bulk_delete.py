@@ -0,0 +1,213 @@
+"""
+Purpose
+
+Deletes many objects of an Amazon S3 bucket with delete_objects, which removes up
+to 1000 keys per request. The keys are either given or listed under prefixes. The
+prefixes are split on their '/' delimited sub prefixes, which are listed in
+parallel, and the batches of a page are deleted while the next page is listed, so
+a bucket of millions of keys can be torn down in minutes. Every version and delete
+marker of the objects is deleted too, so a versioned bucket can be removed after.
+"""
+
+import asyncio
+import logging
+import time
+
+from flaskr.api.helpers.async_io_helper import run_blocking
+
+logger = logging.getLogger(__name__)
+
+# The maximum number of keys of a delete_objects request
+MAX_BATCH_SIZE = 1000
+
+DEFAULT_CONCURRENCY = 8
+
+DELIMITER = '/'
+
+# The number of failed keys whose error is kept in the stats
+MAX_REPORTED_ERRORS = 100
+
+
+class BulkDeleteStats:
+    """Counts the objects of a bulk delete and measures its throughput."""
+
+    def __init__(self):
+        self.started_at = time.perf_counter()
+        self.finished_at = None
+        self.prefixes = 0
+        self.batches = 0
+        self.deleted = 0
+        self.failed = 0
+        self.errors = []
+
+    def to_dict(self):
+        """
+        Renders the counters to a dict.
+
+        :return: A dict that contains the counters, the throughput in keys per second
+                 and the first errors.
+        """
+        elapsed = (self.finished_at or time.perf_counter()) - self.started_at
+        return {
+            'prefixes': self.prefixes,
+            'batches': self.batches,
+            'deleted': self.deleted,
+            'failed': self.failed,
+            'elapsed_s': round(elapsed, 3),
+            'keys_per_second': round(self.deleted / elapsed, 3) if elapsed > 0 else 0.0,
+            'errors': list(self.errors),
+        }
+
+
+class BulkDeleteJob:
+    """Deletes the objects of a bucket in batches, with a bounded number of workers."""
+
+    def __init__(self, s3_client, bucket_name, keys=None, prefixes=None, versions=True,
+                 concurrency=DEFAULT_CONCURRENCY, progress=None, excluded_prefix=None):
+        """
+        Initializes the job.
+
+        :param s3_client: A Boto3 Amazon S3 client.
+        :param bucket_name: The bucket whose objects are deleted.
+        :param keys: The keys of the objects to delete, if any.
+        :param prefixes: The prefixes whose objects are deleted, if any. Use [''] to
+                         delete every object of the bucket.
+        :param versions: When True, every version and delete marker of the objects
+                         listed under the prefixes is deleted. Otherwise, like for the
+                         given keys, only their current version is, which leaves a
+                         delete marker in a versioned bucket.
+        :param concurrency: The number of prefixes listed and the number of batches
+                            deleted at the same time.
+        :param progress: The function called with the stats dict after each batch, if any.
+        :param excluded_prefix: The objects under this prefix are not deleted when they
+                                are listed under the prefixes, if any.
+        """
+        self.s3 = s3_client
+        self.bucket_name = bucket_name
+        self.keys = list(keys or [])
+        self.prefixes = list(prefixes or [])
+        self.versions = versions
+        self.concurrency = concurrency
+        self.progress = progress
+        self.excluded_prefix = excluded_prefix
+        self.stats = BulkDeleteStats()
+        # every key that couldn't be deleted, the stats only report the first errors
+        self.failed_keys = set()
+
+    async def run(self):
+        """
+        Runs the job.
+
+        :return: The stats of the job, see BulkDeleteStats.to_dict.
+        """
+        self._batches = asyncio.Semaphore(self.concurrency)
+        self._pending = set()
+
+        try:
+            for index in range(0, len(self.keys), MAX_BATCH_SIZE):
+                await self._submit([{'Key': key} for key in self.keys[index:index + MAX_BATCH_SIZE]])
+
+            if self.prefixes:
+                await self._delete_prefixes()
+        finally:
+            if self._pending:
+                await asyncio.gather(*self._pending)
+            self.stats.finished_at = time.perf_counter()
+
+        stats = self.stats.to_dict()
+        logger.info("Bulk delete of s3://%s finished : %s", self.bucket_name, stats)
+        return stats
+
+    async def _delete_prefixes(self):
+        queue = asyncio.Queue()
+        for prefix in self.prefixes:
+            queue.put_nowait(prefix)
+
+        workers = [asyncio.ensure_future(self._list_prefixes(queue)) for _ in range(self.concurrency)]
+        try:
+            await queue.join()
+        finally:
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+
+    async def _list_prefixes(self, queue):
+        while True:
+            prefix = await queue.get()
+            try:
+                await self._delete_prefix(prefix, queue)
+            except Exception as e:
+                self._record_error({'Key': prefix, 'Code': type(e).__name__, 'Message': str(e)})
+                logger.exception("Couldn't list s3://%s/%s.", self.bucket_name, prefix)
+            finally:
+                queue.task_done()
+
+    async def _delete_prefix(self, prefix, queue):
+        """
+        Deletes the objects right under a prefix, its sub prefixes are queued to be
+        listed by the other workers.
+        """
+        if self._excluded(prefix):
+            return
+
+        self.stats.prefixes += 1
+        operation = 'list_object_versions' if self.versions else 'list_objects_v2'
+        pages = iter(self.s3.get_paginator(operation).paginate(
+            Bucket=self.bucket_name, Prefix=prefix, Delimiter=DELIMITER))
+
+        while True:
+            page = await run_blocking(next, pages, None)
+            if page is None:
+                return
+
+            for common_prefix in page.get('CommonPrefixes', []):
+                if not self._excluded(common_prefix['Prefix']):
+                    queue.put_nowait(common_prefix['Prefix'])
+
+            if self.versions:
+                objects = [{'Key': version['Key'], 'VersionId': version['VersionId']}
+                           for version in page.get('Versions', []) + page.get('DeleteMarkers', [])]
+            else:
+                objects = [{'Key': s3_object['Key']} for s3_object in page.get('Contents', [])]
+            objects = [s3_object for s3_object in objects if not self._excluded(s3_object['Key'])]
+
+            for index in range(0, len(objects), MAX_BATCH_SIZE):
+                await self._submit(objects[index:index + MAX_BATCH_SIZE])
+
+    async def _submit(self, objects):
+        """
+        Deletes a batch in the background, it waits while concurrency batches are
+        being deleted so the listing doesn't run ahead of the deletes.
+        """
+        await self._batches.acquire()
+        task = asyncio.ensure_future(self._delete_batch(objects))
+        self._pending.add(task)
+        task.add_done_callback(self._pending.discard)
+
+    async def _delete_batch(self, objects):
+        try:
+            response = await run_blocking(self.s3.delete_objects, Bucket=self.bucket_name,
+                                          Delete={'Objects': objects, 'Quiet': True})
+            errors = response.get('Errors', [])
+        except Exception as e:
+            logger.exception("Couldn't delete a batch of %s keys of s3://%s.", len(objects), self.bucket_name)
+            errors = [dict(s3_object, Code=type(e).__name__, Message=str(e)) for s3_object in objects]
+        finally:
+            self._batches.release()
+
+        self.stats.batches += 1
+        self.stats.deleted += len(objects) - len(errors)
+        for error in errors:
+            self._record_error(error)
+
+        if self.progress is not None:
+            self.progress(self.stats.to_dict())
+
+    def _excluded(self, key):
+        return self.excluded_prefix is not None and key.startswith(self.excluded_prefix)
+
+    def _record_error(self, error):
+        self.failed_keys.add(error.get('Key'))
+        self.stats.failed += 1
+        if len(self.stats.errors) < MAX_REPORTED_ERRORS:
+            self.stats.errors.append({name: error.get(name) for name in ('Key', 'VersionId', 'Code', 'Message')})
@@ -0,0 +1,413 @@
+"""
+Purpose
+
+Runs bulk analyses as background jobs whose progress is journaled in SQLite. A job
+interrupted by a crash, a restart or a cancellation can be resumed without paying
+Amazon Rekognition again for the objects already analysed, and the objects whose
+ETag didn't change since their last successful analysis are skipped, so a bucket
+can be re-analysed incrementally.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import closing
+
+from flaskr.api.helpers.async_io_helper import run_blocking
+from flaskr.api.managers.bulk_analysis import BulkAnalysisJob, DEFAULT_CONCURRENCY
+
+logger = logging.getLogger(__name__)
+
+PENDING = 'pending'
+RUNNING = 'running'
+CANCELLED = 'cancelled'
+INTERRUPTED = 'interrupted'
+COMPLETED = 'completed'
+FAILED = 'failed'
+
+# The statuses of the jobs that can be resumed
+RESUMABLE = (CANCELLED, INTERRUPTED, FAILED)
+
+# A running job checks whether it was cancelled by another process every time it
+# has listed this number of objects
+CANCELLATION_CHECK_INTERVAL = 100
+
+# The results of a job are journaled by batches of this number of objects, or at
+# least every RECORD_INTERVAL seconds. A crash loses the results of a batch, the
+# objects of a lost batch are analysed again when the job is resumed.
+RECORD_BATCH_SIZE = 100
+RECORD_INTERVAL = 1.0
+
+
+class BulkJobJournal:
+    """Stores the bulk jobs and the progress of each of their objects in SQLite."""
+
+    def __init__(self, path):
+        """
+        Initializes the journal, its tables are created if needed.
+
+        :param path: The path of the SQLite file.
+        """
+        self.path = path
+        with closing(self._connect()) as connection, connection:
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS bulk_job ('
+                'id TEXT PRIMARY KEY, bucket TEXT NOT NULL, prefix TEXT NOT NULL, operations TEXT NOT NULL, '
+                'concurrency INTEGER NOT NULL, status TEXT NOT NULL, owner TEXT, stats TEXT, '
+                'created_at REAL NOT NULL, updated_at REAL NOT NULL)')
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS bulk_job_object ('
+                'job_id TEXT NOT NULL, key TEXT NOT NULL, etag TEXT, status TEXT NOT NULL, '
+                'result TEXT, updated_at REAL NOT NULL, PRIMARY KEY (job_id, key))')
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS analysed_object ('
+                'bucket TEXT NOT NULL, key TEXT NOT NULL, operations TEXT NOT NULL, etag TEXT, '
+                'analysed_at REAL NOT NULL, PRIMARY KEY (bucket, key, operations))')
+
+    def _connect(self):
+        connection = sqlite3.connect(self.path, timeout=30)
+        connection.row_factory = sqlite3.Row
+        return connection
+
+    def connect(self):
+        """
+        Opens a connection a job keeps for the checks and the writes of its objects.
+        It can be used from any thread, but by one thread at a time.
+        """
+        connection = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        connection.row_factory = sqlite3.Row
+        return connection
+
+    def create_job(self, bucket_name, prefix, operations, concurrency):
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with closing(self._connect()) as connection, connection:
+            connection.execute(
+                'INSERT INTO bulk_job (id, bucket, prefix, operations, concurrency, status, created_at, updated_at) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (job_id, bucket_name, prefix, json.dumps(operations), concurrency, PENDING, now, now))
+        return job_id
+
+    def get_job(self, job_id):
+        with closing(self._connect()) as connection:
+            job = connection.execute('SELECT * FROM bulk_job WHERE id = ?', (job_id,)).fetchone()
+            if job is None:
+                return None
+            counts = dict(connection.execute(
+                'SELECT status, COUNT(*) FROM bulk_job_object WHERE job_id = ? GROUP BY status', (job_id,)).fetchall())
+        return self._render_job(job, counts)
+
+    def get_status(self, job_id):
+        with closing(self._connect()) as connection:
+            row = connection.execute('SELECT status FROM bulk_job WHERE id = ?', (job_id,)).fetchone()
+        return row[0] if row is not None else None
+
+    def list_jobs(self):
+        with closing(self._connect()) as connection:
+            jobs = connection.execute('SELECT * FROM bulk_job ORDER BY created_at DESC').fetchall()
+        return [self._render_job(job) for job in jobs]
+
+    def set_status(self, job_id, status, stats=None):
+        owner = _process_owner() if status == RUNNING else None
+        with closing(self._connect()) as connection, connection:
+            if stats is None:
+                connection.execute('UPDATE bulk_job SET status = ?, owner = ?, updated_at = ? WHERE id = ?',
+                                   (status, owner, time.time(), job_id))
+            else:
+                connection.execute('UPDATE bulk_job SET status = ?, owner = ?, stats = ?, updated_at = ? WHERE id = ?',
+                                   (status, owner, json.dumps(stats), time.time(), job_id))
+
+    def interrupt_running_jobs(self):
+        """
+        Marks the jobs left running by a dead process of this host as interrupted, so
+        they can be resumed. The jobs of the other living processes are left alone.
+        """
+        host = socket.gethostname()
+        with closing(self._connect()) as connection, connection:
+            for job_id, owner in connection.execute(
+                    'SELECT id, owner FROM bulk_job WHERE status = ?', (RUNNING,)).fetchall():
+                owner_host, _, owner_pid = (owner or '').rpartition(':')
+                if owner_host == host and not _process_alive(int(owner_pid)):
+                    connection.execute('UPDATE bulk_job SET status = ?, owner = NULL, updated_at = ? WHERE id = ?',
+                                       (INTERRUPTED, time.time(), job_id))
+
+    def done_keys(self, job_id):
+        """
+        Gets the keys of the objects a job already analysed successfully.
+        """
+        with closing(self._connect()) as connection:
+            return {row[0] for row in connection.execute(
+                'SELECT key FROM bulk_job_object WHERE job_id = ? AND status = ?', (job_id, COMPLETED))}
+
+    def is_unchanged(self, bucket_name, key, operations, etag, connection=None):
+        """
+        Tells whether an object was already analysed successfully with the same operations and ETag.
+
+        :param connection: The connection of the job, see connect. A connection is
+                           opened for the check when this is not specified.
+        """
+        if etag is None:
+            return False
+        if connection is None:
+            with closing(self._connect()) as connection:
+                return self.is_unchanged(bucket_name, key, operations, etag, connection)
+
+        row = connection.execute(
+            'SELECT etag FROM analysed_object WHERE bucket = ? AND key = ? AND operations = ?',
+            (bucket_name, key, self._operations_key(operations))).fetchone()
+        return row is not None and row[0] == etag
+
+    def record_object(self, job_id, bucket_name, operations, record):
+        self.record_objects(job_id, bucket_name, operations, [record])
+
+    def record_objects(self, job_id, bucket_name, operations, records, connection=None):
+        """
+        Writes the results of objects in a single transaction.
+
+        :param connection: The connection of the job, see connect. A connection is
+                           opened for the write when this is not specified.
+        """
+        if connection is None:
+            with closing(self._connect()) as connection:
+                return self.record_objects(job_id, bucket_name, operations, records, connection)
+
+        now = time.time()
+        objects, analysed_objects = [], []
+        for record in records:
+            status = FAILED if record['errors'] and not record['results'] else COMPLETED
+            objects.append((job_id, record['key'], record['etag'], status, json.dumps(record), now))
+            if status == COMPLETED and not record['errors']:
+                analysed_objects.append(
+                    (bucket_name, record['key'], self._operations_key(operations), record['etag'], now))
+
+        with connection:
+            connection.executemany(
+                'INSERT OR REPLACE INTO bulk_job_object (job_id, key, etag, status, result, updated_at) '
+                'VALUES (?, ?, ?, ?, ?, ?)', objects)
+            connection.executemany(
+                'INSERT OR REPLACE INTO analysed_object (bucket, key, operations, etag, analysed_at) '
+                'VALUES (?, ?, ?, ?, ?)', analysed_objects)
+
+    def results(self, job_id, offset=0, limit=100):
+        with closing(self._connect()) as connection:
+            rows = connection.execute(
+                'SELECT result FROM bulk_job_object WHERE job_id = ? ORDER BY key LIMIT ? OFFSET ?',
+                (job_id, limit, offset)).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    @staticmethod
+    def _operations_key(operations):
+        return ','.join(sorted(operations))
+
+    @staticmethod
+    def _render_job(job, counts=None):
+        rendering = {
+            'id': job['id'],
+            'bucket': job['bucket'],
+            'prefix': job['prefix'],
+            'operations': json.loads(job['operations']),
+            'concurrency': job['concurrency'],
+            'status': job['status'],
+            'stats': json.loads(job['stats']) if job['stats'] else None,
+            'created_at': job['created_at'],
+            'updated_at': job['updated_at'],
+        }
+        if counts is not None:
+            rendering['objects'] = {
+                COMPLETED: counts.get(COMPLETED, 0),
+                FAILED: counts.get(FAILED, 0),
+            }
+        return rendering
+
+
+def _process_owner():
+    return '%s:%s' % (socket.gethostname(), os.getpid())
+
+
+def _process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class JournaledBulkAnalysisJob(BulkAnalysisJob):
+    """A bulk analysis whose progress is written to a BulkJobJournal."""
+
+    def __init__(self, journal, job_id, *args, **kwargs):
+        """
+        Initializes the job.
+
+        :param journal: The BulkJobJournal storing the progress.
+        :param job_id: The id of the job in the journal.
+        The other parameters are the ones of BulkAnalysisJob.
+        """
+        super().__init__(*args, **kwargs)
+        self.journal = journal
+        self.job_id = job_id
+        self.done_keys = set()
+        self._connection = None
+        self._connection_lock = threading.Lock()
+        self._records = []
+        self._recorded_at = time.monotonic()
+
+    async def run(self):
+        self.done_keys = await run_blocking(self.journal.done_keys, self.job_id)
+        self._connection = await run_blocking(self.journal.connect)
+        try:
+            return await super().run()
+        finally:
+            records, self._records = self._records, []
+            await run_blocking(self._close, records)
+
+    async def should_analyse(self, s3_object):
+        if self.stats.listed % CANCELLATION_CHECK_INTERVAL == 0 and \
+                await run_blocking(self.journal.get_status, self.job_id) == CANCELLED:
+            self.cancel()
+            return False
+        if not await super().should_analyse(s3_object) or s3_object['Key'] in self.done_keys:
+            return False
+        if await run_blocking(self._is_unchanged, s3_object['Key'], s3_object.get('ETag')):
+            self.stats.unchanged += 1
+            return False
+        return True
+
+    async def analyse_object(self, s3_object):
+        record = await super().analyse_object(s3_object)
+        self._records.append(record)
+        if len(self._records) >= RECORD_BATCH_SIZE or time.monotonic() - self._recorded_at >= RECORD_INTERVAL:
+            # the batch is taken on the event loop, the next records start a new one
+            records, self._records = self._records, []
+            self._recorded_at = time.monotonic()
+            await run_blocking(self._write, records)
+        return record
+
+    def _is_unchanged(self, key, etag):
+        with self._connection_lock:
+            return self.journal.is_unchanged(self.bucket_name, key, self.operations, etag, self._connection)
+
+    def _write(self, records):
+        with self._connection_lock:
+            self.journal.record_objects(self.job_id, self.bucket_name, self.operations, records, self._connection)
+
+    def _close(self, records):
+        try:
+            if records:
+                self._write(records)
+        finally:
+            with self._connection_lock:
+                self._connection.close()
+
+
+class BulkJobManager:
+    """Runs the journaled bulk jobs on background threads."""
+
+    def __init__(self, journal, bucket_manager):
+        """
+        Initializes the manager. The jobs left running by a dead process are
+        marked as interrupted.
+
+        :param journal: The BulkJobJournal storing the jobs.
+        :param bucket_manager: The AwsBucketManager listing the objects.
+        """
+        self.journal = journal
+        self.bucket_manager = bucket_manager
+        self._running = {}
+        self._lock = threading.Lock()
+        journal.interrupt_running_jobs()
+
+    def submit(self, bucket_name, prefix='', operations=('detect_faces',), concurrency=DEFAULT_CONCURRENCY):
+        """
+        Creates a job and starts it.
+
+        :return: The id of the job.
+        """
+        job_id = self.journal.create_job(bucket_name, prefix, list(operations), concurrency)
+        self._start(self.journal.get_job(job_id))
+        return job_id
+
+    def resume(self, job_id):
+        """
+        Restarts an interrupted, cancelled or failed job. The objects it already
+        analysed are skipped.
+
+        :return: False when the job can't be resumed.
+        """
+        job = self.journal.get_job(job_id)
+        if job is None or job['status'] not in RESUMABLE:
+            return False
+        return self._start(job)
+
+    def cancel(self, job_id):
+        """
+        Stops a job, it can be resumed later. A job run by another process notices
+        the cancellation the next time it checks its status.
+
+        :return: False when the job is not pending or running.
+        """
+        with self._lock:
+            job = self._running.get(job_id)
+            if job is not None:
+                job.cancel()
+                return True
+
+        stored_job = self.journal.get_job(job_id)
+        if stored_job is None or stored_job['status'] not in (PENDING, RUNNING):
+            return False
+        self.journal.set_status(job_id, CANCELLED)
+        return True
+
+    def status(self, job_id):
+        """
+        Gets a job, with its live stats when it is running.
+
+        :return: The job rendered to a dict, None when it doesn't exist.
+        """
+        job = self.journal.get_job(job_id)
+        if job is None:
+            return None
+        with self._lock:
+            running_job = self._running.get(job_id)
+        if running_job is not None:
+            job['stats'] = running_job.stats.to_dict()
+        return job
+
+    def _start(self, job):
+        with self._lock:
+            if job['id'] in self._running:
+                return False
+            running_job = JournaledBulkAnalysisJob(
+                self.journal, job['id'], self.bucket_manager, job['bucket'], job['prefix'],
+                job['operations'], job['concurrency'])
+            self._running[job['id']] = running_job
+
+        self.journal.set_status(job['id'], RUNNING)
+        threading.Thread(target=self._run, args=(running_job,), name='bulk-job-%s' % job['id'],
+                         daemon=True).start()
+        return True
+
+    def _run(self, running_job):
+        try:
+            stats = asyncio.run(running_job.run())
+            status = CANCELLED if running_job.cancelled else COMPLETED
+        except Exception:
+            logger.exception("Bulk job %s failed.", running_job.job_id)
+            stats = running_job.stats.to_dict()
+            status = FAILED
+
+        # a cancel or a resume sees the job running until its final status is written
+        with self._lock:
+            try:
+                self.journal.set_status(running_job.job_id, status, stats)
+            finally:
+                del self._running[running_job.job_id]
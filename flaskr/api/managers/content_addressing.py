@@ -0,0 +1,210 @@
+"""
+Purpose
+
+Stores the objects under a key computed from the SHA-256 of their content, so the
+same image uploaded under several names is stored once and two different images
+with the same name don't overwrite each other. An alias table maps the names the
+clients use to the content keys, so the objects are still reached by their name.
+An upload claims its content key before checking whether it is already stored, and
+a removal marks the content it deletes, so a content found stored is never deleted
+before the new name is aliased to it.
+"""
+
+import os
+import sqlite3
+import time
+import uuid
+from contextlib import closing
+
+CONTENT_PREFIX = 'sha256/'
+
+# The streamed uploads are stored under a temporary key until their hash is known
+INCOMING_PREFIX = 'incoming/'
+
+# The streamed uploads up to this size are hashed in memory, so a content already stored is not uploaded
+DEFAULT_BUFFER_SIZE = 8 * 1024 * 1024
+
+# The claim of a crashed upload stops protecting its content after this time
+CLAIM_TTL = 60 * 60
+
+# A deletion not finished after this time is considered crashed
+DELETION_TIMEOUT = 5 * 60
+
+
+def content_key(digest, object_name=''):
+    """
+    Builds the key of an object from the SHA-256 of its content. The extension of its
+    name is kept so the object keeps a recognizable type.
+
+    :param digest: The hexadecimal SHA-256 of the content.
+    :param object_name: The name of the object.
+    :return: The object key.
+    """
+    return CONTENT_PREFIX + digest + os.path.splitext(object_name)[1].lower()
+
+
+class ObjectAliasTable:
+    """Maps the names of the objects to their content keys in SQLite."""
+
+    def __init__(self, path):
+        """
+        Initializes the table, it is created if needed.
+
+        :param path: The path of the SQLite file.
+        """
+        self.path = path
+        with closing(self._connect()) as connection, connection:
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS object_alias ('
+                'bucket TEXT NOT NULL, name TEXT NOT NULL, object_key TEXT NOT NULL, created_at REAL NOT NULL, '
+                'PRIMARY KEY (bucket, name))')
+            connection.execute(
+                'CREATE INDEX IF NOT EXISTS object_alias_key ON object_alias (bucket, object_key)')
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS object_claim ('
+                'claim_id TEXT PRIMARY KEY, bucket TEXT NOT NULL, object_key TEXT NOT NULL, created_at REAL NOT NULL)')
+            connection.execute(
+                'CREATE INDEX IF NOT EXISTS object_claim_key ON object_claim (bucket, object_key)')
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS object_deletion ('
+                'bucket TEXT NOT NULL, object_key TEXT NOT NULL, started_at REAL NOT NULL, '
+                'PRIMARY KEY (bucket, object_key))')
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def claim(self, bucket_name, object_key):
+        """
+        Protects a content key from the removals until a name is aliased to it.
+
+        :return: A tuple. The first element is the id of the claim, to pass to set
+                 or release. The second element tells whether the content is being
+                 deleted, it must then be stored again once the deletion is done.
+        """
+        claim_id = uuid.uuid4().hex
+        with closing(self._connect()) as connection, connection:
+            connection.execute('BEGIN IMMEDIATE')
+            connection.execute(
+                'INSERT INTO object_claim (claim_id, bucket, object_key, created_at) VALUES (?, ?, ?, ?)',
+                (claim_id, bucket_name, object_key, time.time()))
+            return claim_id, self._deleting(connection, bucket_name, object_key)
+
+    def release(self, claim_id):
+        with closing(self._connect()) as connection, connection:
+            connection.execute('DELETE FROM object_claim WHERE claim_id = ?', (claim_id,))
+
+    def set(self, bucket_name, name, object_key, claim_id=None):
+        """
+        Points a name to a content key.
+
+        :param claim_id: The claim of the content key, released once the name points to it.
+        :return: The content key the name pointed to before, if it is no longer
+                 referenced by any name. It is marked as being deleted, call deleted
+                 once it is.
+        """
+        with closing(self._connect()) as connection, connection:
+            connection.execute('BEGIN IMMEDIATE')
+            previous = self._get(connection, bucket_name, name)
+            connection.execute(
+                'INSERT OR REPLACE INTO object_alias (bucket, name, object_key, created_at) VALUES (?, ?, ?, ?)',
+                (bucket_name, name, object_key, time.time()))
+            if claim_id is not None:
+                connection.execute('DELETE FROM object_claim WHERE claim_id = ?', (claim_id,))
+            if previous is not None and previous != object_key and not self._referenced(
+                    connection, bucket_name, previous):
+                self._start_deletion(connection, bucket_name, previous)
+                return previous
+        return None
+
+    def get(self, bucket_name, name):
+        """
+        Gets the content key of a name, None when the name has no alias.
+        """
+        with closing(self._connect()) as connection:
+            return self._get(connection, bucket_name, name)
+
+    def names(self, bucket_name, prefix=''):
+        """
+        Lists the names starting with a prefix.
+
+        :return: A dict that maps the names to their content keys.
+        """
+        with closing(self._connect()) as connection:
+            return dict(connection.execute(
+                'SELECT name, object_key FROM object_alias WHERE bucket = ? AND substr(name, 1, ?) = ?',
+                (bucket_name, len(prefix), prefix)).fetchall())
+
+    def restore(self, bucket_name, name, object_key):
+        """
+        Points a removed name back to its content key, when its content couldn't be
+        deleted. A name aliased again since it was removed is left unchanged.
+        """
+        with closing(self._connect()) as connection, connection:
+            connection.execute(
+                'INSERT OR IGNORE INTO object_alias (bucket, name, object_key, created_at) VALUES (?, ?, ?, ?)',
+                (bucket_name, name, object_key, time.time()))
+
+    def remove(self, bucket_name, name):
+        """
+        Removes the alias of a name.
+
+        :return: A tuple. The first element is the content key of the name, None
+                 when the name has no alias. The second element tells whether the
+                 content key is still referenced by another name or claimed by an
+                 upload. A content no longer referenced is marked as being deleted,
+                 call deleted once it is.
+        """
+        with closing(self._connect()) as connection, connection:
+            connection.execute('BEGIN IMMEDIATE')
+            object_key = self._get(connection, bucket_name, name)
+            if object_key is None:
+                return None, False
+            connection.execute('DELETE FROM object_alias WHERE bucket = ? AND name = ?', (bucket_name, name))
+            referenced = self._referenced(connection, bucket_name, object_key)
+            if not referenced:
+                self._start_deletion(connection, bucket_name, object_key)
+            return object_key, referenced
+
+    def deleted(self, bucket_name, object_key):
+        """
+        Ends the deletion of a content, the uploads waiting for it can store it again.
+        """
+        with closing(self._connect()) as connection, connection:
+            connection.execute('DELETE FROM object_deletion WHERE bucket = ? AND object_key = ?',
+                               (bucket_name, object_key))
+
+    def deleting(self, bucket_name, object_key):
+        """
+        Tells whether a content is being deleted.
+        """
+        with closing(self._connect()) as connection:
+            return self._deleting(connection, bucket_name, object_key)
+
+    def remove_bucket(self, bucket_name):
+        with closing(self._connect()) as connection, connection:
+            for table in ('object_alias', 'object_claim', 'object_deletion'):
+                connection.execute('DELETE FROM %s WHERE bucket = ?' % table, (bucket_name,))
+
+    @staticmethod
+    def _get(connection, bucket_name, name):
+        row = connection.execute(
+            'SELECT object_key FROM object_alias WHERE bucket = ? AND name = ?', (bucket_name, name)).fetchone()
+        return row[0] if row is not None else None
+
+    @staticmethod
+    def _referenced(connection, bucket_name, object_key):
+        return connection.execute(
+            'SELECT 1 FROM object_alias WHERE bucket = ? AND object_key = ? '
+            'UNION ALL SELECT 1 FROM object_claim WHERE bucket = ? AND object_key = ? AND created_at > ? LIMIT 1',
+            (bucket_name, object_key, bucket_name, object_key, time.time() - CLAIM_TTL)).fetchone() is not None
+
+    @staticmethod
+    def _deleting(connection, bucket_name, object_key):
+        return connection.execute(
+            'SELECT 1 FROM object_deletion WHERE bucket = ? AND object_key = ? AND started_at > ?',
+            (bucket_name, object_key, time.time() - DELETION_TIMEOUT)).fetchone() is not None
+
+    @staticmethod
+    def _start_deletion(connection, bucket_name, object_key):
+        connection.execute('INSERT OR REPLACE INTO object_deletion (bucket, object_key, started_at) VALUES (?, ?, ?)',
+                           (bucket_name, object_key, time.time()))
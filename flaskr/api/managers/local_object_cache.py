@@ -0,0 +1,252 @@
+"""
+Purpose
+
+Keeps the objects downloaded from Amazon S3 in a bounded local folder, so they are
+reused across requests instead of downloaded again. The files are named after the
+SHA-256 of their content, so two objects sharing a name never shadow each other,
+and an index in SQLite maps each object, with its ETag, to its file. A content is
+kept in a single file, named with the extension of the first object cached with it,
+so the objects sharing a content share its file. The least
+recently used files are evicted once the folder holds more than its maximum size,
+except the files used in the last seconds, which a request may be about to send.
+The files are written to a temporary file first then renamed, so a reader never
+sees a partly written file, and the index is shared by the processes of the node.
+"""
+
+import hashlib
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from contextlib import closing
+
+DEFAULT_MAX_BYTES = 1024 * 1024 * 1024
+
+INDEX_FILE_NAME = 'index.sqlite'
+TEMPORARY_PREFIX = '.tmp-'
+
+# The temporary files older than this are left by a crashed writer
+STALE_TEMPORARY_AGE = 60 * 60
+
+# The files used in the last seconds are not evicted, the path returned by get is
+# opened by the request after get returned
+DEFAULT_GRACE_PERIOD = 60
+
+
+class LocalObjectCache:
+    """Stores files by content hash in a folder bounded by its total size."""
+
+    def __init__(self, folder, max_bytes=DEFAULT_MAX_BYTES, grace_period=DEFAULT_GRACE_PERIOD):
+        """
+        Initializes the cache, its folder and index are created if needed.
+
+        :param folder: The folder the files are stored in.
+        :param max_bytes: The maximum total size of the files. It can be exceeded
+                          by the files used in the last grace_period seconds.
+        :param grace_period: The number of seconds a file is kept after it was used.
+        """
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.grace_period = grace_period
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        os.makedirs(folder, exist_ok=True)
+        with closing(self._connect()) as connection, connection:
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS cached_file ('
+                'digest TEXT PRIMARY KEY, path TEXT NOT NULL, size INTEGER NOT NULL, accessed_at REAL NOT NULL)')
+            connection.execute(
+                'CREATE INDEX IF NOT EXISTS cached_file_accessed_at ON cached_file (accessed_at)')
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS cached_object ('
+                'namespace TEXT NOT NULL, name TEXT NOT NULL, version TEXT, digest TEXT NOT NULL, '
+                'PRIMARY KEY (namespace, name))')
+        self._remove_stale_temporary_files()
+
+    def _connect(self):
+        return sqlite3.connect(os.path.join(self.folder, INDEX_FILE_NAME), timeout=30)
+
+    def get(self, namespace, name, version=None):
+        """
+        Gets the path of the cached file of an object, and marks it as recently used.
+
+        :param namespace: The namespace of the object, such as its bucket.
+        :param name: The name of the object.
+        :param version: The version of the object, such as its ETag. The file of
+                        another version is not returned.
+        :return: The path of the file, None when the object is not cached.
+        """
+        with closing(self._connect()) as connection, connection:
+            row = connection.execute(
+                'SELECT cached_file.digest, cached_file.path FROM cached_object '
+                'JOIN cached_file ON cached_file.digest = cached_object.digest '
+                'WHERE namespace = ? AND name = ? AND version IS ?', (namespace, name, version)).fetchone()
+            # a file evicted by another process may still be indexed for a moment
+            path = row[1] if row is not None and os.path.exists(row[1]) else None
+            if path is not None:
+                connection.execute('UPDATE cached_file SET accessed_at = ? WHERE digest = ?', (time.time(), row[0]))
+
+        with self._lock:
+            if path is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+        return path
+
+    def put(self, namespace, name, write, version=None, extension=''):
+        """
+        Caches the file of an object.
+
+        :param namespace: The namespace of the object, such as its bucket.
+        :param name: The name of the object.
+        :param write: The function writing the file, it receives the path of a
+                      temporary file to write to.
+        :param version: The version of the object, such as its ETag.
+        :param extension: The extension of the file, to keep a recognizable type.
+        :return: The path of the file.
+        """
+        descriptor, temporary_path = tempfile.mkstemp(prefix=TEMPORARY_PREFIX, dir=self.folder)
+        os.close(descriptor)
+
+        try:
+            write(temporary_path)
+            digest = _file_digest(temporary_path)
+            size = os.path.getsize(temporary_path)
+
+            now = time.time()
+            with closing(self._connect()) as connection, connection:
+                # the other writers wait, so a content is stored in a single indexed file
+                connection.execute('BEGIN IMMEDIATE')
+                row = connection.execute('SELECT path FROM cached_file WHERE digest = ?', (digest,)).fetchone()
+                if row is not None and os.path.exists(row[0]):
+                    # the content is already stored, under the extension of its first object
+                    path = row[0]
+                    os.remove(temporary_path)
+                else:
+                    path = os.path.join(self.folder, digest[:2], digest + extension.lower())
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    # the rename is atomic, a reader never sees a partly written file
+                    os.replace(temporary_path, path)
+                connection.execute(
+                    'INSERT OR REPLACE INTO cached_file (digest, path, size, accessed_at) VALUES (?, ?, ?, ?)',
+                    (digest, path, size, now))
+                connection.execute(
+                    'INSERT OR REPLACE INTO cached_object (namespace, name, version, digest) VALUES (?, ?, ?, ?)',
+                    (namespace, name, version, digest))
+        except BaseException:
+            if os.path.exists(temporary_path):
+                os.remove(temporary_path)
+            raise
+
+        self.evict(keep=digest)
+        return path
+
+    def put_bytes(self, namespace, name, data, version=None, extension=''):
+        def write(path):
+            with open(path, 'wb') as file:
+                file.write(data)
+
+        return self.put(namespace, name, write, version, extension)
+
+    def remove(self, namespace, name=None):
+        """
+        Forgets an object, or every object of a namespace. Their files are evicted
+        like the others once they are not used anymore.
+        """
+        with closing(self._connect()) as connection, connection:
+            if name is None:
+                connection.execute('DELETE FROM cached_object WHERE namespace = ?', (namespace,))
+            else:
+                connection.execute('DELETE FROM cached_object WHERE namespace = ? AND name = ?', (namespace, name))
+
+    def evict(self, keep=None):
+        """
+        Removes the least recently used files until the total size fits in max_bytes.
+        The files used in the last grace_period seconds are kept.
+
+        :param keep: The digest of a file that must not be evicted, such as the one
+                     just written.
+        """
+        evicted = []
+        with closing(self._connect()) as connection, connection:
+            # the writes of the other processes wait while the files to evict are chosen
+            connection.execute('BEGIN IMMEDIATE')
+            total = connection.execute('SELECT COALESCE(SUM(size), 0) FROM cached_file').fetchone()[0]
+            if total <= self.max_bytes:
+                return
+
+            used_after = time.time() - self.grace_period
+            for digest, path, size, accessed_at in connection.execute(
+                    'SELECT digest, path, size, accessed_at FROM cached_file ORDER BY accessed_at').fetchall():
+                if total <= self.max_bytes or accessed_at > used_after:
+                    break
+                if digest == keep:
+                    continue
+                evicted.append((digest, path))
+                total -= size
+
+            for digest, _ in evicted:
+                connection.execute('DELETE FROM cached_object WHERE digest = ?', (digest,))
+                connection.execute('DELETE FROM cached_file WHERE digest = ?', (digest,))
+
+        for _, path in evicted:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+        with self._lock:
+            self.evictions += len(evicted)
+
+    def clear(self):
+        """
+        Removes every cached file.
+        """
+        with closing(self._connect()) as connection, connection:
+            paths = [row[0] for row in connection.execute('SELECT path FROM cached_file')]
+            connection.execute('DELETE FROM cached_object')
+            connection.execute('DELETE FROM cached_file')
+
+        for path in paths:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def _remove_stale_temporary_files(self):
+        stale_before = time.time() - STALE_TEMPORARY_AGE
+        for file_name in os.listdir(self.folder):
+            path = os.path.join(self.folder, file_name)
+            try:
+                if file_name.startswith(TEMPORARY_PREFIX) and os.path.getmtime(path) < stale_before:
+                    os.remove(path)
+            except OSError:
+                pass
+
+    def stats(self):
+        with closing(self._connect()) as connection:
+            files, size = connection.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM cached_file').fetchone()
+
+        with self._lock:
+            return {
+                'files': files,
+                'bytes': size,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+
+def _file_digest(file_path):
+    sha256 = hashlib.sha256()
+
+    with open(file_path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1024 * 1024), b''):
+            sha256.update(chunk)
+
+    return sha256.hexdigest()
@@ -11,25 +11,79 @@ without cloning the GitHub repository, you must first download the image files f
     https://github.com/awsdocs/aws-doc-sdk-examples/tree/master/python/example_code/rekognition/.media
 """
 
+import asyncio
 import json
 import logging
+import threading
 from pprint import pprint
-import boto3
 from botocore.exceptions import ClientError
 #from flask import request as requests
-import requests
+from flaskr.api.helpers.async_io_helper import run_blocking
+from flaskr.api.helpers.aws_client_registry import get_client
+from flaskr.api.helpers.hedging import hedger
+from flaskr.api.helpers.image_fetcher import image_fetcher
+from flaskr.api.helpers.image_optimizer import image_optimizer
+from flaskr.api.helpers.rate_limiter import rate_limiter
+from flaskr.api.helpers.region_router import region_router
+from flaskr.api.helpers.single_flight import SingleFlight
+from flaskr.api.managers.rekognition_result_cache import RekognitionResultCache, result_cache
 from flaskr.api.managers.rekognition_objects import RekognitionFace, RekognitionCelebrity, RekognitionLabel, RekognitionModerationLabel, RekognitionText, show_bounding_boxes, show_polygons
 
 logger = logging.getLogger(__name__)
 
+single_flight = SingleFlight()
+
+
+def get_rekognition_client():
+    """
+    Gets the shared Rekognition client, or the region_router spreading the calls
+    over several regions when REKOGNITION_REGIONS is set.
+
+    :return: An object used like a Boto3 Rekognition client.
+    """
+    if region_router is not None:
+        return region_router
+    return get_client('rekognition')
+
+
+def _blob(image_bytes):
+    """
+    Boto3 only accepts bytes or a bytearray as image bytes. A memoryview spanning a
+    whole buffer is unwrapped to that buffer, so it is not copied.
+
+    :param image_bytes: The bytes of the image, or a memoryview of them.
+    :return: The bytes of the image, as bytes or a bytearray.
+    """
+    if not isinstance(image_bytes, memoryview):
+        return image_bytes
+    if image_bytes.contiguous and isinstance(image_bytes.obj, (bytes, bytearray)) \
+            and image_bytes.nbytes == len(image_bytes.obj):
+        return image_bytes.obj
+    return image_bytes.tobytes()
+
 
 class RekognitionImage:
     """
     Encapsulates an Amazon Rekognition image. This class is a thin wrapper
     around parts of the Boto3 Amazon Rekognition API.
+    The responses are cached by result_cache, set it to None to disable caching.
+    Identical concurrent calls are coalesced by single_flight, so a burst of
+    requests for the same image only calls Rekognition once.
+    The images read from bytes are shrunk by image_optimizer before they are sent.
+    They are cached by the digest of their original bytes, so an image already
+    analysed is answered from the cache without being optimized again.
+    The calls are paced by rate_limiter, which retries the throttled ones. When the
+    calls are spread over several regions, region_router paces them in each region.
+    The slow calls are sent twice by hedger, when it is enabled.
     """
 
-    def __init__(self, image, image_name, rekognition_client):
+    result_cache = result_cache
+    single_flight = single_flight
+    image_optimizer = image_optimizer
+    rate_limiter = rate_limiter if region_router is None else None
+    hedger = hedger
+
+    def __init__(self, image, image_name, rekognition_client, source=None):
         """
         Initializes the image object.
 
@@ -37,13 +91,20 @@ class RekognitionImage:
                       an Amazon S3 bucket and object key.
         :param image_name: The name of the image.
         :param rekognition_client: A Boto3 Rekognition client.
+        :param source: The (bucket, object) the image is stored in, if any. Cached
+                       results are invalidated when this object is removed.
         """
         self.image = image
         self.image_name = image_name
         self.rekognition_client = rekognition_client
+        self.source = source
+        self.optimization = None
+        self._digest = None
+        self._unoptimized = False
+        self._optimize_lock = threading.Lock()
 
     @classmethod
-    def from_file(cls, image_file_name, rekognition_client, image_name=None):
+    def from_file(cls, image_file_name, rekognition_client, image_name=None, source=None):
         """
         Creates a RekognitionImage object from a local file.
 
@@ -52,13 +113,34 @@ class RekognitionImage:
         :param rekognition_client: A Boto3 Rekognition client.
         :param image_name: The name of the image. If this is not specified, the
                            file name is used as the image name.
+        :param source: The (bucket, object) the file was downloaded from, if any.
         :return: The RekognitionImage object, initialized with image bytes from the
                  file.
         """
         with open(image_file_name, 'rb') as img_file:
-            image = {'Bytes': img_file.read()}
+            image_bytes = img_file.read()
         name = image_file_name if image_name is None else image_name
-        return cls(image, name, rekognition_client)
+        return cls.from_bytes(image_bytes, name, rekognition_client, source)
+
+    @classmethod
+    def from_bytes(cls, image_bytes, image_name, rekognition_client, source=None, digest=None):
+        """
+        Creates a RekognitionImage object from image bytes already in memory.
+
+        :param image_bytes: The bytes of the image, or a memoryview of them, such as
+                            the buffer filled by AwsBucketManager.fetch_object.
+        :param image_name: The name of the image.
+        :param rekognition_client: A Boto3 Rekognition client.
+        :param source: The (bucket, object) the image is stored in, if any.
+        :param digest: The SHA-256 of the image bytes, if it is already known.
+        :return: The RekognitionImage object, initialized with the image bytes. They
+                 are optimized by image_optimizer, if it is enabled, by the first
+                 request which is not answered from the result cache.
+        """
+        image = cls({'Bytes': _blob(image_bytes)}, image_name, rekognition_client, source)
+        image._unoptimized = cls.image_optimizer is not None
+        image._digest = digest
+        return image
 
     @classmethod
     def from_bucket(cls, s3_object, rekognition_client):
@@ -66,7 +148,9 @@ class RekognitionImage:
         Creates a RekognitionImage object from an Amazon S3 object.
 
         :param s3_object: An Amazon S3 object that identifies the image. The image
-                          is not retrieved until needed for a later call.
+                          is not retrieved until needed for a later call. When it
+                          has an e_tag, cached results of a previous version of the
+                          object are not reused.
         :param rekognition_client: A Boto3 Rekognition client.
         :return: The RekognitionImage object, initialized with Amazon S3 object data.
         """
@@ -76,16 +160,112 @@ class RekognitionImage:
                 'Name': s3_object.key
             }
         }
-        return cls(image, s3_object.key, rekognition_client)
+        rekognition_image = cls(image, s3_object.key, rekognition_client,
+                                (s3_object.bucket_name, s3_object.key))
+        rekognition_image._digest = RekognitionResultCache.image_digest(image, getattr(s3_object, 'e_tag', None))
+        return rekognition_image
+
+    @property
+    def digest(self):
+        """
+        The SHA-256 of the original image bytes, or of the Amazon S3 reference of the image.
+        """
+        if self._digest is None:
+            self._digest = RekognitionResultCache.image_digest(self.image)
+        return self._digest
+
+    def optimize(self):
+        """
+        Shrinks the image bytes with image_optimizer, once. The digest is computed
+        before, so the cached results of the original image are still found.
+        This decodes the image, call it from a worker thread.
+        """
+        with self._optimize_lock:
+            if not self._unoptimized:
+                return
+            self.digest
+            image_bytes, self.optimization = self.image_optimizer.optimize(self.image['Bytes'])
+            self.image = {'Bytes': _blob(image_bytes)}
+            self._unoptimized = False
+
+    def _call(self, operation, **params):
+        """
+        Calls a Rekognition operation on the image, through the result cache.
+
+        :param operation: The name of the Boto3 Rekognition client method.
+        :param params: The parameters of the operation, except the image.
+        :return: The response of the operation, without its metadata.
+        """
+        key = RekognitionResultCache.make_key(self.digest, operation, params)
+        if self.result_cache is not None:
+            response = self.result_cache.get(key)
+            if response is not None:
+                logger.info("Got cached %s response for %s.", operation, self.image_name)
+                return response
+
+        if self.single_flight is not None:
+            return self.single_flight.do(key, self._invoke, key, operation, params)
+        return self._invoke(key, operation, params)
+
+    def _invoke(self, key, operation, params):
+        """
+        Sends a Rekognition request and caches its response.
+
+        :param key: The cache key of the request.
+        :param operation: The name of the Boto3 Rekognition client method.
+        :param params: The parameters of the operation, except the image.
+        :return: The response of the operation, without its metadata.
+        """
+        self.optimize()
+        if self.hedger is not None:
+            may_hedge = None if self.rate_limiter is None else lambda: self.rate_limiter.try_acquire(operation)
+            response = self.hedger.call(
+                operation, lambda hedge: self._send(operation, params, hedge), may_hedge)
+        else:
+            response = self._send(operation, params)
+        response = {name: value for name, value in response.items() if name != 'ResponseMetadata'}
+
+        if self.result_cache is not None:
+            self.result_cache.set(key, response, self.source)
+        return response
+
+    def _send(self, operation, params, hedge=False):
+        """
+        Sends a Rekognition request through the rate limiter.
 
-    def detect_faces(self):
+        :param operation: The name of the Boto3 Rekognition client method.
+        :param params: The parameters of the operation, except the image.
+        :param hedge: True when the request duplicates a slow one. Its token was
+                      already taken from the rate limiter and it is not retried.
+        :return: The response of the operation.
+        """
+        send = getattr(self.rekognition_client, operation)
+        if self.hedger is not None:
+            # the hedging delay only follows the service latency, not the waits for a token
+            send = self.hedger.timed(operation, send)
+        if self.rate_limiter is None:
+            return send(Image=self.image, **params)
+        if not hedge:
+            return self.rate_limiter.call(operation, send, Image=self.image, **params)
+
+        try:
+            response = send(Image=self.image, **params)
+        except Exception as error:
+            self.rate_limiter.record(operation, error)
+            raise
+        self.rate_limiter.record(operation)
+        return response
+
+    def detect_faces(self, attributes=None):
         """
         Detects faces in the image.
 
+        :param attributes: The face attributes to return, ['DEFAULT'] or ['ALL'].
+                           All the attributes are returned when this is not specified.
         :return: The list of faces found in the image.
         """
         try:
-            response = self.rekognition_client.detect_faces(Image=self.image, Attributes=['ALL'])
+            response = self._call('detect_faces', Attributes=attributes or ['ALL'])
             faces = [RekognitionFace(face) for face in response['FaceDetails']]
             logger.info("Detected %s faces.", len(faces))
         except ClientError:
@@ -105,6 +285,8 @@ class RekognitionImage:
                  reference image. The second element is the list of faces that have
                  a similarity value below the specified threshold.
         """
+        self.optimize()
+        target_image.optimize()
         try:
             response = self.rekognition_client.compare_faces(
                 SourceImage=self.image,
@@ -134,8 +316,7 @@ class RekognitionImage:
         :return: The list of labels detected in the image.
         """
         try:
-            response = self.rekognition_client.detect_labels(
-                Image=self.image, MaxLabels=max_labels)
+            response = self._call('detect_labels', MaxLabels=max_labels)
             labels = [RekognitionLabel(label) for label in response['Labels']]
             logger.info("Found %s labels in %s.", len(labels), self.image_name)
         except ClientError:
@@ -152,8 +333,7 @@ class RekognitionImage:
         :return: The list of moderation labels found in the image.
         """
         try:
-            response = self.rekognition_client.detect_moderation_labels(
-                Image=self.image)
+            response = self._call('detect_moderation_labels')
             labels = [
                 RekognitionModerationLabel(label)
                 for label in response['ModerationLabels']
@@ -174,7 +354,7 @@ class RekognitionImage:
         :return The list of text elements found in the image.
         """
         try:
-            response = self.rekognition_client.detect_text(Image=self.image)
+            response = self._call('detect_text')
             texts = [
                 RekognitionText(text) for text in response['TextDetections']
             ]
@@ -194,8 +374,7 @@ class RekognitionImage:
                  detected but did not match any known celebrities.
         """
         try:
-            response = self.rekognition_client.recognize_celebrities(
-                Image=self.image)
+            response = self._call('recognize_celebrities')
             celebrities = [
                 RekognitionCelebrity(celeb)
                 for celeb in response['CelebrityFaces']
@@ -213,25 +392,93 @@ class RekognitionImage:
             return celebrities, other_faces
 
 
-def face_from_url(url, shoulDisplayImageBoundingBox):
-    print('-' * 88)
-    print("Face Rekognition Demo ")
-    print('-' * 88)
+def _render_celebrities(result):
+    celebrities, other_faces = result
+    return {
+        'celebrities': [celebrity.to_dict() for celebrity in celebrities],
+        'other_faces': [face.to_dict_args() for face in other_faces],
+    }
+
+
+# For each operation that can be combined in one analysis, a tuple of the
+# function running it on an image and of the function rendering its result
+ANALYSIS_OPERATIONS = {
+    'detect_faces': (
+        lambda image, max_labels: image.detect_faces(),
+        lambda faces: [face.to_dict_args() for face in faces]),
+    'detect_labels': (
+        lambda image, max_labels: image.detect_labels(max_labels),
+        lambda labels: [label.to_dict() for label in labels]),
+    'detect_moderation_labels': (
+        lambda image, max_labels: image.detect_moderation_labels(),
+        lambda labels: [label.to_dict() for label in labels]),
+    'detect_text': (
+        lambda image, max_labels: image.detect_text(),
+        lambda texts: [text.to_dict() for text in texts]),
+    'recognize_celebrities': (
+        lambda image, max_labels: image.recognize_celebrities(),
+        _render_celebrities),
+}
+
+
+async def run_operations(image, operations, max_labels=10, timer=None):
+    """
+    Runs several Rekognition operations on the same image at the same time.
 
-    logging.basicConfig(level=logging.INFO,
-                        format='%(levelname)s: %(message)s')
-    rekognition_client = boto3.client('rekognition')
+    :param image: The RekognitionImage to analyse.
+    :param operations: The names of the operations to run, see ANALYSIS_OPERATIONS.
+    :param max_labels: The maximum number of labels returned by detect_labels.
+    :param timer: A StageTimer measuring the duration of each operation, if any.
+    :return: A dict of the result of each operation, or of the exception it raised.
+    """
+    unknown = [operation for operation in operations if operation not in ANALYSIS_OPERATIONS]
+    if unknown:
+        raise ValueError("Unknown operations : %s" % ', '.join(unknown))
+
+    operations = list(dict.fromkeys(operations))
+    calls = [run_blocking(ANALYSIS_OPERATIONS[operation][0], image, max_labels) for operation in operations]
+    if timer is not None:
+        calls = [timer.measure(operation, call) for operation, call in zip(operations, calls)]
+
+    return dict(zip(operations, await asyncio.gather(*calls, return_exceptions=True)))
+
+
+async def analyse_image(image, operations, max_labels=10, timer=None):
+    """
+    Runs several Rekognition operations on the same image at the same time and
+    merges their results.
+
+    :param image: The RekognitionImage to analyse.
+    :param operations: The names of the operations to run, see ANALYSIS_OPERATIONS.
+    :param max_labels: The maximum number of labels returned by detect_labels.
+    :param timer: A StageTimer measuring the duration of each operation, if any.
+    :return: A tuple. The first element is a dict of the rendered results by
+             operation. The second element is a dict of the error messages of the
+             operations that failed.
+    """
+    results = {}
+    errors = {}
+    for operation, result in (await run_operations(image, operations, max_labels, timer)).items():
+        if isinstance(result, Exception):
+            errors[operation] = str(result)
+        else:
+            results[operation] = ANALYSIS_OPERATIONS[operation][1](result)
 
-    image_response = requests.get(url)
-    print(image_response.content)
-    image = RekognitionImage({'Bytes': image_response.content}, "image",
-                             rekognition_client)
+    return results, errors
 
-    print(f"Detecting faces in {image.image_name}...")
+
+def face_from_url(url, shoulDisplayImageBoundingBox):
+    rekognition_client = get_rekognition_client()
+
+    # a pooled session with timeouts and a size limit, an unchanged image is not downloaded again
+    image_bytes, digest = image_fetcher.fetch(url)
+    image = RekognitionImage.from_bytes(image_bytes, url, rekognition_client, digest=digest)
+
+    logger.info("Detecting faces in %s...", image.image_name)
     faces = image.detect_faces()
     faces_list = []
 
-    print(f"Found {len(faces)} faces, here are the first three.")
+    logger.info("Found %s faces, here are the first three.", len(faces))
     for face in faces[:3]:
         faces_list.append(face.to_dict())
 
@@ -240,49 +487,56 @@ def face_from_url(url, shoulDisplayImageBoundingBox):
             image.image['Bytes'], [
                 [face.bounding_box for face in faces]],
             ['aqua'])
-    
-    print("Thanks for watching!")
-    print('-'*88)
-    
+
     return faces_list
 
 
 def face_from_local_file(url, shoulDisplayImageBoundingBox=False, args=None):
 
+    file_name = "flaskr/images/" + url
+
+    with open(file_name, 'rb') as img_file:
+        image_bytes = img_file.read()
+
+    return face_from_bytes(image_bytes, file_name, shoulDisplayImageBoundingBox, args)
+
+
+def face_from_bytes(image_bytes, image_name, shoulDisplayImageBoundingBox=False, args=None, source=None, digest=None):
+
     faces_list = []
 
     logging.basicConfig(level=logging.INFO,
                         format='%(levelname)s: %(message)s')
-    rekognition_client = boto3.client('rekognition')
+    rekognition_client = get_rekognition_client()
 
-    file_name = "flaskr/images/" + url
+    image = RekognitionImage.from_bytes(image_bytes, image_name, rekognition_client, source, digest)
 
-    image = RekognitionImage.from_file(file_name, rekognition_client)
+    # If arg is not None, then it is a list of arguments
+    # split the arg into list and only request the attributes they need
+    arg_list = args.split(',') if args is not None else None
+    attributes = RekognitionFace.required_attributes(arg_list) if arg_list is not None else None
 
-    faces = image.detect_faces()             
+    faces = image.detect_faces(attributes)
         
     # Display the image and bounding boxes of each face.
     if shoulDisplayImageBoundingBox:
         show_bounding_boxes(image.image['Bytes'],
                             [[face.bounding_box for face in faces]], ['aqua'])
 
-    # If arg is not None, then it is a list of arguments
-    # split the arg into list
-    if args is not None:
-        arg_list = args.split(',')
+    if arg_list is not None:
         # List of all attributes returned
         attributes = []
 
-        # get faces in the correct format
+        # get faces in the correct format, with the requested fields only
         for face in faces[:3]:
-            faces_list.append(face.to_dict_args())
+            faces_list.append(face.to_dict_args(arg_list))
 
         # get the attributes
         for arg in arg_list:
             attribute_list = []
             for face in faces_list:
                 # get the interested attribute with the argument
-                attribute_list.append(face[arg])
+                attribute_list.append(face.get(arg))
             data = { arg : attribute_list}
             attributes.append(data)
 
@@ -303,7 +557,7 @@ def celebrity_demo():
 
     logging.basicConfig(level=logging.INFO,
                         format='%(levelname)s: %(message)s')
-    rekognition_client = boto3.client('rekognition')
+    rekognition_client = get_rekognition_client()
     celebrity_file_name = "flaskr/images/pexels-pixabay-53370.jpg"
     celebrity_image = RekognitionImage.from_file(celebrity_file_name,
                                                  rekognition_client)
@@ -55,6 +55,29 @@ def show_polygons(image_bytes, polygons, color):
 class RekognitionFace:
     """Encapsulates an Amazon Rekognition face."""
 
+    # The DetectFaces attributes needed by each field rendered by to_dict_args
+    FIELD_ATTRIBUTES = {
+        'bounding_box': 'DEFAULT',
+        'gender': 'ALL',
+        'emotions': 'ALL',
+        'face_id': 'DEFAULT',
+        'image_id': 'DEFAULT',
+        'timestamp': 'DEFAULT',
+        'confidence': 'DEFAULT',
+        'age_range': 'ALL',
+        'smile': 'ALL',
+        'eyeglasses': 'ALL',
+        'sunglasses': 'ALL',
+        'beard': 'ALL',
+        'mustache': 'ALL',
+        'eyes_open': 'ALL',
+        'mouth_open': 'ALL',
+        'pose': 'DEFAULT',
+        'quality': 'DEFAULT',
+        'landmarks': 'DEFAULT',
+        'has': 'ALL',
+    }
+
     def __init__(self, face, timestamp=None):
         """
         Initializes the face object.
@@ -93,60 +116,43 @@ class RekognitionFace:
     def to_dict(self):
         return json.dumps(self.__dict__)
 
-    def to_dict_args(self):
-
+    def to_dict_args(self, fields=None):
         """
         Renders some of the face data to a dict.
 
+        :param fields: The fields to render, see FIELD_ATTRIBUTES. When this is not
+                       specified, every field except the landmarks is rendered.
+                       Only the requested fields are computed.
         :return: A dict that contains the face data.
         """
+        if fields is None:
+            fields = [field for field in self.FIELD_ATTRIBUTES if field != 'landmarks']
+
         rendering = {}
-        if self.bounding_box is not None:
-            rendering['bounding_box'] = self.bounding_box
-        if self.gender is not None:
-            rendering['gender'] = self.gender
-        if self.emotions:
-            rendering['emotions'] = self.emotions
-        if self.face_id is not None:
-            rendering['face_id'] = self.face_id
-        if self.image_id is not None:
-            rendering['image_id'] = self.image_id
-        if self.timestamp is not None:
-            rendering['timestamp'] = self.timestamp
-        
-        if self.confidence is not None:
-            rendering['confidence'] = self.confidence
-
-        if self.age_range is not None:
-            rendering['age_range'] = self.age_range
-
-        if self.smile is not None:
-            rendering['smile'] = self.smile
-
-        if self.eyeglasses is not None:
-            rendering['eyeglasses'] = self.eyeglasses
-        
-        if self.sunglasses is not None:
-            rendering['sunglasses'] = self.sunglasses
-        
-        if self.beard is not None:
-            rendering['beard'] = self.beard
-
-        if self.mustache is not None:
-            rendering['mustache'] = self.mustache
-        
-        if self.eyes_open is not None:
-            rendering['eyes_open'] = self.eyes_open
-
-        if self.mouth_open is not None:
-            rendering['mouth_open'] = self.mouth_open
-        
-        if self.pose is not None:
-            rendering['pose'] = self.pose
-        
-        if self.quality is not None:
-            rendering['quality'] = self.quality
+        for field in fields:
+            value = self._has() if field == 'has' else getattr(self, field)
+            if value is not None and (value or field not in ('emotions', 'has')):
+                rendering[field] = value
+        return rendering
+
+    @classmethod
+    def required_attributes(cls, fields):
+        """
+        Plans the DetectFaces attributes needed to render some fields, DEFAULT is
+        cheaper and returns a smaller payload than ALL.
 
+        :param fields: The fields to render, see FIELD_ATTRIBUTES.
+        :return: The Attributes parameter of DetectFaces.
+        """
+        unknown = [field for field in fields if field not in cls.FIELD_ATTRIBUTES]
+        if unknown:
+            raise ValueError("Unknown face fields : %s" % ', '.join(unknown))
+
+        if all(cls.FIELD_ATTRIBUTES[field] == 'DEFAULT' for field in fields):
+            return ['DEFAULT']
+        return ['ALL']
+
+    def _has(self):
         has = []
         if self.smile:
             has.append('smile')
@@ -162,9 +168,7 @@ class RekognitionFace:
             has.append('open eyes')
         if self.mouth_open:
             has.append('open mouth')
-        if has:
-            rendering['has'] = has
-        return rendering
+        return has
 
 
 class RekognitionCelebrity:
@@ -193,7 +197,7 @@ class RekognitionCelebrity:
 
         :return: A dict that contains the celebrity data.
         """
-        rendering = self.face.to_dict()
+        rendering = self.face.to_dict_args()
         if self.name is not None:
             rendering['name'] = self.name
         if self.info_urls:
@@ -227,7 +231,7 @@ class RekognitionPerson:
 
         :return: A dict that contains the person data.
         """
-        rendering = self.face.to_dict() if self.face is not None else {}
+        rendering = self.face.to_dict_args() if self.face is not None else {}
         if self.index is not None:
             rendering['index'] = self.index
         if self.bounding_box is not None:
@@ -0,0 +1,267 @@
+"""
+Purpose
+
+Runs Amazon Rekognition operations on an image as a declarative pipeline. A stage
+can depend on the result of the previous ones, so the paid calls that can't find
+anything are skipped, for example detecting faces on a picture without people.
+"""
+
+import logging
+import os
+import threading
+
+from flaskr.api.managers.rekognition_image_detection import ANALYSIS_OPERATIONS, run_operations
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PERSON_MIN_CONFIDENCE = 80
+DEFAULT_MODERATION_MIN_CONFIDENCE = 50
+
+
+class LabelDetected:
+    """Condition met when detect_labels found a label above a confidence."""
+
+    requires = 'detect_labels'
+
+    def __init__(self, name, min_confidence=DEFAULT_PERSON_MIN_CONFIDENCE):
+        """
+        Initializes the condition.
+
+        :param name: The name of the label, for example Person.
+        :param min_confidence: The minimum confidence of the label.
+        """
+        self.name = name
+        self.min_confidence = min_confidence
+
+    def __call__(self, outputs):
+        return any(label.name == self.name and label.confidence >= self.min_confidence
+                   for label in outputs.get(self.requires) or [])
+
+    def describe(self):
+        return "label %s >= %s" % (self.name, self.min_confidence)
+
+
+class ModerationFlagged:
+    """Condition met when detect_moderation_labels flagged the image."""
+
+    requires = 'detect_moderation_labels'
+
+    def __init__(self, min_confidence=DEFAULT_MODERATION_MIN_CONFIDENCE):
+        """
+        Initializes the condition.
+
+        :param min_confidence: The minimum confidence of a moderation label to
+                               flag the image.
+        """
+        self.min_confidence = min_confidence
+
+    def __call__(self, outputs):
+        return any(label.confidence >= self.min_confidence
+                   for label in outputs.get(self.requires) or [])
+
+    def describe(self):
+        return "moderation label >= %s" % self.min_confidence
+
+
+CONDITIONS = {
+    'label': lambda config: LabelDetected(
+        config['name'], config.get('min_confidence', DEFAULT_PERSON_MIN_CONFIDENCE)),
+    'moderation': lambda config: ModerationFlagged(
+        config.get('min_confidence', DEFAULT_MODERATION_MIN_CONFIDENCE)),
+}
+
+
+class PipelineStage:
+    """Encapsulates a Rekognition operation of a pipeline."""
+
+    def __init__(self, operation, when=None, stop_if=None):
+        """
+        Initializes the stage.
+
+        :param operation: The name of the operation, see ANALYSIS_OPERATIONS.
+        :param when: The condition to run the stage. The stage always runs when
+                     this is not specified.
+        :param stop_if: The condition to stop the pipeline after this stage, if any.
+        """
+        if operation not in ANALYSIS_OPERATIONS:
+            raise ValueError("Unknown operation : %s" % operation)
+        self.operation = operation
+        self.when = when
+        self.stop_if = stop_if
+
+    @property
+    def requires(self):
+        """
+        The operations that must be finished before the stage starts.
+        """
+        return {condition.requires for condition in (self.when, self.stop_if)
+                if condition is not None and condition.requires != self.operation}
+
+    @classmethod
+    def from_dict(cls, config):
+        """
+        Creates a stage from its json description, for example
+        {"operation": "detect_faces", "when": {"type": "label", "name": "Person", "min_confidence": 80}}
+
+        :param config: The dict describing the stage.
+        :return: The PipelineStage object.
+        """
+        def condition(name):
+            if config.get(name) is None:
+                return None
+            condition_config = config[name]
+            if condition_config.get('type') not in CONDITIONS:
+                raise ValueError("Unknown condition type : %s" % condition_config.get('type'))
+            return CONDITIONS[condition_config['type']](condition_config)
+
+        return cls(config['operation'], when=condition('when'), stop_if=condition('stop_if'))
+
+
+class PipelineStats:
+    """Counts the Rekognition calls run and saved by the pipelines."""
+
+    def __init__(self):
+        self.images = 0
+        self.ran = {}
+        self.skipped = {}
+        self._lock = threading.Lock()
+
+    def record(self, ran, skipped):
+        with self._lock:
+            self.images += 1
+            for operation in ran:
+                self.ran[operation] = self.ran.get(operation, 0) + 1
+            for operation in skipped:
+                self.skipped[operation] = self.skipped.get(operation, 0) + 1
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                'images': self.images,
+                'calls': sum(self.ran.values()),
+                'saved_calls': sum(self.skipped.values()),
+                'ran': dict(self.ran),
+                'skipped': dict(self.skipped),
+            }
+
+
+pipeline_stats = PipelineStats()
+
+
+class AnalysisPipeline:
+    """
+    Runs the stages of a pipeline on an image. The stages whose dependencies are
+    finished run at the same time, the others wait for the next wave. Every stage
+    listed after a stage that can stop the pipeline waits for it, so nothing runs
+    once the pipeline is stopped.
+    """
+
+    def __init__(self, stages, stats=pipeline_stats):
+        """
+        Initializes the pipeline.
+
+        :param stages: The list of PipelineStage. A stage can only depend on the
+                       operations of the stages listed before it.
+        :param stats: The PipelineStats counting the calls run and skipped.
+        """
+        operations = set()
+        stoppers = set()
+        self._waits_for = {}
+        for stage in stages:
+            if stage.operation in operations:
+                raise ValueError("Operation %s is used by several stages" % stage.operation)
+            if not stage.requires <= operations:
+                raise ValueError("Stage %s depends on %s, which must run before it" % (
+                    stage.operation, ', '.join(sorted(stage.requires - operations))))
+            self._waits_for[stage.operation] = stage.requires | stoppers
+            operations.add(stage.operation)
+            if stage.stop_if is not None:
+                stoppers.add(stage.operation)
+        self.stages = stages
+        self.stats = stats
+
+    @classmethod
+    def from_config(cls, config):
+        """
+        Creates a pipeline from its json description, a list of stage descriptions.
+
+        :param config: The list of dicts describing the stages.
+        :return: The AnalysisPipeline object.
+        """
+        return cls([PipelineStage.from_dict(stage) for stage in config])
+
+    async def run(self, image, max_labels=10, timer=None):
+        """
+        Runs the pipeline on an image.
+
+        :param image: The RekognitionImage to analyse.
+        :param max_labels: The maximum number of labels returned by detect_labels.
+        :param timer: A StageTimer measuring the duration of each operation, if any.
+        :return: A dict that contains the rendered results and errors by operation,
+                 the operations that ran, the reason each skipped operation was
+                 skipped and the operation that stopped the pipeline, if any.
+        """
+        outputs = {}
+        errors = {}
+        ran = []
+        skipped = {}
+        stopped_by = None
+        pending = list(self.stages)
+
+        while pending:
+            finished = set(ran) | set(skipped) | set(errors)
+            wave = [stage for stage in pending if self._waits_for[stage.operation] <= finished]
+            pending = [stage for stage in pending if stage not in wave]
+
+            runnable = []
+            for stage in wave:
+                if stopped_by is not None:
+                    skipped[stage.operation] = "stopped by %s" % stopped_by
+                elif stage.when is not None and not stage.when(outputs):
+                    skipped[stage.operation] = "condition not met : %s" % stage.when.describe()
+                else:
+                    runnable.append(stage)
+
+            if not runnable:
+                continue
+
+            results = await run_operations(image, [stage.operation for stage in runnable], max_labels, timer)
+
+            for stage in runnable:
+                result = results[stage.operation]
+                if isinstance(result, Exception):
+                    errors[stage.operation] = str(result)
+                    continue
+                ran.append(stage.operation)
+                outputs[stage.operation] = result
+                if stopped_by is None and stage.stop_if is not None and stage.stop_if(outputs):
+                    stopped_by = stage.operation
+
+        self.stats.record(ran + list(errors), skipped)
+        logger.info("Pipeline ran %s and skipped %s on %s.", ran, list(skipped), image.image_name)
+
+        return {
+            'results': {operation: ANALYSIS_OPERATIONS[operation][1](output)
+                        for operation, output in outputs.items()},
+            'errors': errors,
+            'ran': ran,
+            'skipped': skipped,
+            'stopped_by': stopped_by,
+        }
+
+
+def default_pipeline():
+    """
+    Creates the default pipeline : the image is checked by detect_labels and
+    detect_moderation_labels, a flagged image stops there, and the face and
+    celebrity detections only run when a person was found.
+    """
+    person = LabelDetected('Person', float(os.getenv('PIPELINE_PERSON_MIN_CONFIDENCE', DEFAULT_PERSON_MIN_CONFIDENCE)))
+    flagged = ModerationFlagged(float(os.getenv('PIPELINE_MODERATION_MIN_CONFIDENCE', DEFAULT_MODERATION_MIN_CONFIDENCE)))
+
+    return AnalysisPipeline([
+        PipelineStage('detect_labels'),
+        PipelineStage('detect_moderation_labels', stop_if=flagged),
+        PipelineStage('detect_faces', when=person),
+        PipelineStage('recognize_celebrities', when=person),
+    ])
@@ -0,0 +1,259 @@
+"""
+Purpose
+
+Caches the responses of Amazon Rekognition so the same image analysed twice with
+the same operation and parameters is only paid once.
+The cache has an in memory LRU tier and an optional SQLite tier on disk that
+survives restarts. Both tiers expire entries after a TTL and are bounded in size.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_ENTRIES = 1024
+DEFAULT_TTL = 24 * 60 * 60
+DEFAULT_MAX_DISK_BYTES = 256 * 1024 * 1024
+
+
+class RekognitionResultCache:
+    """
+    Two tiers cache of Amazon Rekognition responses, keyed on the image content,
+    the operation and its parameters.
+    """
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, ttl=DEFAULT_TTL, disk_path=None,
+                 max_disk_bytes=DEFAULT_MAX_DISK_BYTES):
+        """
+        Initializes the cache.
+
+        :param max_entries: The maximum number of responses kept in memory.
+        :param ttl: The number of seconds a response stays valid.
+        :param disk_path: The path of the SQLite file of the disk tier. The disk
+                          tier is disabled when this is not specified.
+        :param max_disk_bytes: The maximum size of the responses stored on disk.
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.disk_path = disk_path
+        self.max_disk_bytes = max_disk_bytes
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._connection = None
+
+        if disk_path:
+            self._connection = sqlite3.connect(disk_path, check_same_thread=False)
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS rekognition_result ('
+                'key TEXT PRIMARY KEY, bucket TEXT, object TEXT, response TEXT NOT NULL, '
+                'size INTEGER NOT NULL, created_at REAL NOT NULL, accessed_at REAL NOT NULL)')
+            self._connection.execute(
+                'CREATE INDEX IF NOT EXISTS rekognition_result_source ON rekognition_result (bucket, object)')
+            self._connection.commit()
+
+    @staticmethod
+    def image_digest(image, etag=None):
+        """
+        Computes the SHA-256 that identifies the image of a Rekognition request.
+
+        :param image: The image, either the image bytes or an Amazon S3 bucket and
+                      object key.
+        :param etag: The ETag of the Amazon S3 object, if it is known. It makes
+                     the digest change when the object is overwritten.
+        :return: The hexadecimal digest.
+        """
+        if 'Bytes' in image:
+            return hashlib.sha256(image['Bytes']).hexdigest()
+
+        s3_object = image['S3Object']
+        reference = 's3://%s/%s@%s#%s' % (s3_object['Bucket'], s3_object['Name'], s3_object.get('Version', ''),
+                                          etag or '')
+        return hashlib.sha256(reference.encode()).hexdigest()
+
+    @staticmethod
+    def make_key(image_digest, operation, params):
+        """
+        Builds the cache key of a Rekognition request.
+
+        :param image_digest: The digest of the image, see image_digest.
+        :param operation: The name of the Rekognition operation.
+        :param params: The parameters of the operation, except the image.
+        :return: The cache key.
+        """
+        request = json.dumps([image_digest, operation, params], sort_keys=True, default=str)
+        return hashlib.sha256(request.encode()).hexdigest()
+
+    def get(self, key):
+        """
+        Gets a cached response.
+
+        :param key: The cache key.
+        :return: The response, or None when it is not cached or expired.
+        """
+        now = time.time()
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, response, source = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return response
+                del self._entries[key]
+
+            if self._connection is not None:
+                row = self._connection.execute(
+                    'SELECT response, bucket, object, created_at FROM rekognition_result WHERE key = ?',
+                    (key,)).fetchone()
+                if row is not None:
+                    response, bucket, object_name, created_at = row
+                    if created_at + self.ttl > now:
+                        self._connection.execute(
+                            'UPDATE rekognition_result SET accessed_at = ? WHERE key = ?', (now, key))
+                        self._connection.commit()
+                        response = json.loads(response)
+                        source = (bucket, object_name) if bucket else None
+                        self._remember(key, created_at + self.ttl, response, source)
+                        self.hits += 1
+                        self.disk_hits += 1
+                        return response
+                    self._connection.execute('DELETE FROM rekognition_result WHERE key = ?', (key,))
+                    self._connection.commit()
+
+            self.misses += 1
+            return None
+
+    def set(self, key, response, source=None):
+        """
+        Stores a response.
+
+        :param key: The cache key.
+        :param response: The Rekognition response, without its metadata.
+        :param source: The (bucket, object) the image comes from, if any. The
+                       response is invalidated when this object is removed.
+        """
+        now = time.time()
+
+        with self._lock:
+            self._remember(key, now + self.ttl, response, source)
+
+            if self._connection is not None:
+                serialized = json.dumps(response)
+                bucket, object_name = source if source else (None, None)
+                self._connection.execute(
+                    'INSERT OR REPLACE INTO rekognition_result '
+                    '(key, bucket, object, response, size, created_at, accessed_at) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                    (key, bucket, object_name, serialized, len(serialized), now, now))
+                self._evict_disk(now)
+                self._connection.commit()
+
+    def invalidate(self, bucket_name, object_name=None, prefix=None):
+        """
+        Removes the responses computed from an object, from the objects under a
+        prefix, or from every object of a bucket.
+
+        :param bucket_name: The bucket of the removed object.
+        :param object_name: The removed object. When neither this nor the prefix is
+                            specified, every response of the bucket is removed.
+        :param prefix: The prefix of the removed objects.
+        """
+        def matches(source):
+            return source is not None and source[0] == bucket_name and (
+                object_name is None or source[1] == object_name) and (
+                prefix is None or (source[1] or '').startswith(prefix))
+
+        with self._lock:
+            keys = [key for key, (_, _, source) in self._entries.items() if matches(source)]
+            for key in keys:
+                del self._entries[key]
+            self.invalidations += len(keys)
+
+            if self._connection is not None:
+                if object_name is not None:
+                    cursor = self._connection.execute(
+                        'DELETE FROM rekognition_result WHERE bucket = ? AND object = ?', (bucket_name, object_name))
+                elif prefix:
+                    cursor = self._connection.execute(
+                        'DELETE FROM rekognition_result WHERE bucket = ? AND substr(object, 1, ?) = ?',
+                        (bucket_name, len(prefix), prefix))
+                else:
+                    cursor = self._connection.execute(
+                        'DELETE FROM rekognition_result WHERE bucket = ?', (bucket_name,))
+                self._connection.commit()
+                self.invalidations += cursor.rowcount
+
+    def clear(self):
+        """
+        Removes every cached response.
+        """
+        with self._lock:
+            self._entries.clear()
+            if self._connection is not None:
+                self._connection.execute('DELETE FROM rekognition_result')
+                self._connection.commit()
+
+    def stats(self):
+        """
+        Renders the cache counters to a dict.
+
+        :return: A dict that contains the cache counters.
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+                'entries': len(self._entries),
+            }
+
+    def _remember(self, key, expires_at, response, source):
+        self._entries[key] = (expires_at, response, source)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def _evict_disk(self, now):
+        cursor = self._connection.execute(
+            'DELETE FROM rekognition_result WHERE created_at < ?', (now - self.ttl,))
+        self.evictions += cursor.rowcount
+
+        total_size, = self._connection.execute(
+            'SELECT COALESCE(SUM(size), 0) FROM rekognition_result').fetchone()
+        while total_size > self.max_disk_bytes:
+            key, size = self._connection.execute(
+                'SELECT key, size FROM rekognition_result ORDER BY accessed_at LIMIT 1').fetchone()
+            self._connection.execute('DELETE FROM rekognition_result WHERE key = ?', (key,))
+            total_size -= size
+            self.evictions += 1
+
+
+def _cache_from_env():
+    if os.getenv('REKOGNITION_CACHE_ENABLED', '1') == '0':
+        return None
+
+    return RekognitionResultCache(
+        max_entries=int(os.getenv('REKOGNITION_CACHE_MAX_ENTRIES', DEFAULT_MAX_ENTRIES)),
+        ttl=int(os.getenv('REKOGNITION_CACHE_TTL', DEFAULT_TTL)),
+        disk_path=os.getenv('REKOGNITION_CACHE_PATH'),
+        max_disk_bytes=int(os.getenv('REKOGNITION_CACHE_MAX_DISK_BYTES', DEFAULT_MAX_DISK_BYTES)))
+
+
+result_cache = _cache_from_env()
@@ -0,0 +1,143 @@
+"""
+Purpose
+
+Remembers the Amazon S3 metadata the uploads need again and again, so they don't
+cost a round trip or a signature each time. The buckets known to exist are kept
+for a TTL, which saves the head_bucket call checking the bucket of each upload,
+and the presigned urls are reused until they get close to their expiry. A url
+signed with temporary credentials, such as the ones of an assumed role or an
+instance profile, stops working when they expire : it is only reused until then.
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+
+DEFAULT_BUCKET_TTL = 300
+DEFAULT_URL_EXPIRES_IN = 3600
+DEFAULT_URL_REFRESH_MARGIN = 600
+
+# The number of presigned urls kept, the least recently used ones are dropped first
+DEFAULT_MAX_URLS = 10000
+
+
+class S3MetadataCache:
+    """Caches the existing buckets and the presigned urls of the objects."""
+
+    def __init__(self, bucket_ttl=DEFAULT_BUCKET_TTL, url_expires_in=DEFAULT_URL_EXPIRES_IN,
+                 url_refresh_margin=DEFAULT_URL_REFRESH_MARGIN, max_urls=DEFAULT_MAX_URLS):
+        """
+        Initializes the cache.
+
+        :param bucket_ttl: The number of seconds a bucket is known to exist, 0 to
+                           check the bucket every time.
+        :param url_expires_in: The number of seconds the presigned urls are valid.
+        :param url_refresh_margin: A presigned url is not reused once it expires in
+                                   less than this number of seconds, so the clients
+                                   always get a url valid at least that long.
+        :param max_urls: The maximum number of presigned urls kept.
+        """
+        self.bucket_ttl = bucket_ttl
+        self.url_expires_in = url_expires_in
+        self.url_refresh_margin = url_refresh_margin
+        self.max_urls = max_urls
+        self.bucket_hits = 0
+        self.bucket_misses = 0
+        self.url_hits = 0
+        self.url_misses = 0
+        self._buckets = {}
+        self._urls = OrderedDict()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            bucket_ttl=float(os.getenv('S3_BUCKET_CACHE_TTL', DEFAULT_BUCKET_TTL)),
+            url_expires_in=int(os.getenv('S3_PRESIGNED_URL_EXPIRES_IN', DEFAULT_URL_EXPIRES_IN)),
+            url_refresh_margin=int(os.getenv('S3_PRESIGNED_URL_REFRESH_MARGIN', DEFAULT_URL_REFRESH_MARGIN)))
+
+    def bucket_exists(self, bucket_name):
+        """
+        Tells whether a bucket is known to exist. A bucket that is not known must be
+        checked, the missing buckets are never remembered.
+        """
+        with self._lock:
+            expires_at = self._buckets.get(bucket_name)
+            if expires_at is not None and expires_at > time.monotonic():
+                self.bucket_hits += 1
+                return True
+            self._buckets.pop(bucket_name, None)
+            self.bucket_misses += 1
+            return False
+
+    def remember_bucket(self, bucket_name):
+        if self.bucket_ttl <= 0:
+            return
+        with self._lock:
+            self._buckets[bucket_name] = time.monotonic() + self.bucket_ttl
+
+    def forget_bucket(self, bucket_name):
+        """
+        Forgets a bucket and the presigned urls of its objects.
+        """
+        with self._lock:
+            self._buckets.pop(bucket_name, None)
+            for key in [key for key in self._urls if key[0] == bucket_name]:
+                del self._urls[key]
+
+    def presigned_url(self, bucket_name, object_key):
+        """
+        Gets the presigned url of an object, None when there is none valid long enough.
+        """
+        with self._lock:
+            entry = self._urls.get((bucket_name, object_key))
+            if entry is not None and entry[1] - self.url_refresh_margin > time.time():
+                self._urls.move_to_end((bucket_name, object_key))
+                self.url_hits += 1
+                return entry[0]
+            self._urls.pop((bucket_name, object_key), None)
+            self.url_misses += 1
+            return None
+
+    def remember_url(self, bucket_name, object_key, url, signed_at, credentials_expire_at=None):
+        """
+        Keeps the presigned url of an object.
+
+        :param signed_at: The time the url was signed at, it expires url_expires_in
+                          seconds later.
+        :param credentials_expire_at: The time the temporary credentials that signed
+                                      the url expire at, if any. The url expires with
+                                      them when they expire first.
+        """
+        expires_at = signed_at + self.url_expires_in
+        if credentials_expire_at is not None:
+            expires_at = min(expires_at, credentials_expire_at)
+
+        with self._lock:
+            self._urls[(bucket_name, object_key)] = (url, expires_at)
+            self._urls.move_to_end((bucket_name, object_key))
+            while len(self._urls) > self.max_urls:
+                self._urls.popitem(last=False)
+
+    def forget_url(self, bucket_name, object_key=None, prefix=None):
+        """
+        Forgets the presigned url of an object, or of the objects under a prefix.
+        """
+        with self._lock:
+            if object_key is not None:
+                self._urls.pop((bucket_name, object_key), None)
+                return
+            for key in [key for key in self._urls if key[0] == bucket_name and key[1].startswith(prefix or '')]:
+                del self._urls[key]
+
+    def stats(self):
+        with self._lock:
+            return {
+                'buckets': len(self._buckets),
+                'bucket_hits': self.bucket_hits,
+                'bucket_misses': self.bucket_misses,
+                'presigned_urls': len(self._urls),
+                'presigned_url_hits': self.url_hits,
+                'presigned_url_misses': self.url_misses,
+            }
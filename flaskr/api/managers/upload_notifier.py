@@ -0,0 +1,294 @@
+"""
+Purpose
+
+Detects the objects uploaded straight to Amazon S3 with a presigned post and queues
+their analysis by S3 reference, so the image bytes never pass through the app.
+The new objects are either received as S3 event notifications, pushed to a local
+stand-in queue by the /api/s3_events endpoint, or found by polling the buckets.
+Only the uploads expected through a presigned post are analysed, unless every new
+image of the buckets is. An upload refused by a full analysis queue stays expected
+and its analysis is queued again later.
+"""
+
+import asyncio
+import hmac
+import logging
+import os
+import queue
+import re
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import unquote_plus, urlsplit
+
+import requests
+
+from flaskr.api.managers.bulk_analysis import IMAGE_EXTENSIONS, S3ObjectReference
+from flaskr.api.managers.rekognition_image_detection import RekognitionImage, analyse_image, get_rekognition_client
+
+logger = logging.getLogger(__name__)
+
+EVENTS = 'events'
+POLL = 'poll'
+MODES = (EVENTS, POLL)
+
+DEFAULT_POLL_INTERVAL = 10
+
+# The presigned posts expire after an hour, an upload is not awaited longer
+WATCH_TTL = 60 * 60
+
+# The number of uploads whose analysis job id is remembered
+MAX_TRACKED_UPLOADS = 10000
+
+# The subscriptions are only confirmed with SNS itself, never with another host
+SNS_HOST = re.compile(r'^sns\.[a-z0-9-]+\.amazonaws\.com(\.cn)?$')
+SNS_CONFIRM_TIMEOUT = 10
+
+
+class S3EventQueue:
+    """
+    Local stand-in for the queue S3 sends its event notifications to.
+    """
+
+    def __init__(self):
+        self._queue = queue.Queue()
+
+    def put(self, notification):
+        """
+        Queues the records of an S3 event notification.
+
+        :param notification: The notification, as sent by S3 to SQS or SNS.
+        :return: The number of records queued.
+        """
+        records = notification.get('Records', [])
+        for record in records:
+            self._queue.put(record)
+        return len(records)
+
+    def get(self, timeout=None):
+        """
+        Gets the next record, None when there is none before the timeout.
+        """
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def qsize(self):
+        return self._queue.qsize()
+
+
+def events_token_matches(token, candidates):
+    """
+    Tells whether one of the tokens sent with a request is the shared secret of the
+    /api/s3_events endpoint, compared in constant time.
+    """
+    return any(candidate is not None and hmac.compare_digest(candidate.encode(), token.encode())
+               for candidate in candidates)
+
+
+def confirm_sns_subscription(message):
+    """
+    Confirms the subscription of the endpoint to an SNS topic by visiting the
+    SubscribeURL of the SubscriptionConfirmation message.
+
+    :param message: The SubscriptionConfirmation message, as posted by SNS.
+    :raises ValueError: When the SubscribeURL is not an SNS url or the confirmation failed.
+    """
+    subscribe_url = message.get('SubscribeURL') or ''
+    parsed = urlsplit(subscribe_url)
+    if parsed.scheme != 'https' or parsed.username or parsed.port or not SNS_HOST.match(parsed.hostname or ''):
+        raise ValueError("The SubscribeURL is not an SNS url : %s" % subscribe_url)
+
+    try:
+        response = requests.get(subscribe_url, timeout=SNS_CONFIRM_TIMEOUT, allow_redirects=False)
+        response.raise_for_status()
+    except requests.RequestException as e:
+        raise ValueError("Couldn't confirm the subscription to %s : %s" % (message.get('TopicArn'), e))
+
+    logger.info("Confirmed the subscription to %s.", message.get('TopicArn'))
+
+
+def analyse_s3_object(bucket_name, key, e_tag=None, operations=('detect_faces',)):
+    """
+    Analyses an object by S3 reference.
+
+    :return: A dict of the object, the results and the errors of each operation.
+    """
+    image = RekognitionImage.from_bucket(S3ObjectReference(bucket_name, key, e_tag), get_rekognition_client())
+    results, errors = asyncio.run(analyse_image(image, operations))
+    return {'bucket': bucket_name, 'key': key, 'etag': e_tag, 'results': results, 'errors': errors}
+
+
+class UploadNotifier:
+    """Queues the analysis of the images uploaded to the watched buckets."""
+
+    def __init__(self, analysis_queue, bucket_manager, mode=EVENTS, poll_interval=DEFAULT_POLL_INTERVAL,
+                 operations=('detect_faces',), analyse=analyse_s3_object, analyse_all=False):
+        """
+        Initializes the notifier, it is started by the first expected upload or event
+        notification of each process.
+
+        :param analysis_queue: The AnalysisQueue running the analyses.
+        :param bucket_manager: The AwsBucketManager listing the polled buckets.
+        :param mode: EVENTS to consume the events queue, POLL to list the watched buckets.
+        :param poll_interval: The number of seconds between two listings of a bucket.
+        :param operations: The Rekognition operations run on each new image.
+        :param analyse: The function analysing an object by S3 reference.
+        :param analyse_all: When True, every new image of the notifications is analysed,
+                            not only the expected uploads.
+        """
+        if mode not in MODES:
+            raise ValueError("Unknown mode %s, use one of : %s" % (mode, ', '.join(MODES)))
+
+        self.analysis_queue = analysis_queue
+        self.bucket_manager = bucket_manager
+        self.mode = mode
+        self.poll_interval = poll_interval
+        self.operations = list(operations)
+        self.analyse = analyse
+        self.analyse_all = analyse_all
+        self.events = S3EventQueue()
+        self.detected = 0
+        self.rejected = 0
+        self._watched = {}
+        self._retries = []
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+        self._pid = None
+
+    def start(self):
+        """
+        Starts the notifier thread of the current process, a forked child doesn't run the thread of its parent.
+        """
+        with self._lock:
+            if self._stopped.is_set() or self._pid == os.getpid():
+                return
+            target = self._consume if self.mode == EVENTS else self._poll
+            self._thread = threading.Thread(target=target, name='upload-notifier', daemon=True)
+            self._thread.start()
+            self._pid = os.getpid()
+
+    def stop(self, timeout=5):
+        self._stopped.set()
+        if self._thread is not None and self._pid == os.getpid():
+            self._thread.join(timeout)
+
+    def receive(self, notification):
+        """
+        Queues the records of an S3 event notification, see S3EventQueue.put.
+        """
+        self.start()
+        return self.events.put(notification)
+
+    def watch(self, bucket_name, key):
+        """
+        Expects an upload, in POLL mode its bucket is listed until the object arrives.
+        """
+        self.start()
+        with self._lock:
+            self._expire_watched()
+            self._watched.setdefault(bucket_name, {})[key] = time.time()
+
+    def job_id(self, bucket_name, key):
+        """
+        Gets the id of the analysis job of an uploaded object, None until it is detected.
+        """
+        with self._lock:
+            return self._jobs.get((bucket_name, key))
+
+    def notify(self, bucket_name, key, e_tag=None):
+        """
+        Queues the analysis of a new object. The objects that are not images, and the
+        objects that are not expected unless analyse_all is set, are ignored. An object
+        whose analysis can't be queued stays expected : in POLL mode it is found again
+        by the next listing, in EVENTS mode its event is retried after a backoff.
+
+        :return: The id of the analysis job, None when the object is ignored or the queue is full.
+        """
+        if not key.lower().endswith(IMAGE_EXTENSIONS):
+            return None
+
+        with self._lock:
+            if not self.analyse_all and key not in self._watched.get(bucket_name, {}):
+                return None
+
+        try:
+            job_id = self.analysis_queue.submit(
+                lambda: self.analyse(bucket_name, key, e_tag, self.operations))
+        except Exception as e:
+            logger.warning("Couldn't queue the analysis of s3://%s/%s : %s", bucket_name, key, e)
+            retry_at = time.time() + getattr(e, 'retry_after', self.poll_interval)
+            with self._lock:
+                self.rejected += 1
+                if self.mode == EVENTS:
+                    self._retries.append((retry_at, bucket_name, key, e_tag))
+            return None
+
+        with self._lock:
+            self.detected += 1
+            self._watched.get(bucket_name, {}).pop(key, None)
+            self._jobs[(bucket_name, key)] = job_id
+            self._jobs.move_to_end((bucket_name, key))
+            while len(self._jobs) > MAX_TRACKED_UPLOADS:
+                self._jobs.popitem(last=False)
+        return job_id
+
+    def _consume(self):
+        while not self._stopped.is_set():
+            self._retry_due()
+            record = self.events.get(timeout=min(1, self.poll_interval))
+            if record is None:
+                continue
+            if not record.get('eventName', '').startswith('ObjectCreated:'):
+                continue
+            s3 = record['s3']
+            # the keys of the notifications are url encoded
+            self.notify(s3['bucket']['name'], unquote_plus(s3['object']['key']), s3['object'].get('eTag'))
+
+    def _retry_due(self):
+        with self._lock:
+            now = time.time()
+            due = [retry for retry in self._retries if retry[0] <= now]
+            self._retries = [retry for retry in self._retries if retry[0] > now]
+        for _, bucket_name, key, e_tag in due:
+            self.notify(bucket_name, key, e_tag)
+
+    def _poll(self):
+        while not self._stopped.wait(self.poll_interval):
+            with self._lock:
+                self._expire_watched()
+                watched = [(bucket_name, key) for bucket_name, keys in self._watched.items() for key in keys]
+            for bucket_name, key in watched:
+                try:
+                    asyncio.run(self.poll_object(bucket_name, key))
+                except Exception:
+                    logger.exception("Couldn't poll s3://%s/%s.", bucket_name, key)
+
+    async def poll_object(self, bucket_name, key):
+        """
+        Lists an expected object, its analysis is queued when it arrived.
+        """
+        async for s3_object in self.bucket_manager.list_objects(bucket_name, key):
+            if s3_object['Key'] == key:
+                self.notify(bucket_name, key, s3_object.get('ETag'))
+                return
+
+    def _expire_watched(self):
+        expired_before = time.time() - WATCH_TTL
+        for keys in self._watched.values():
+            for key in [key for key, watched_at in keys.items() if watched_at < expired_before]:
+                del keys[key]
+
+    def stats(self):
+        with self._lock:
+            return {
+                'mode': self.mode,
+                'detected': self.detected,
+                'rejected': self.rejected,
+                'pending_events': self.events.qsize(),
+                'retried_events': len(self._retries),
+                'awaited_uploads': sum(len(keys) for keys in self._watched.values()),
+            }
@@ -0,0 +1,66 @@
+import time
+import unittest
+
+from flaskr.api.managers.rekognition_image_detection import RekognitionImage, analyse_image
+
+
+class SlowRekognitionClient:
+    """
+    Fake rekognition client answering every operation after the same latency
+    """
+
+    def __init__(self, latency):
+        self.latency = latency
+
+    def detect_faces(self, Image, Attributes):
+        time.sleep(self.latency)
+        return {'FaceDetails': [{'Confidence': 99.0}]}
+
+    def detect_labels(self, Image, MaxLabels):
+        time.sleep(self.latency)
+        return {'Labels': [{'Name': 'Person', 'Confidence': 98.0}]}
+
+    def detect_text(self, Image):
+        time.sleep(self.latency)
+        raise RuntimeError('Service unavailable')
+
+
+class AnalyseImageTestCase(unittest.IsolatedAsyncioTestCase):
+    """
+    This test class is designed to confirm the behavior of the combined analysis of an image
+    """
+
+    def setUp(self):
+        """
+        This test method initializes the context before each test method run.
+        """
+        self.latency = 0.2
+        self.image = RekognitionImage({'Bytes': b'picture'}, 'image', SlowRekognitionClient(self.latency))
+        self.image.result_cache = None
+
+    async def test_operations_run_concurrently(self):
+        """
+        This test method checks that the duration is close to the slowest operation
+        """
+        # When
+        start = time.perf_counter()
+        results, errors = await analyse_image(self.image, ['detect_faces', 'detect_labels', 'detect_text'])
+        elapsed = time.perf_counter() - start
+
+        # Then
+        self.assertLess(elapsed, self.latency * 2)
+        self.assertEqual([{'confidence': 99.0}], results['detect_faces'])
+        self.assertEqual([{'name': 'Person'}], results['detect_labels'])
+        self.assertEqual({'detect_text': 'Service unavailable'}, errors)
+
+    async def test_unknown_operation_refused(self):
+        """
+        This test method checks that an unknown operation is refused before any call
+        """
+        # When / Then
+        with self.assertRaises(ValueError):
+            await analyse_image(self.image, ['detect_faces', 'detect_everything'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,209 @@
+import json
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from flaskr.api.managers.analysis_queue import AnalysisQueue, AnalysisQueueFull, InvalidCallbackUrl, \
+    check_callback_url, COMPLETED, FAILED
+
+
+class SlowCallbackHandler(BaseHTTPRequestHandler):
+    """
+    Fake webhook answering the callbacks after a latency
+    """
+
+    def do_POST(self):
+        time.sleep(self.server.latency)
+        self.server.jobs.append(json.loads(self.rfile.read(int(self.headers['Content-Length']))))
+        self.send_response(204)
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+class AnalysisQueueTestCase(unittest.TestCase):
+    """
+    This test class is designed to confirm that the analyses queued in the background can be polled
+    and that a full queue refuses new jobs
+    """
+
+    def setUp(self):
+        """
+        This test method initializes the context before each test method run.
+        """
+        self.release = threading.Event()
+        self.queue = AnalysisQueue(workers=1, max_size=1)
+
+    def tearDown(self):
+        self.release.set()
+        self.queue.stop()
+
+    def wait_for(self, job_id, timeout=5):
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            job = self.queue.status(job_id)
+            if job['finished_at'] is not None:
+                return job
+            time.sleep(0.01)
+        self.fail('The job %s did not finish' % job_id)
+
+    def test_completed_job_can_be_polled(self):
+        """
+        This test method confirms that the result of a job is available once it is finished.
+        """
+        # Given
+        function = lambda: [{'Confidence': 99.0}]
+
+        # When
+        job = self.wait_for(self.queue.submit(function))
+
+        # Then
+        self.assertEqual(COMPLETED, job['status'])
+        self.assertEqual([{'Confidence': 99.0}], job['result'])
+
+    def test_failed_job_keeps_its_error(self):
+        """
+        This test method confirms that the error of a failed job is reported instead of being raised.
+        """
+        # Given
+        def function():
+            raise RuntimeError('Service unavailable')
+
+        # When
+        job = self.wait_for(self.queue.submit(function))
+
+        # Then
+        self.assertEqual(FAILED, job['status'])
+        self.assertEqual('Service unavailable', job['error'])
+
+    def test_full_queue_refuses_jobs(self):
+        """
+        This test method confirms that a job submitted to a full queue is refused with a retry delay.
+        """
+        # Given the worker is busy and the only slot of the queue is taken
+        running = threading.Event()
+
+        def blocking():
+            running.set()
+            self.release.wait()
+
+        self.queue.submit(blocking)
+        running.wait(5)
+        self.queue.submit(blocking)
+
+        # When
+        with self.assertRaises(AnalysisQueueFull) as context:
+            self.queue.submit(blocking)
+
+        # Then
+        self.assertGreaterEqual(context.exception.retry_after, 1)
+        self.assertEqual(1, self.queue.stats()['rejected'])
+
+    def test_workers_start_with_first_job(self):
+        """
+        This test method confirms that the workers are only started by the first job of the process.
+        """
+        # Given
+        started = len(self.queue._threads)
+
+        # When
+        self.wait_for(self.queue.submit(lambda: 'done'))
+
+        # Then
+        self.assertEqual(0, started)
+        self.assertEqual(1, len(self.queue._threads))
+
+    def test_forked_process_starts_its_own_workers(self):
+        """
+        This test method confirms that a forked process runs its jobs on its own workers.
+        """
+        # Given
+        self.wait_for(self.queue.submit(lambda: 'parent'))
+        parent_threads = list(self.queue._threads)
+        self.queue._pid = -1
+
+        # When
+        job = self.wait_for(self.queue.submit(lambda: 'child'))
+
+        # Then
+        self.assertEqual('child', job['result'])
+        self.assertNotEqual(parent_threads, self.queue._threads)
+
+    def test_stopped_queue_ends_its_workers(self):
+        """
+        This test method confirms that stop ends the workers and refuses the next jobs.
+        """
+        # Given
+        self.wait_for(self.queue.submit(lambda: 'done'))
+        threads = list(self.queue._threads)
+
+        # When
+        self.queue.stop()
+
+        # Then
+        self.assertFalse(any(thread.is_alive() for thread in threads))
+        with self.assertRaises(RuntimeError):
+            self.queue.submit(lambda: 'refused')
+
+    def test_unknown_job_has_no_status(self):
+        """
+        This test method confirms that an unknown job id has no status.
+        """
+        self.assertIsNone(self.queue.status('unknown'))
+
+    def test_slow_callback_doesnt_hold_the_worker(self):
+        """
+        This test method confirms that the worker runs the next job while the callback of the previous one is delivered.
+        """
+        # Given
+        server = ThreadingHTTPServer(('127.0.0.1', 0), SlowCallbackHandler)
+        server.latency = 0.5
+        server.jobs = []
+        threading.Thread(target=server.serve_forever, args=(0.05,), daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        self.queue = AnalysisQueue(workers=1, max_size=2, callback_hosts=['127.0.0.1'])
+        callback_url = 'http://127.0.0.1:%s/jobs' % server.server_address[1]
+
+        # When
+        first_id = self.queue.submit(lambda: 'first', callback_url)
+        self.wait_for(first_id)
+        start = time.perf_counter()
+        self.wait_for(self.queue.submit(lambda: 'second'))
+        elapsed = time.perf_counter() - start
+
+        # Then
+        self.assertLess(elapsed, server.latency / 2)
+        deadline = time.time() + 5
+        while not server.jobs and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual([first_id], [job['id'] for job in server.jobs])
+
+    def test_private_callback_urls_refused(self):
+        """
+        This test method confirms that a callback can't be posted to a private address or with another scheme.
+        """
+        # Given
+        urls = ['http://127.0.0.1/jobs', 'http://169.254.169.254/latest/meta-data', 'http://10.0.0.1/',
+                'http://[::1]/jobs', 'file:///etc/passwd', 'ftp://8.8.8.8/']
+
+        # When / Then
+        for url in urls:
+            with self.assertRaises(InvalidCallbackUrl):
+                self.queue.submit(lambda: None, url)
+        check_callback_url('https://8.8.8.8/jobs')
+
+    def test_callback_host_outside_allow_list_refused(self):
+        """
+        This test method confirms that only the allowed hosts receive the callbacks when they are configured.
+        """
+        # When / Then
+        with self.assertRaises(InvalidCallbackUrl):
+            check_callback_url('https://8.8.8.8/jobs', allowed_hosts={'hooks.example.com'})
+        check_callback_url('https://hooks.example.com/jobs', allowed_hosts={'hooks.example.com'})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,50 @@
+import asyncio
+import time
+import unittest
+
+from flaskr.api.managers.aws_bucket_manager import AwsBucketManager
+
+
+class SlowS3Client:
+    """
+    Fake s3 client whose calls block like a real network round trip
+    """
+
+    def __init__(self, latency):
+        self.latency = latency
+
+    def head_bucket(self, Bucket):
+        time.sleep(self.latency)
+
+
+class AsyncIoHelperTestCase(unittest.IsolatedAsyncioTestCase):
+    """
+    This test class is designed to confirm that AwsBucketManager calls don't block the event loop
+    """
+
+    def setUp(self):
+        """
+        This test method initializes the context before each test method run.
+        """
+        self.latency = 0.2
+        self.bucket_manager = AwsBucketManager(s3_client=SlowS3Client(self.latency))
+
+    async def test_concurrent_calls_overlap(self):
+        """
+        This test method checks that concurrent s3 calls run at the same time
+        """
+        # Given
+        calls = 8
+
+        # When
+        start = time.perf_counter()
+        results = await asyncio.gather(*[self.bucket_manager.object_exists(bucket_name='bucket') for _ in range(calls)])
+        elapsed = time.perf_counter() - start
+
+        # Then
+        self.assertEqual([True] * calls, results)
+        self.assertLess(elapsed, self.latency * calls / 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+import os
+import unittest
+from unittest import mock
+
+from flaskr.api.helpers.aws_client_registry import AwsClientRegistry, NO_RETRIES
+
+
+class AwsClientRegistryTestCase(unittest.TestCase):
+    """
+    This test class is designed to confirm the AwsClientRegistry class's behavior
+    """
+
+    def setUp(self):
+        """
+        This test method initializes the context before each test method run.
+        """
+        self.registry = AwsClientRegistry(max_pool_connections=20)
+        self.region_name = 'eu-central-1'
+
+    def test_client_created_once(self):
+        """
+        This test method checks that a service client is shared between calls
+        """
+        # Given
+        first = self.registry.client('s3', region_name=self.region_name)
+
+        # When
+        second = self.registry.client('s3', region_name=self.region_name)
+
+        # Then
+        self.assertIs(first, second)
+        self.assertEqual(20, first.meta.config.max_pool_connections)
+
+    def test_client_recreated_after_fork(self):
+        """
+        This test method checks that a forked process doesn't reuse the clients of its parent
+        """
+        # Given
+        parent_client = self.registry.client('rekognition', region_name=self.region_name)
+        self.registry._pid = -1
+
+        # When
+        child_client = self.registry.client('rekognition', region_name=self.region_name)
+
+        # Then
+        self.assertIsNot(parent_client, child_client)
+
+    def test_client_retries_configured_by_service(self):
+        """
+        This test method checks that botocore doesn't retry the calls of a service retried by the rate limiter
+        """
+        # Given
+        registry = AwsClientRegistry(retries={'rekognition': NO_RETRIES})
+
+        # When
+        rekognition = registry.client('rekognition', region_name=self.region_name)
+        s3 = registry.client('s3', region_name=self.region_name)
+
+        # Then
+        self.assertEqual(1, rekognition.meta.config.retries['total_max_attempts'])
+        self.assertNotIn('total_max_attempts', s3.meta.config.retries)
+
+    def test_warm_without_region_is_deferred(self):
+        """
+        This test method checks that warming the clients without a region doesn't fail
+        """
+        # Given
+        environment = {'AWS_CONFIG_FILE': '/nonexistent', 'AWS_DEFAULT_REGION': '', 'AWS_REGION': ''}
+
+        # When
+        with mock.patch.dict('os.environ', environment):
+            for name in ('AWS_DEFAULT_REGION', 'AWS_REGION'):
+                del os.environ[name]
+            self.registry.warm('rekognition')
+
+        # Then
+        self.assertEqual({}, self.registry._clients)
+
+
+    def test_credentials_resolved_once(self):
+        """
+        This test method checks that the credentials of the clients are resolved once by the shared session
+        """
+        # Given
+        with mock.patch.dict(os.environ, {'AWS_ACCESS_KEY_ID': 'key', 'AWS_SECRET_ACCESS_KEY': 'secret'}):
+            first = self.registry.credentials()
+
+        # When
+        second = self.registry.credentials()
+
+        # Then
+        self.assertIs(first, second)
+        self.assertEqual('key', second.access_key)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,195 @@
+import io
+import tarfile
+import threading
+import time
+import unittest
+import zipfile
+
+from flaskr.api.helpers.archive_stream import ArchiveTooLarge, iter_tar, iter_zip
+from flaskr.api.helpers.multipart_stream import MultipartFileReader
+from flaskr.api.managers.aws_bucket_manager import AwsBucketManager
+
+BOUNDARY = 'test-boundary'
+
+
+def multipart_body(files):
+    parts = []
+    for filename, content in files:
+        parts.append(b'--%s\r\nContent-Disposition: form-data; name="files"; filename="%s"\r\n'
+                     b'Content-Type: image/jpeg\r\n\r\n' % (BOUNDARY.encode(), filename.encode()))
+        parts.append(content + b'\r\n')
+    parts.append(b'--%s--\r\n' % BOUNDARY.encode())
+    return b''.join(parts)
+
+
+class Stream:
+    """
+    Non seekable stream, like the body of a request
+    """
+
+    def __init__(self, data):
+        self._data = io.BytesIO(data)
+
+    def read(self, size=-1):
+        return self._data.read(size)
+
+
+class ConcurrentS3Client:
+    """
+    Fake s3 client counting the bucket checks and the uploads running at the same time
+    """
+
+    def __init__(self, latency=0.02):
+        self.latency = latency
+        self.objects = {}
+        self.head_buckets = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+
+    def head_bucket(self, Bucket):
+        self.head_buckets += 1
+
+    def put_object(self, Bucket, Key, Body):
+        with self._lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        time.sleep(self.latency)
+        with self._lock:
+            self.in_flight -= 1
+            self.objects[Key] = Body
+
+    def generate_presigned_url(self, ClientMethod, Params, ExpiresIn=3600):
+        return 'https://%s.s3.local/%s' % (Params['Bucket'], Params['Key'])
+
+
+class BatchUploadTestCase(unittest.IsolatedAsyncioTestCase):
+    """
+    This test class is designed to confirm that the files of a batch are uploaded concurrently after one bucket check
+    """
+
+    def setUp(self):
+        """
+        This test method initializes the context before each test method run.
+        """
+        self.s3_client = ConcurrentS3Client()
+        self.bucket_manager = AwsBucketManager(s3_client=self.s3_client)
+        self.files = [('face%s.jpg' % index, b'picture %d' % index) for index in range(20)]
+
+    async def test_files_are_uploaded_concurrently(self):
+        """
+        This test method checks that the bucket is checked once and the files are uploaded by the workers.
+        """
+        # When
+        results, status = await self.bucket_manager.upload_batch('photos', iter(self.files), concurrency=4)
+
+        # Then
+        self.assertEqual(200, status)
+        self.assertEqual(1, self.s3_client.head_buckets)
+        self.assertEqual(4, self.s3_client.max_in_flight)
+        self.assertEqual([name for name, _ in self.files], [result['name'] for result in results])
+        self.assertEqual('https://photos.s3.local/face3.jpg', results[3]['url'])
+
+    async def test_rejected_and_truncated_files_are_reported(self):
+        """
+        This test method checks that a too large file and an invalid body are reported without failing the batch.
+        """
+        # Given
+        def files():
+            yield 'face.jpg', b'picture'
+            yield 'large.jpg', None
+            raise ValueError('The multipart body is truncated')
+
+        # When
+        results, status = await self.bucket_manager.upload_batch('photos', files())
+
+        # Then
+        self.assertEqual(207, status)
+        self.assertEqual([200, 413, 400], [result['status'] for result in results])
+        self.assertEqual(b'picture', self.s3_client.objects['face.jpg'])
+
+    def test_multipart_files_are_read_in_turn(self):
+        """
+        This test method checks that every file of a multipart body is read, the too large ones are skipped.
+        """
+        # Given
+        body = multipart_body([('a.jpg', b'small'), ('b.jpg', b'x' * 100), ('c.jpg', b'last')])
+        reader = MultipartFileReader(Stream(body), BOUNDARY, file_field=None, chunk_size=16)
+
+        # When
+        files = list(reader.iter_files(max_size=10))
+
+        # Then
+        self.assertEqual([('a.jpg', b'small'), ('b.jpg', None), ('c.jpg', b'last')], files)
+
+    def test_tar_is_read_as_a_stream(self):
+        """
+        This test method checks that a compressed tar is read from a non seekable stream with safe member names.
+        """
+        # Given
+        archive = io.BytesIO()
+        with tarfile.open(fileobj=archive, mode='w:gz') as tar:
+            for name, content in (('photos/face.jpg', b'face'), ('../../etc/passwd', b'root')):
+                info = tarfile.TarInfo(name)
+                info.size = len(content)
+                tar.addfile(info, io.BytesIO(content))
+
+        # When
+        files = list(iter_tar(Stream(archive.getvalue())))
+
+        # Then
+        self.assertEqual([('photos/face.jpg', b'face'), ('etc/passwd', b'root')], files)
+
+    def test_zip_is_read(self):
+        """
+        This test method checks that the files of a zip are read, the folders are ignored.
+        """
+        # Given
+        archive = io.BytesIO()
+        with zipfile.ZipFile(archive, 'w') as zip_file:
+            zip_file.writestr('photos/', b'')
+            zip_file.writestr('photos/face.jpg', b'face')
+
+        # When
+        files = list(iter_zip(Stream(archive.getvalue())))
+
+        # Then
+        self.assertEqual([('photos/face.jpg', b'face')], files)
+
+
+    async def test_too_large_zip_is_refused(self):
+        """
+        This test method checks that a zip larger than the maximum archive size is refused before any upload.
+        """
+        # Given
+        archive = io.BytesIO()
+        with zipfile.ZipFile(archive, 'w') as zip_file:
+            zip_file.writestr('face.jpg', b'x' * 1000)
+
+        # When
+        result, status = await self.bucket_manager.upload_batch(
+            'photos', iter_zip(Stream(archive.getvalue()), max_archive_size=100))
+
+        # Then
+        self.assertEqual(413, status)
+        self.assertEqual('The archive is larger than 100 bytes', result)
+        self.assertEqual({}, self.s3_client.objects)
+
+    def test_too_large_tar_is_refused(self):
+        """
+        This test method checks that a tar stops being read once it is larger than the maximum archive size.
+        """
+        # Given
+        archive = io.BytesIO()
+        with tarfile.open(fileobj=archive, mode='w') as tar:
+            info = tarfile.TarInfo('face.jpg')
+            info.size = 10000
+            tar.addfile(info, io.BytesIO(b'x' * 10000))
+
+        # When / Then
+        with self.assertRaises(ArchiveTooLarge):
+            list(iter_tar(Stream(archive.getvalue()), max_archive_size=1000))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -72,12 +72,11 @@ class BucketManagerTestCase(unittest.IsolatedAsyncioTestCase):
         self.assertTrue(await self.bucket_manager.object_exists(bucket_name=self.bucket_name, object_name=self.object_name))
 
         # When
-        await self.bucket_manager.download_object(self.bucket_name, self.object_name)
+        file_path, status = await self.bucket_manager.download_object(self.bucket_name, self.object_name)
 
         # Then
-        self.assertTrue(
-            os.path.exists('%s%s' %
-                           (os.getenv('STORAGE_FOLDER'), self.object_name)))
+        self.assertEqual(200, status)
+        self.assertTrue(os.path.exists(file_path))
 
     async def test_bucket_existing(self):
         """
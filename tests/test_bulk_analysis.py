@@ -0,0 +1,122 @@
+import threading
+import time
+import unittest
+
+from flaskr.api.managers.aws_bucket_manager import AwsBucketManager
+from flaskr.api.managers.bulk_analysis import BulkAnalysisJob, BulkAnalysisStats, LATENCY_WINDOW
+from flaskr.api.managers.rekognition_result_cache import result_cache
+
+
+class PagedS3Client:
+    """
+    Fake s3 client listing its keys in pages of two objects
+    """
+
+    def __init__(self, keys):
+        self.keys = keys
+
+    def get_paginator(self, operation_name):
+        return self
+
+    def paginate(self, Bucket, Prefix):
+        keys = [key for key in self.keys if key.startswith(Prefix)]
+        for index in range(0, len(keys), 2):
+            yield {'Contents': [{'Key': key, 'ETag': '"%s"' % key} for key in keys[index:index + 2]]}
+
+
+class S3ReferenceRekognitionClient:
+    """
+    Fake rekognition client only accepting images referenced on s3
+    """
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.names = []
+        self._lock = threading.Lock()
+
+    def detect_faces(self, Image, Attributes):
+        with self._lock:
+            self.names.append(Image['S3Object']['Name'])
+        time.sleep(self.latency)
+        return {'FaceDetails': [{'Confidence': 99.0}]}
+
+
+class ListSink:
+    def __init__(self):
+        self.records = []
+
+    def write(self, record):
+        self.records.append(record)
+
+
+class BulkAnalysisTestCase(unittest.IsolatedAsyncioTestCase):
+    """
+    This test class is designed to confirm the BulkAnalysisJob class's behavior
+    """
+
+    def setUp(self):
+        """
+        This test method initializes the context before each test method run.
+        """
+        keys = ['photos/%s.jpg' % index for index in range(8)] + ['photos/readme.txt', 'other/a.jpg']
+        self.bucket_manager = AwsBucketManager(s3_client=PagedS3Client(keys))
+        self.latency = 0.2
+        self.rekognition_client = S3ReferenceRekognitionClient(self.latency)
+        self.sink = ListSink()
+        if result_cache is not None:
+            result_cache.clear()
+
+    async def test_prefix_images_analysed_by_reference(self):
+        """
+        This test method checks that every image of the prefix is analysed by s3 reference
+        """
+        # Given
+        job = BulkAnalysisJob(self.bucket_manager, 'bucket', 'photos/', concurrency=8, sink=self.sink,
+                              rekognition_client=self.rekognition_client)
+        job_start = time.perf_counter()
+
+        # When
+        stats = await job.run()
+
+        # Then
+        self.assertEqual(8, len(self.sink.records))
+        self.assertEqual(sorted('photos/%s.jpg' % index for index in range(8)), sorted(self.rekognition_client.names))
+        self.assertEqual({'listed': 9, 'skipped': 1, 'analysed': 8, 'failed': 0},
+                         {name: stats[name] for name in ('listed', 'skipped', 'analysed', 'failed')})
+        self.assertLess(time.perf_counter() - job_start, self.latency * 4)
+        self.assertEqual(8, stats['latency']['count'])
+
+    async def test_concurrency_bounded(self):
+        """
+        This test method checks that no more images than the concurrency are analysed at the same time
+        """
+        # Given
+        job = BulkAnalysisJob(self.bucket_manager, 'bucket', 'photos/', concurrency=2, sink=self.sink,
+                              rekognition_client=self.rekognition_client)
+
+        # When
+        start = time.perf_counter()
+        await job.run()
+
+        # Then
+        self.assertGreaterEqual(time.perf_counter() - start, self.latency * 4)
+
+    def test_latencies_kept_for_last_objects_only(self):
+        """
+        This test method checks that the memory of the latencies of a job doesn't grow with its objects
+        """
+        # Given
+        stats = BulkAnalysisStats()
+
+        # When
+        for index in range(LATENCY_WINDOW * 3):
+            stats.latencies.record(index / 1000)
+
+        # Then
+        self.assertEqual(LATENCY_WINDOW * 3, stats.to_dict()['latency']['count'])
+        self.assertEqual(LATENCY_WINDOW, len(stats.latencies._durations))
+        self.assertEqual((LATENCY_WINDOW * 3 - 1) * 1.0, stats.to_dict()['latency']['max_ms'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,247 @@
+import os
+import tempfile
+import threading
+import time
+import unittest
+
+from flaskr.api.managers.aws_bucket_manager import AwsBucketManager
+from flaskr.api.managers.bulk_delete import BulkDeleteJob
+from flaskr.api.managers.content_addressing import ObjectAliasTable
+
+
+class VersionedS3Client:
+    """
+    Fake s3 client of a versioned bucket, listing its keys by pages of 1000 and recording the delete batches
+    """
+
+    def __init__(self, versions, failing_keys=(), latency=0.01):
+        self.versions = versions
+        self.failing_keys = set(failing_keys)
+        self.latency = latency
+        self.batches = []
+        self.listing = 0
+        self.max_listing = 0
+        self.deleted_buckets = []
+        self._lock = threading.Lock()
+
+    def get_paginator(self, operation_name):
+        return Paginator(self, operation_name)
+
+    def list_page(self, operation_name, prefix, delimiter):
+        with self._lock:
+            self.listing += 1
+            self.max_listing = max(self.max_listing, self.listing)
+        time.sleep(self.latency)
+        with self._lock:
+            self.listing -= 1
+
+        common_prefixes, entries = set(), []
+        for key in sorted(self.versions):
+            if not key.startswith(prefix):
+                continue
+            rest = key[len(prefix):]
+            if delimiter and delimiter in rest:
+                common_prefixes.add(prefix + rest.split(delimiter)[0] + delimiter)
+            elif operation_name == 'list_object_versions':
+                entries.extend((key, version_id) for version_id in self.versions[key])
+            elif self.versions[key] and not self.versions[key][-1].startswith('marker'):
+                entries.append((key, None))
+        return sorted(common_prefixes), entries
+
+    def delete_objects(self, Bucket, Delete):
+        time.sleep(self.latency)
+        errors = []
+        with self._lock:
+            self.batches.append(len(Delete['Objects']))
+            for s3_object in Delete['Objects']:
+                if s3_object['Key'] in self.failing_keys:
+                    errors.append({'Key': s3_object['Key'], 'Code': 'AccessDenied', 'Message': 'Access Denied'})
+                elif 'VersionId' in s3_object:
+                    self.versions[s3_object['Key']].remove(s3_object['VersionId'])
+                    if not self.versions[s3_object['Key']]:
+                        del self.versions[s3_object['Key']]
+                else:
+                    self.versions[s3_object['Key']].append('marker-%s' % len(self.versions[s3_object['Key']]))
+        return {'Errors': errors} if errors else {}
+
+    def delete_bucket(self, Bucket):
+        if self.versions:
+            raise Exception('BucketNotEmpty')
+        self.deleted_buckets.append(Bucket)
+
+
+class Paginator:
+    def __init__(self, s3_client, operation_name):
+        self.s3_client = s3_client
+        self.operation_name = operation_name
+
+    def paginate(self, Bucket, Prefix, Delimiter=None):
+        common_prefixes, entries = self.s3_client.list_page(self.operation_name, Prefix, Delimiter)
+        for index in range(0, max(len(entries), 1), 1000):
+            page = entries[index:index + 1000]
+            if self.operation_name == 'list_object_versions':
+                yield {'CommonPrefixes': [{'Prefix': prefix} for prefix in common_prefixes] if index == 0 else [],
+                       'Versions': [{'Key': key, 'VersionId': version_id}
+                                    for key, version_id in page if not version_id.startswith('marker')],
+                       'DeleteMarkers': [{'Key': key, 'VersionId': version_id}
+                                         for key, version_id in page if version_id.startswith('marker')]}
+            else:
+                yield {'CommonPrefixes': [{'Prefix': prefix} for prefix in common_prefixes] if index == 0 else [],
+                       'Contents': [{'Key': key} for key, _ in page]}
+
+
+class BulkDeleteTestCase(unittest.IsolatedAsyncioTestCase):
+    """
+    This test class is designed to confirm that the objects are deleted in batches of 1000 keys
+    """
+
+    def setUp(self):
+        """
+        This test method initializes the context before each test method run.
+        """
+        self.versions = {'photos/%s/%04d.jpg' % (folder, index): ['v1', 'v2']
+                         for folder in ('a', 'b', 'c', 'd') for index in range(600)}
+        self.versions['readme.txt'] = ['v1', 'marker-1']
+        self.s3_client = VersionedS3Client(self.versions)
+
+    async def test_prefix_is_deleted_with_every_version(self):
+        """
+        This test method checks that the versions and delete markers under a prefix are deleted in parallel.
+        """
+        # Given
+        progress = []
+        job = BulkDeleteJob(self.s3_client, 'photos', prefixes=[''], concurrency=4, progress=progress.append)
+
+        # When
+        stats = await job.run()
+
+        # Then
+        self.assertEqual({}, self.s3_client.versions)
+        self.assertEqual(4 * 600 * 2 + 2, stats['deleted'])
+        self.assertEqual(0, stats['failed'])
+        self.assertEqual(6, stats['prefixes'])
+        self.assertTrue(all(size <= 1000 for size in self.s3_client.batches))
+        self.assertEqual(len(self.s3_client.batches), len(progress))
+        self.assertGreater(self.s3_client.max_listing, 1)
+
+    async def test_keys_are_deleted_in_batches(self):
+        """
+        This test method checks that the given keys are split in batches of at most 1000 keys.
+        """
+        # Given
+        keys = ['photos/a/%04d.jpg' % index for index in range(600)] + \
+            ['photos/b/%04d.jpg' % index for index in range(600)]
+        job = BulkDeleteJob(self.s3_client, 'photos', keys=keys, versions=False)
+
+        # When
+        stats = await job.run()
+
+        # Then
+        self.assertEqual([1000, 200], sorted(self.s3_client.batches, reverse=True))
+        self.assertEqual(1200, stats['deleted'])
+
+    async def test_failed_keys_are_reported(self):
+        """
+        This test method checks that the keys S3 couldn't delete are counted and reported.
+        """
+        # Given
+        self.s3_client.failing_keys.add('readme.txt')
+        bucket_manager = AwsBucketManager(s3_client=self.s3_client)
+
+        # When
+        stats, status = await bucket_manager.delete_objects('photos', prefixes=[''])
+
+        # Then
+        self.assertEqual(500, status)
+        self.assertEqual(2, stats['failed'])
+        self.assertEqual({'Key': 'readme.txt', 'VersionId': None, 'Code': 'AccessDenied',
+                          'Message': 'Access Denied'}, stats['errors'][0])
+        self.assertEqual(['readme.txt'], list(self.s3_client.versions))
+
+    async def test_bucket_is_emptied_before_it_is_removed(self):
+        """
+        This test method checks that a versioned bucket is emptied with the bulk delete then removed.
+        """
+        # Given
+        bucket_manager = AwsBucketManager(s3_client=self.s3_client)
+
+        # When
+        message, status = await bucket_manager.remove_object('photos')
+
+        # Then
+        self.assertEqual(('Bucket deleted', 200), (message, status))
+        self.assertEqual(['photos'], self.s3_client.deleted_buckets)
+
+
+class ContentAddressedBulkDeleteTestCase(unittest.IsolatedAsyncioTestCase):
+    """
+    This test class is designed to confirm that the bulk delete of content addressed objects applies to their names
+    """
+
+    def setUp(self):
+        """
+        This test method initializes the context before each test method run.
+        """
+        self.folder = tempfile.TemporaryDirectory()
+        self.alias_table = ObjectAliasTable(os.path.join(self.folder.name, 'aliases.sqlite'))
+        self.alias_table.set('photos', 'a/one.jpg', 'sha256/one.jpg')
+        self.alias_table.set('photos', 'b/two.jpg', 'sha256/two.jpg')
+        self.alias_table.set('photos', 'b/copy.jpg', 'sha256/one.jpg')
+        self.s3_client = VersionedS3Client({'sha256/one.jpg': ['v1'], 'sha256/two.jpg': ['v1'],
+                                            'a/posted.jpg': ['v1']})
+        self.bucket_manager = AwsBucketManager(s3_client=self.s3_client, alias_table=self.alias_table)
+
+    def tearDown(self):
+        """
+        This test method removes the alias table after each test method run.
+        """
+        self.folder.cleanup()
+
+    async def test_prefix_applies_to_names(self):
+        """
+        This test method checks that a prefix removes the aliases of its names and keeps the shared contents.
+        """
+        # When
+        stats, status = await self.bucket_manager.delete_objects('photos', prefixes=['a/'])
+
+        # Then
+        self.assertEqual(200, status)
+        self.assertIsNone(self.alias_table.get('photos', 'a/one.jpg'))
+        self.assertEqual('sha256/one.jpg', self.alias_table.get('photos', 'b/copy.jpg'))
+        self.assertEqual(['sha256/one.jpg', 'sha256/two.jpg'], sorted(self.s3_client.versions))
+
+    async def test_content_keys_are_not_listed(self):
+        """
+        This test method checks that the content keys are only deleted through the aliases of the names.
+        """
+        # Given
+        self.s3_client.versions['sha256/unknown.jpg'] = ['v1']
+
+        # When
+        stats, status = await self.bucket_manager.delete_objects('photos', prefixes=[''])
+
+        # Then
+        self.assertEqual(200, status)
+        self.assertEqual({}, self.alias_table.names('photos'))
+        self.assertNotIn('a/posted.jpg', self.s3_client.versions)
+        self.assertEqual(['v1'], self.s3_client.versions['sha256/unknown.jpg'])
+        self.assertEqual(['v1', 'marker-1'], self.s3_client.versions['sha256/one.jpg'])
+
+    async def test_alias_is_restored_when_content_is_not_deleted(self):
+        """
+        This test method checks that a name whose content couldn't be deleted keeps its alias.
+        """
+        # Given
+        self.s3_client.failing_keys.add('sha256/two.jpg')
+
+        # When
+        stats, status = await self.bucket_manager.delete_objects('photos', keys=['b/two.jpg'])
+
+        # Then
+        self.assertEqual(500, status)
+        self.assertEqual('sha256/two.jpg', self.alias_table.get('photos', 'b/two.jpg'))
+        self.assertFalse(self.alias_table.deleting('photos', 'sha256/two.jpg'))
+
+
+if __name__ == '__main__':
+    unittest.main()
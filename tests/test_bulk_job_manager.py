@@ -0,0 +1,182 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+from flaskr import create_app
+from flaskr.api.managers.aws_bucket_manager import AwsBucketManager
+from flaskr.api.managers.bulk_job_manager import BulkJobJournal, BulkJobManager, INTERRUPTED, COMPLETED
+from flaskr.api.managers.rekognition_result_cache import result_cache
+
+
+class PagedS3Client:
+    """
+    Fake s3 client listing its objects in pages of two objects
+    """
+
+    def __init__(self, etags):
+        self.etags = etags
+
+    def get_paginator(self, operation_name):
+        return self
+
+    def paginate(self, Bucket, Prefix):
+        keys = sorted(self.etags)
+        for index in range(0, len(keys), 2):
+            yield {'Contents': [{'Key': key, 'ETag': self.etags[key]} for key in keys[index:index + 2]]}
+
+
+class CountingRekognitionClient:
+    """
+    Fake rekognition client recording the analysed objects
+    """
+
+    def __init__(self):
+        self.names = []
+        self._lock = threading.Lock()
+
+    def detect_faces(self, Image, Attributes):
+        with self._lock:
+            self.names.append(Image['S3Object']['Name'])
+        return {'FaceDetails': []}
+
+
+class BulkJobManagerTestCase(unittest.TestCase):
+    """
+    This test class is designed to confirm the BulkJobManager class's behavior
+    """
+
+    def setUp(self):
+        """
+        This test method initializes the context before each test method run.
+        """
+        self.folder = tempfile.mkdtemp()
+        self.journal = BulkJobJournal(os.path.join(self.folder, 'jobs.sqlite'))
+        self.etags = {'%s.jpg' % index: '"v1"' for index in range(6)}
+        self.manager = BulkJobManager(self.journal, AwsBucketManager(s3_client=PagedS3Client(self.etags)))
+        self.rekognition_client = CountingRekognitionClient()
+        self.manager_client_patch = mock.patch(
+            'flaskr.api.managers.bulk_analysis.get_rekognition_client', return_value=self.rekognition_client)
+        self.manager_client_patch.start()
+        if result_cache is not None:
+            result_cache.clear()
+
+    def tearDown(self):
+        self.manager_client_patch.stop()
+        shutil.rmtree(self.folder)
+
+    def wait(self, job_id):
+        for _ in range(100):
+            job = self.manager.status(job_id)
+            if job['status'] not in ('pending', 'running'):
+                return job
+            time.sleep(0.05)
+        self.fail('The job did not finish')
+
+    def test_job_journaled(self):
+        """
+        This test method checks that a job analyses every object and journals its progress
+        """
+        # When
+        job = self.wait(self.manager.submit('bucket'))
+
+        # Then
+        self.assertEqual(COMPLETED, job['status'])
+        self.assertEqual(6, job['objects']['completed'])
+        self.assertEqual(6, len(self.journal.results(job['id'])))
+
+    def test_objects_journaled_in_batches(self):
+        """
+        This test method checks that a job journals its objects with a single connection and a single transaction
+        """
+        # Given
+        connect = mock.Mock(wraps=self.journal.connect)
+        record_objects = mock.Mock(wraps=self.journal.record_objects)
+
+        # When
+        with mock.patch.multiple(self.journal, connect=connect, record_objects=record_objects):
+            job = self.wait(self.manager.submit('bucket'))
+
+        # Then
+        self.assertEqual(6, job['objects']['completed'])
+        self.assertEqual(1, connect.call_count)
+        self.assertEqual(1, record_objects.call_count)
+
+    def test_final_status_written_before_release(self):
+        """
+        This test method checks that a finished job is still running until its final status is written
+        """
+        # Given
+        running = []
+        set_status = self.journal.set_status
+
+        def recording_set_status(job_id, status, stats=None):
+            running.append(job_id in self.manager._running)
+            set_status(job_id, status, stats)
+
+        # When
+        with mock.patch.object(self.journal, 'set_status', side_effect=recording_set_status):
+            job = self.wait(self.manager.submit('bucket'))
+
+        # Then
+        self.assertEqual(COMPLETED, job['status'])
+        self.assertEqual(True, running[-1])
+
+    def test_unchanged_objects_skipped(self):
+        """
+        This test method checks that a new job only analyses the objects whose etag changed
+        """
+        # Given
+        self.wait(self.manager.submit('bucket'))
+        self.rekognition_client.names = []
+        self.etags['2.jpg'] = '"v2"'
+
+        # When
+        job = self.wait(self.manager.submit('bucket'))
+
+        # Then
+        self.assertEqual(['2.jpg'], self.rekognition_client.names)
+        self.assertEqual(5, job['stats']['unchanged'])
+
+    def test_interrupted_job_resumed(self):
+        """
+        This test method checks that a resumed job doesn't analyse again the objects already done
+        """
+        # Given
+        job_id = self.journal.create_job('bucket', '', ['detect_faces'], 2)
+        for key in ('0.jpg', '1.jpg'):
+            self.journal.record_object(job_id, 'other-bucket', ['detect_faces'],
+                                       {'key': key, 'etag': '"v1"', 'results': {'detect_faces': []}, 'errors': {}})
+        self.journal.set_status(job_id, INTERRUPTED)
+
+        # When
+        self.assertTrue(self.manager.resume(job_id))
+        job = self.wait(job_id)
+
+        # Then
+        self.assertEqual(COMPLETED, job['status'])
+        self.assertEqual(['2.jpg', '3.jpg', '4.jpg', '5.jpg'], sorted(self.rekognition_client.names))
+        self.assertEqual(6, job['objects']['completed'])
+
+    def test_invalid_concurrency_refused(self):
+        """
+        This test method checks that a job with a concurrency which is not a positive integer is refused
+        """
+        # Given
+        with mock.patch('flaskr.api.managers.aws_bucket_manager.get_client', return_value=PagedS3Client(self.etags)):
+            app = create_app({'AWS_WARM_CLIENTS': False, 'DATABASE': os.path.join(self.folder, 'flaskr.sqlite')})
+        client = app.test_client()
+
+        # When
+        responses = [client.post('/api/jobs', json={'bucket': 'photos', 'concurrency': concurrency})
+                     for concurrency in ('many', 0, -1, 1000)]
+
+        # Then
+        self.assertEqual([400] * 4, [response.status_code for response in responses])
+
+
+if __name__ == '__main__':
+    unittest.main()
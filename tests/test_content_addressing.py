@@ -0,0 +1,192 @@
+import asyncio
+import hashlib
+import io
+import os
+import tempfile
+import threading
+import unittest
+
+from flaskr.api.managers.aws_bucket_manager import AwsBucketManager
+from flaskr.api.managers.content_addressing import ObjectAliasTable, content_key
+
+
+class NotFound(Exception):
+    pass
+
+
+class ObjectStoreS3Client:
+    """
+    Fake s3 client storing the objects of a bucket in memory and counting the uploads
+    """
+
+    def __init__(self):
+        self.objects = {}
+        self.uploads = 0
+        self.deleting = threading.Event()
+        self.delete_allowed = threading.Event()
+        self.delete_allowed.set()
+
+    def head_bucket(self, Bucket):
+        pass
+
+    def head_object(self, Bucket, Key):
+        if Key not in self.objects:
+            raise NotFound(Key)
+        return {'ContentLength': len(self.objects[Key])}
+
+    def put_object(self, Bucket, Key, Body):
+        self.uploads += 1
+        self.objects[Key] = bytes(Body)
+
+    def upload_fileobj(self, Fileobj, Bucket, Key, Config=None):
+        self.uploads += 1
+        self.objects[Key] = Fileobj.read()
+
+    def copy(self, CopySource, Bucket, Key, Config=None):
+        self.objects[Key] = self.objects[CopySource['Key']]
+
+    def delete_object(self, Bucket, Key):
+        self.deleting.set()
+        self.delete_allowed.wait(5)
+        self.objects.pop(Key, None)
+
+    def generate_presigned_url(self, ClientMethod, Params, ExpiresIn=3600):
+        return 'https://%s.s3.local/%s' % (Params['Bucket'], Params['Key'])
+
+
+class ContentAddressingTestCase(unittest.IsolatedAsyncioTestCase):
+    """
+    This test class is designed to confirm that the content addressed objects are stored once and reached by name
+    """
+
+    def setUp(self):
+        """
+        This test method initializes the context before each test method run.
+        """
+        self.folder = tempfile.mkdtemp()
+        self.alias_table = ObjectAliasTable(os.path.join(self.folder, 'aliases.sqlite'))
+        self.s3_client = ObjectStoreS3Client()
+        self.bucket_manager = AwsBucketManager(s3_client=self.s3_client, alias_table=self.alias_table)
+        self.image = b'first picture'
+        self.key = content_key(hashlib.sha256(self.image).hexdigest(), 'face.JPG')
+
+    async def test_same_content_is_uploaded_once(self):
+        """
+        This test method checks that the second upload of a content under another name is skipped.
+        """
+        # When
+        first_url, _ = await self.bucket_manager.upload_bytes('photos', 'face.JPG', self.image)
+        second_url, _ = await self.bucket_manager.upload_bytes('photos', 'copy.jpg', self.image)
+
+        # Then
+        self.assertTrue(self.key.endswith('.jpg'))
+        self.assertEqual(1, self.s3_client.uploads)
+        self.assertEqual(1, self.bucket_manager.deduplicated)
+        self.assertTrue(first_url.endswith(self.key))
+        self.assertEqual(self.key, self.alias_table.get('photos', 'copy.jpg'))
+
+    async def test_streamed_upload_is_moved_to_its_content_key(self):
+        """
+        This test method checks that a streamed upload ends under its content key without temporary object.
+        """
+        # Given
+        self.bucket_manager.content_buffer_size = 4
+
+        # When
+        url, status, headers = await self.bucket_manager.upload_stream('photos', 'face.JPG', io.BytesIO(self.image))
+
+        # Then
+        self.assertEqual(200, status)
+        self.assertEqual([self.key], list(self.s3_client.objects))
+        self.assertEqual(self.image, self.s3_client.objects[self.key])
+        self.assertEqual(self.key, self.alias_table.get('photos', 'face.JPG'))
+
+    async def test_small_streamed_duplicate_is_not_uploaded(self):
+        """
+        This test method checks that a streamed upload held in memory is skipped when its content is stored.
+        """
+        # Given
+        await self.bucket_manager.upload_stream('photos', 'face.JPG', io.BytesIO(self.image))
+
+        # When
+        url, status, headers = await self.bucket_manager.upload_stream('photos', 'copy.jpg', io.BytesIO(self.image))
+
+        # Then
+        self.assertEqual(200, status)
+        self.assertEqual(1, self.s3_client.uploads)
+        self.assertEqual(hashlib.sha256(self.image).hexdigest(), headers['X-Content-SHA256'])
+        self.assertEqual([self.key], list(self.s3_client.objects))
+        self.assertEqual(self.key, self.alias_table.get('photos', 'copy.jpg'))
+
+    async def test_shared_content_is_kept_until_last_name_is_removed(self):
+        """
+        This test method checks that a content is only deleted when no name references it anymore.
+        """
+        # Given
+        await self.bucket_manager.upload_bytes('photos', 'face.JPG', self.image)
+        await self.bucket_manager.upload_bytes('photos', 'copy.jpg', self.image)
+
+        # When
+        await self.bucket_manager.remove_object('photos', 'face.JPG')
+        kept = self.key in self.s3_client.objects
+        await self.bucket_manager.remove_object('photos', 'copy.jpg')
+
+        # Then
+        self.assertTrue(kept)
+        self.assertNotIn(self.key, self.s3_client.objects)
+
+    async def test_overwritten_name_releases_previous_content(self):
+        """
+        This test method checks that a name uploaded again with another content points to the new content.
+        """
+        # Given
+        await self.bucket_manager.upload_bytes('photos', 'face.JPG', self.image)
+
+        # When
+        await self.bucket_manager.upload_bytes('photos', 'face.JPG', b'second picture')
+
+        # Then
+        self.assertNotIn(self.key, self.s3_client.objects)
+        self.assertEqual(1, len(self.s3_client.objects))
+
+    async def test_upload_during_removal_stores_content_again(self):
+        """
+        This test method checks that a content found stored while it is being deleted is stored again.
+        """
+        # Given
+        await self.bucket_manager.upload_bytes('photos', 'face.JPG', self.image)
+        self.s3_client.delete_allowed.clear()
+        removal = asyncio.create_task(self.bucket_manager.remove_object('photos', 'face.JPG'))
+        await asyncio.to_thread(self.s3_client.deleting.wait, 5)
+
+        # When
+        upload = asyncio.create_task(self.bucket_manager.upload_bytes('photos', 'copy.jpg', self.image))
+        await asyncio.sleep(0.1)
+        self.s3_client.delete_allowed.set()
+        await removal
+        await upload
+
+        # Then
+        self.assertIn(self.key, self.s3_client.objects)
+        self.assertEqual(self.key, self.alias_table.get('photos', 'copy.jpg'))
+
+    async def test_claimed_content_is_kept_on_removal(self):
+        """
+        This test method checks that a content claimed by an upload isn't deleted with its last name.
+        """
+        # Given
+        await self.bucket_manager.upload_bytes('photos', 'face.JPG', self.image)
+        claim_id, deleting = self.alias_table.claim('photos', self.key)
+
+        # When
+        await self.bucket_manager.remove_object('photos', 'face.JPG')
+
+        # Then
+        self.assertFalse(deleting)
+        self.assertIn(self.key, self.s3_client.objects)
+        self.alias_table.set('photos', 'copy.jpg', self.key, claim_id)
+        self.assertEqual(self.key, self.alias_table.get('photos', 'copy.jpg'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,157 @@
+import io
+import os
+import re
+import tempfile
+import unittest
+from unittest import mock
+
+from botocore.exceptions import ClientError
+from botocore.response import StreamingBody
+
+from flaskr import create_app
+from flaskr.api.managers.aws_bucket_manager import AwsBucketManager
+
+
+class RangedS3Client:
+    """
+    Fake s3 client serving ranged and conditional GETs of its objects
+    """
+
+    def __init__(self, objects):
+        self.objects = objects
+
+    def get_object(self, Bucket, Key, Range=None, IfNoneMatch=None):
+        if Key not in self.objects:
+            raise ClientError({'Error': {'Code': 'NoSuchKey'}, 'ResponseMetadata': {'HTTPStatusCode': 404}},
+                              'GetObject')
+        data = self.objects[Key]
+        e_tag = '"%s"' % len(data)
+        if IfNoneMatch is not None and e_tag in [value.strip() for value in IfNoneMatch.split(',')]:
+            raise ClientError({'Error': {'Code': '304'},
+                               'ResponseMetadata': {'HTTPStatusCode': 304, 'HTTPHeaders': {'etag': e_tag}}},
+                              'GetObject')
+
+        response = {'ETag': e_tag}
+        if Range is not None:
+            start, end = (int(value) for value in re.match(r'bytes=(\d+)-(\d+)', Range).groups())
+            if start >= len(data):
+                raise ClientError({'Error': {'Code': 'InvalidRange', 'ActualObjectSize': str(len(data))},
+                                   'ResponseMetadata': {'HTTPStatusCode': 416}}, 'GetObject')
+            response['ContentRange'] = 'bytes %s-%s/%s' % (start, min(end, len(data) - 1), len(data))
+            data = data[start:end + 1]
+
+        response['ContentLength'] = len(data)
+        response['Body'] = StreamingBody(io.BytesIO(data), len(data))
+        return response
+
+
+class DownloadStreamTestCase(unittest.IsolatedAsyncioTestCase):
+    """
+    This test class is designed to confirm that the objects are streamed with ranges and conditional GETs
+    """
+
+    def setUp(self):
+        """
+        This test method initializes the context before each test method run.
+        """
+        self.data = os.urandom(200 * 1024)
+        self.bucket_manager = AwsBucketManager(s3_client=RangedS3Client({'face.jpg': self.data}))
+
+    async def test_whole_object_is_streamed(self):
+        """
+        This test method checks that the body of the object is read chunk by chunk.
+        """
+        # When
+        s3_object, status = await self.bucket_manager.get_object_stream('photos', 'face.jpg')
+        chunks = list(s3_object['Body'].iter_chunks(64 * 1024))
+
+        # Then
+        self.assertEqual(200, status)
+        self.assertEqual(4, len(chunks))
+        self.assertEqual(self.data, b''.join(chunks))
+
+    async def test_range_is_forwarded(self):
+        """
+        This test method checks that a range is fetched with a ranged GET.
+        """
+        # When
+        s3_object, status = await self.bucket_manager.get_object_stream('photos', 'face.jpg', 'bytes=10-19')
+
+        # Then
+        self.assertEqual(206, status)
+        self.assertEqual('bytes 10-19/%s' % len(self.data), s3_object['ContentRange'])
+        self.assertEqual(self.data[10:20], s3_object['Body'].read())
+
+    async def test_matching_etag_is_not_modified(self):
+        """
+        This test method checks that an object whose ETag matches If-None-Match is not returned.
+        """
+        # When
+        _, status = await self.bucket_manager.get_object_stream(
+            'photos', 'face.jpg', if_none_match='"%s"' % len(self.data))
+
+        # Then
+        self.assertEqual(304, status)
+
+    async def test_errors_are_mapped(self):
+        """
+        This test method checks that a missing object and an invalid range get their own status.
+        """
+        # When
+        _, missing_status = await self.bucket_manager.get_object_stream('photos', 'missing.jpg')
+        _, range_status = await self.bucket_manager.get_object_stream('photos', 'face.jpg', 'bytes=999999-1000000')
+
+        # Then
+        self.assertEqual(404, missing_status)
+        self.assertEqual(416, range_status)
+
+
+class DownloadEndpointTestCase(unittest.TestCase):
+    """
+    This test class is designed to confirm the headers of the download endpoint's empty answers
+    """
+
+    def setUp(self):
+        """
+        This test method initializes the context before each test method run.
+        """
+        self.data = b'picture'
+        self.folder = tempfile.TemporaryDirectory()
+        with mock.patch('flaskr.api.managers.aws_bucket_manager.get_client',
+                        return_value=RangedS3Client({'face.jpg': self.data})):
+            app = create_app({'AWS_WARM_CLIENTS': False,
+                              'DATABASE': os.path.join(self.folder.name, 'flaskr.sqlite')})
+        self.client = app.test_client()
+
+    def tearDown(self):
+        """
+        This test method removes the database after each test method run.
+        """
+        self.folder.cleanup()
+
+    def test_unsatisfiable_range_gives_object_size(self):
+        """
+        This test method checks that a range out of the object is answered with the size of the object.
+        """
+        # When
+        response = self.client.get('/api/download/photos/face.jpg', headers={'Range': 'bytes=100-200'})
+
+        # Then
+        self.assertEqual(416, response.status_code)
+        self.assertEqual('bytes */%s' % len(self.data), response.headers['Content-Range'])
+
+    def test_not_modified_gives_object_etag(self):
+        """
+        This test method checks that a not modified object is answered with its own ETag, not the listed ones.
+        """
+        # When
+        response = self.client.get('/api/download/photos/face.jpg',
+                                   headers={'If-None-Match': '"other", "%s"' % len(self.data)})
+
+        # Then
+        self.assertEqual(304, response.status_code)
+        self.assertEqual('"%s"' % len(self.data), response.headers['ETag'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+import json
+import unittest
+from unittest import mock
+
+from flaskr.api.managers.rekognition_image_detection import face_from_bytes
+from flaskr.api.managers.rekognition_objects import RekognitionFace
+
+
+class RecordingRekognitionClient:
+    """
+    Fake rekognition client recording the attributes requested to DetectFaces
+    """
+
+    def __init__(self):
+        self.attributes = []
+
+    def detect_faces(self, Image, Attributes):
+        self.attributes.append(Attributes)
+        face = {'BoundingBox': {'Left': 0.1}, 'Confidence': 99.0}
+        if Attributes == ['ALL']:
+            face['Smile'] = {'Value': True, 'Confidence': 90.0}
+        return {'FaceDetails': [face]}
+
+
+class FaceProjectionTestCase(unittest.TestCase):
+    """
+    This test class is designed to confirm that only the requested face attributes are computed
+    """
+
+    def setUp(self):
+        """
+        This test method initializes the context before each test method run.
+        """
+        self.client = RecordingRekognitionClient()
+        patcher = mock.patch('flaskr.api.managers.rekognition_image_detection.get_client', return_value=self.client)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def analyse(self, args, image_bytes):
+        return json.loads(face_from_bytes(image_bytes, 'image', args=args))
+
+    def test_default_attributes_requested(self):
+        """
+        This test method checks that DEFAULT attributes are requested for default fields
+        """
+        # When
+        result = self.analyse('bounding_box,confidence', b'first picture')
+
+        # Then
+        self.assertEqual([['DEFAULT']], self.client.attributes)
+        self.assertEqual([{'bounding_box': [{'Left': 0.1}]}, {'confidence': [99.0]}], result)
+
+    def test_all_attributes_requested(self):
+        """
+        This test method checks that ALL attributes are requested when a field needs them
+        """
+        # When
+        result = self.analyse('confidence,has', b'second picture')
+
+        # Then
+        self.assertEqual([['ALL']], self.client.attributes)
+        self.assertEqual([{'confidence': [99.0]}, {'has': [['smile']]}], result)
+
+    def test_only_requested_fields_rendered(self):
+        """
+        This test method checks that the rendering only contains the requested fields
+        """
+        # Given
+        face = RekognitionFace({'BoundingBox': {'Left': 0.1}, 'Confidence': 99.0, 'Pose': {'Roll': 1.0}})
+
+        # When
+        rendering = face.to_dict_args(['pose'])
+
+        # Then
+        self.assertEqual({'pose': {'Roll': 1.0}}, rendering)
+
+    def test_unknown_field_refused(self):
+        """
+        This test method checks that an unknown field is refused
+        """
+        # When / Then
+        with self.assertRaises(ValueError):
+            RekognitionFace.required_attributes(['confidence', 'shoe_size'])
+
+
+if __name__ == '__main__':
+    unittest.main()
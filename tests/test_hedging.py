@@ -0,0 +1,141 @@
+import threading
+import time
+import unittest
+
+from flaskr.api.helpers.hedging import Hedger
+from flaskr.api.helpers.rate_limiter import AdaptiveRateLimiter
+from flaskr.api.managers.rekognition_image_detection import RekognitionImage
+
+
+class StragglerRekognitionClient:
+    """
+    Fake rekognition client whose first call is a straggler once the latencies are recorded
+    """
+
+    def __init__(self, latency, straggler_latency):
+        self.latency = latency
+        self.straggler_latency = straggler_latency
+        self.calls = 0
+        self.straggle = False
+        self._lock = threading.Lock()
+
+    def detect_faces(self, Image, Attributes):
+        with self._lock:
+            self.calls += 1
+            straggle, self.straggle = self.straggle, False
+        time.sleep(self.straggler_latency if straggle else self.latency)
+        return {'FaceDetails': [{'Confidence': 99.0}], 'ResponseMetadata': {}}
+
+
+class HedgingTestCase(unittest.TestCase):
+    """
+    This test class is designed to confirm that a slow rekognition call is hedged and the first response wins
+    """
+
+    def setUp(self):
+        """
+        This test method initializes the context before each test method run.
+        """
+        self.client = StragglerRekognitionClient(latency=0.01, straggler_latency=1.0)
+        self.hedger = Hedger(percentile=90, min_samples=5, max_ratio=0.5)
+        self.limiter = AdaptiveRateLimiter(default_rate=1000)
+        self.patch_image(result_cache=None, single_flight=None, rate_limiter=self.limiter, hedger=self.hedger)
+
+    def patch_image(self, **attributes):
+        for name, value in attributes.items():
+            previous = getattr(RekognitionImage, name)
+            setattr(RekognitionImage, name, value)
+            self.addCleanup(setattr, RekognitionImage, name, previous)
+
+    def detect_faces(self):
+        image = RekognitionImage({'Bytes': b'picture'}, 'picture', self.client)
+        return image.detect_faces()
+
+    def test_no_hedge_before_enough_samples(self):
+        """
+        This test method checks that the calls are not hedged while the latencies are unknown.
+        """
+        # When
+        self.detect_faces()
+
+        # Then
+        self.assertIsNone(self.hedger.delay('detect_faces'))
+        self.assertEqual(1, self.client.calls)
+
+    def test_straggler_is_hedged_and_hedge_wins(self):
+        """
+        This test method checks that a straggler call is sent again and the faster response is returned.
+        """
+        # Given
+        for _ in range(5):
+            self.detect_faces()
+        self.client.straggle = True
+
+        # When
+        start = time.perf_counter()
+        faces = self.detect_faces()
+        elapsed = time.perf_counter() - start
+
+        # Then
+        stats = self.hedger.stats()['detect_faces']
+        self.assertEqual(1, len(faces))
+        self.assertLess(elapsed, 0.5)
+        self.assertEqual(1, stats['fired'])
+        self.assertEqual(1, stats['won'])
+        self.assertEqual(7, self.client.calls)
+
+    def test_hedge_denied_without_budget(self):
+        """
+        This test method checks that no hedge is sent when the rate limiter has no token left.
+        """
+        # Given
+        for _ in range(5):
+            self.detect_faces()
+        self.client.straggle = True
+        self.client.straggler_latency = 0.2
+
+        # When
+        self.hedger.call('detect_faces', lambda hedge: self.client.detect_faces(Image={}, Attributes=['ALL']),
+                         may_hedge=lambda: False)
+
+        # Then
+        stats = self.hedger.stats()['detect_faces']
+        self.assertEqual(0, stats['fired'])
+        self.assertEqual(1, stats['denied'])
+
+    def test_token_waits_not_recorded(self):
+        """
+        This test method checks that the hedging delay doesn't include the time spent waiting for a token.
+        """
+        # Given a bucket of 5 tokens per second, so most calls wait for their token
+        self.patch_image(rate_limiter=AdaptiveRateLimiter(default_rate=5))
+
+        # When
+        for _ in range(8):
+            self.detect_faces()
+
+        # Then
+        self.assertLess(self.hedger.delay('detect_faces'), 0.1)
+
+
+    def test_pool_wait_not_counted_in_delay(self):
+        """
+        This test method checks that a call waiting for a thread of the pool is not hedged before it started.
+        """
+        # Given a pool of one thread, busy for longer than the hedging delay
+        hedger = Hedger(percentile=90, min_samples=5, max_ratio=0.5, max_workers=1)
+        self.patch_image(hedger=hedger)
+        for _ in range(5):
+            self.detect_faces()
+        hedger._get_executor().submit(time.sleep, 0.2)
+
+        # When
+        faces = self.detect_faces()
+
+        # Then
+        self.assertEqual(1, len(faces))
+        self.assertEqual(0, hedger.stats()['detect_faces']['fired'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,159 @@
+import hashlib
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+from flaskr.api.helpers.image_fetcher import ImageFetcher, ImageTooLarge
+
+PICTURE = b'picture' * 1000
+
+
+class ImageHandler(BaseHTTPRequestHandler):
+    """
+    Fake image server answering the conditional requests, with keep-alive connections
+    """
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.server.requests.append(self.path)
+        self.server.client_ports.add(self.client_address[1])
+
+        if self.path == '/large.jpg':
+            # no Content-Length, so the size is only known while reading
+            self.send_response(200)
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.end_headers()
+            for _ in range(10):
+                self.wfile.write(b'%x\r\n%s\r\n' % (len(PICTURE), PICTURE))
+            self.wfile.write(b'0\r\n\r\n')
+            return
+
+        if self.path == '/missing.jpg':
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        etag = '"%s"' % self.server.version
+        if self.path == '/face.jpg' and self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        self.send_response(200)
+        if self.path == '/face.jpg':
+            self.send_header('ETag', etag)
+        self.send_header('Content-Length', str(len(PICTURE)))
+        self.end_headers()
+        self.wfile.write(PICTURE)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class ImageFetcherTestCase(unittest.TestCase):
+    """
+    This test class is designed to confirm that the images are streamed with a size limit and fetched again conditionally
+    """
+
+    def setUp(self):
+        """
+        This test method initializes the context before each test method run.
+        """
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), ImageHandler)
+        self.server.requests = []
+        self.server.client_ports = set()
+        self.server.version = 1
+        threading.Thread(target=self.server.serve_forever, args=(0.05,), daemon=True).start()
+        self.base_url = 'http://127.0.0.1:%s' % self.server.server_address[1]
+        self.fetcher = ImageFetcher(max_bytes=len(PICTURE) * 2, chunk_size=1024)
+
+    def tearDown(self):
+        """
+        This test method stops the image server after each test method run.
+        """
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_unchanged_image_is_not_downloaded_again(self):
+        """
+        This test method checks that an image with an ETag is fetched again with a conditional request.
+        """
+        # When
+        first_bytes, first_digest = self.fetcher.fetch(self.base_url + '/face.jpg')
+        second_bytes, second_digest = self.fetcher.fetch(self.base_url + '/face.jpg')
+
+        # Then
+        self.assertEqual(PICTURE, first_bytes)
+        self.assertEqual(first_bytes, second_bytes)
+        self.assertEqual(hashlib.sha256(PICTURE).hexdigest(), second_digest)
+        self.assertEqual(1, self.fetcher.stats()['not_modified'])
+        self.assertEqual(len(PICTURE), self.fetcher.stats()['downloaded_bytes'])
+
+    def test_changed_image_is_downloaded_again(self):
+        """
+        This test method checks that an image whose ETag changed is downloaded again.
+        """
+        # Given
+        self.fetcher.fetch(self.base_url + '/face.jpg')
+        self.server.version = 2
+
+        # When
+        self.fetcher.fetch(self.base_url + '/face.jpg')
+
+        # Then
+        self.assertEqual(0, self.fetcher.stats()['not_modified'])
+        self.assertEqual(2 * len(PICTURE), self.fetcher.stats()['downloaded_bytes'])
+
+    def test_image_without_validator_is_not_kept(self):
+        """
+        This test method checks that an image served without ETag nor Last-Modified is not cached.
+        """
+        # When
+        self.fetcher.fetch(self.base_url + '/other.jpg')
+
+        # Then
+        self.assertEqual(0, self.fetcher.stats()['cached_images'])
+
+    def test_too_large_image_is_refused(self):
+        """
+        This test method checks that an image is refused as soon as it is larger than max_bytes.
+        """
+        # Given
+        self.fetcher.max_bytes = len(PICTURE) - 1
+
+        # When / Then
+        with self.assertRaises(ImageTooLarge):
+            self.fetcher.fetch(self.base_url + '/other.jpg')
+        with self.assertRaises(ImageTooLarge):
+            self.fetcher.fetch(self.base_url + '/large.jpg')
+        self.assertEqual(2, self.fetcher.stats()['too_large'])
+
+    def test_missing_image_raises(self):
+        """
+        This test method checks that an error response is raised instead of being analysed.
+        """
+        # When / Then
+        with self.assertRaises(requests.HTTPError):
+            self.fetcher.fetch(self.base_url + '/missing.jpg')
+
+    def test_connection_is_kept_alive(self):
+        """
+        This test method checks that the images are fetched over the same connection.
+        """
+        # When
+        for _ in range(3):
+            self.fetcher.fetch(self.base_url + '/other.jpg')
+
+        # Then
+        self.assertEqual(3, len(self.server.requests))
+        self.assertEqual(1, len(self.server.client_ports))
+
+
+if __name__ == '__main__':
+    unittest.main()
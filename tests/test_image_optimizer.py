@@ -0,0 +1,113 @@
+import io
+import unittest
+from unittest import mock
+
+from PIL import Image
+
+from flaskr.api.helpers.image_optimizer import ImageOptimizer
+
+
+def make_image(size, format, **save_options):
+    image = Image.linear_gradient('L').resize(size).convert('RGB')
+    output = io.BytesIO()
+    image.save(output, format=format, **save_options)
+    return output.getvalue()
+
+
+class ImageOptimizerTestCase(unittest.TestCase):
+    """
+    This test class is designed to confirm the ImageOptimizer class's behavior
+    """
+
+    def setUp(self):
+        """
+        This test method initializes the context before each test method run.
+        """
+        self.optimizer = ImageOptimizer(max_dimension=800, jpeg_quality=80)
+
+    def test_large_png_downscaled_to_jpeg(self):
+        """
+        This test method checks that a large png is downscaled and transcoded to jpeg
+        """
+        # Given
+        image_bytes = make_image((3200, 2400), 'PNG')
+
+        # When
+        optimized_bytes, stats = self.optimizer.optimize(image_bytes)
+
+        # Then
+        optimized = Image.open(io.BytesIO(optimized_bytes))
+        self.assertEqual('JPEG', optimized.format)
+        self.assertEqual((800, 600), optimized.size)
+        self.assertEqual(len(image_bytes) - len(optimized_bytes), stats['saved_bytes'])
+        self.assertGreater(stats['saved_bytes'], 0)
+
+    def test_large_jpeg_keeps_aspect_ratio(self):
+        """
+        This test method checks that a downscaled jpeg keeps its aspect ratio, so bounding boxes stay valid
+        """
+        # Given
+        image_bytes = make_image((4000, 1000), 'JPEG', quality=95)
+
+        # When
+        optimized_bytes, stats = self.optimizer.optimize(image_bytes)
+
+        # Then
+        self.assertEqual((800, 200), Image.open(io.BytesIO(optimized_bytes)).size)
+
+    def test_small_jpeg_untouched(self):
+        """
+        This test method checks that a small jpeg without metadata is sent as it is
+        """
+        # Given
+        image_bytes = make_image((640, 480), 'JPEG')
+
+        # When
+        optimized_bytes, stats = self.optimizer.optimize(image_bytes)
+
+        # Then
+        self.assertIs(image_bytes, optimized_bytes)
+        self.assertEqual(0, stats['saved_bytes'])
+
+    def test_metadata_stripped(self):
+        """
+        This test method checks that the exif metadata are not sent to rekognition
+        """
+        # Given
+        exif = Image.Exif()
+        exif[0x010e] = 'description ' * 2000
+        image_bytes = make_image((640, 480), 'JPEG', exif=exif.tobytes())
+
+        # When
+        optimized_bytes, stats = self.optimizer.optimize(image_bytes)
+
+        # Then
+        self.assertNotIn('exif', Image.open(io.BytesIO(optimized_bytes)).info)
+
+    def test_invalid_image_untouched(self):
+        """
+        This test method checks that bytes which are not an image are sent as they are
+        """
+        # When
+        optimized_bytes, stats = self.optimizer.optimize(b'not an image')
+
+        # Then
+        self.assertEqual(b'not an image', optimized_bytes)
+
+    def test_decompression_bomb_untouched(self):
+        """
+        This test method checks that an image with too many pixels to decode is sent as it is
+        """
+        # Given
+        image_bytes = make_image((1000, 1000), 'PNG')
+
+        # When
+        with mock.patch.object(Image, 'MAX_IMAGE_PIXELS', 1000):
+            optimized_bytes, stats = self.optimizer.optimize(image_bytes)
+
+        # Then
+        self.assertEqual(image_bytes, optimized_bytes)
+
+
+if __name__ == '__main__':
+    unittest.main()
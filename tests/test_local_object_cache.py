@@ -0,0 +1,190 @@
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from flaskr.api.managers.aws_bucket_manager import AwsBucketManager
+from flaskr.api.managers.local_object_cache import LocalObjectCache, TEMPORARY_PREFIX
+
+
+class DownloadingS3Client:
+    """
+    Fake s3 client counting the downloads of its objects
+    """
+
+    def __init__(self, objects):
+        self.objects = objects
+        self.downloads = 0
+
+    def head_object(self, Bucket, Key):
+        return {'ContentLength': len(self.objects[Key]), 'ETag': '"%s"' % hash(self.objects[Key])}
+
+    def download_file(self, Bucket, Key, Filename):
+        self.downloads += 1
+        with open(Filename, 'wb') as file:
+            file.write(self.objects[Key])
+
+
+class LocalObjectCacheTestCase(unittest.IsolatedAsyncioTestCase):
+    """
+    This test class is designed to confirm that the local files are stored by content hash in a bounded folder
+    """
+
+    def setUp(self):
+        """
+        This test method initializes the context before each test method run.
+        """
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.folder)
+        self.cache = LocalObjectCache(self.folder, max_bytes=250, grace_period=0)
+
+    def test_file_is_reused_for_its_version_only(self):
+        """
+        This test method checks that a cached file is only returned for the version it was cached with.
+        """
+        # Given
+        path = self.cache.put_bytes('photos', 'face.jpg', b'picture', version='v1', extension='.JPG')
+
+        # When
+        same_version = self.cache.get('photos', 'face.jpg', 'v1')
+        other_version = self.cache.get('photos', 'face.jpg', 'v2')
+
+        # Then
+        self.assertEqual(path, same_version)
+        self.assertIsNone(other_version)
+        self.assertTrue(path.endswith('.jpg'))
+        with open(path, 'rb') as file:
+            self.assertEqual(b'picture', file.read())
+
+    def test_files_are_named_after_their_content(self):
+        """
+        This test method checks that a new content under a name gets its own file, the same content is stored once.
+        """
+        # When
+        first = self.cache.put_bytes('photos', 'face.jpg', b'first picture')
+        copy = self.cache.put_bytes('photos', 'copy.jpg', b'first picture')
+        second = self.cache.put_bytes('photos', 'face.jpg', b'second picture')
+
+        # Then
+        self.assertEqual(first, copy)
+        self.assertNotEqual(first, second)
+        self.assertEqual(second, self.cache.get('photos', 'face.jpg'))
+        self.assertEqual(2, self.cache.stats()['files'])
+
+    def test_same_content_with_another_extension_shares_its_file(self):
+        """
+        This test method checks that a content cached under names with different extensions is stored in one file.
+        """
+        # When
+        first = self.cache.put_bytes('photos', 'face.jpg', b'picture', extension='.jpg')
+        second = self.cache.put_bytes('photos', 'face.png', b'picture', extension='.png')
+
+        # Then
+        self.assertEqual(first, second)
+        self.assertEqual(first, self.cache.get('photos', 'face.png'))
+        files = [name for _, _, names in os.walk(self.folder) for name in names if not name.startswith('index')]
+        self.assertEqual([os.path.basename(first)], files)
+
+    def test_least_recently_used_files_are_evicted(self):
+        """
+        This test method checks that the least recently used files are removed once the folder is too large.
+        """
+        # Given
+        first = self.cache.put_bytes('photos', 'a.jpg', b'a' * 100)
+        second = self.cache.put_bytes('photos', 'b.jpg', b'b' * 100)
+        self.cache.get('photos', 'a.jpg')
+
+        # When
+        self.cache.put_bytes('photos', 'c.jpg', b'c' * 100)
+
+        # Then
+        self.assertTrue(os.path.exists(first))
+        self.assertFalse(os.path.exists(second))
+        self.assertIsNone(self.cache.get('photos', 'b.jpg'))
+        self.assertEqual(200, self.cache.stats()['bytes'])
+
+    def test_recently_used_files_are_kept(self):
+        """
+        This test method checks that a file just returned by get is not evicted before it is read.
+        """
+        # Given
+        cache = LocalObjectCache(self.folder, max_bytes=250)
+        path = cache.put_bytes('photos', 'a.jpg', b'a' * 100)
+        cache.put_bytes('photos', 'b.jpg', b'b' * 100)
+        cache.get('photos', 'a.jpg')
+
+        # When
+        cache.put_bytes('photos', 'c.jpg', b'c' * 100)
+
+        # Then
+        self.assertTrue(os.path.exists(path))
+        self.assertEqual(300, cache.stats()['bytes'])
+        self.assertEqual(0, cache.stats()['evictions'])
+
+    def test_failed_write_leaves_nothing(self):
+        """
+        This test method checks that a file whose writing failed is neither cached nor left in the folder.
+        """
+        # Given
+        def write(path):
+            with open(path, 'wb') as file:
+                file.write(b'partial')
+            raise IOError('The download failed')
+
+        # When
+        with self.assertRaises(IOError):
+            self.cache.put('photos', 'face.jpg', write)
+
+        # Then
+        self.assertIsNone(self.cache.get('photos', 'face.jpg'))
+        self.assertFalse([name for name in os.listdir(self.folder) if name.startswith(TEMPORARY_PREFIX)])
+
+    def test_concurrent_writers_are_safe(self):
+        """
+        This test method checks that the files written at the same time by several threads are all complete.
+        """
+        # Given
+        cache = LocalObjectCache(self.folder, max_bytes=10 * 1024 * 1024)
+        contents = [os.urandom(64 * 1024) for _ in range(4)]
+        paths = {}
+
+        def write(index):
+            paths[index] = cache.put_bytes('photos', 'face%s.jpg' % (index % 8), contents[index % 4])
+
+        # When
+        threads = [threading.Thread(target=write, args=(index,)) for index in range(16)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        # Then
+        for index, path in paths.items():
+            with open(path, 'rb') as file:
+                self.assertEqual(contents[index % 4], file.read())
+        self.assertEqual(4, cache.stats()['files'])
+
+    async def test_downloaded_object_is_reused_until_it_changes(self):
+        """
+        This test method checks that an object is only downloaded again once its ETag changed.
+        """
+        # Given
+        s3_client = DownloadingS3Client({'face.jpg': b'first picture'})
+        bucket_manager = AwsBucketManager(s3_client=s3_client, local_cache=self.cache)
+
+        # When
+        first_path, status = await bucket_manager.download_object('photos', 'face.jpg')
+        second_path, _ = await bucket_manager.download_object('photos', 'face.jpg')
+        s3_client.objects['face.jpg'] = b'second picture'
+        third_path, _ = await bucket_manager.download_object('photos', 'face.jpg')
+
+        # Then
+        self.assertEqual(200, status)
+        self.assertEqual(first_path, second_path)
+        self.assertNotEqual(first_path, third_path)
+        self.assertEqual(2, s3_client.downloads)
+
+
+if __name__ == '__main__':
+    unittest.main()
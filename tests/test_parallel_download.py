@@ -0,0 +1,155 @@
+import io
+import os
+import threading
+import time
+import unittest
+
+from boto3.s3.transfer import TransferConfig
+from botocore.exceptions import ClientError
+from botocore.response import StreamingBody
+
+from flaskr.api.managers.aws_bucket_manager import AwsBucketManager
+from flaskr.api.managers.rekognition_image_detection import RekognitionImage
+
+
+class RangedGetS3Client:
+    """
+    Fake s3 client serving the ranges of its objects and recording the concurrent gets
+    """
+
+    def __init__(self, objects, latency=0.02):
+        self.objects = objects
+        self.latency = latency
+        self.ranges = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+
+    def get_object(self, Bucket, Key, Range, IfMatch=None):
+        with self._lock:
+            self.ranges.append(Range)
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        time.sleep(self.latency)
+        with self._lock:
+            self.in_flight -= 1
+
+        if Key not in self.objects:
+            raise ClientError({'Error': {'Code': 'NoSuchKey'}}, 'GetObject')
+        data = self.objects[Key]
+        e_tag = '"%s"' % hash(data)
+        if IfMatch is not None and IfMatch != e_tag:
+            raise ClientError({'Error': {'Code': 'PreconditionFailed'}}, 'GetObject')
+        start, end = (int(value) for value in Range[len('bytes='):].split('-'))
+        end = min(end, len(data) - 1)
+        part = data[start:end + 1]
+        return {'Body': StreamingBody(io.BytesIO(part), len(part)), 'ContentLength': len(part), 'ETag': e_tag,
+                'ContentRange': 'bytes %s-%s/%s' % (start, end, len(data))}
+
+
+class RecordingRekognitionClient:
+    """
+    Fake rekognition client recording the images it receives
+    """
+
+    def __init__(self):
+        self.images = []
+
+    def detect_faces(self, Image, Attributes):
+        self.images.append(Image['Bytes'])
+        return {'FaceDetails': []}
+
+
+class ParallelDownloadTestCase(unittest.IsolatedAsyncioTestCase):
+    """
+    This test class is designed to confirm that the large objects are fetched in memory with concurrent ranged gets
+    """
+
+    def setUp(self):
+        """
+        This test method initializes the context before each test method run.
+        """
+        self.data = os.urandom(1024 * 1024 + 10)
+        self.s3_client = RangedGetS3Client({'face.jpg': self.data, 'small.jpg': b'small picture'})
+        self.bucket_manager = AwsBucketManager(s3_client=self.s3_client)
+        self.bucket_manager.transfer_config = TransferConfig(
+            multipart_threshold=256 * 1024, multipart_chunksize=128 * 1024, max_concurrency=4)
+
+    async def test_large_object_is_fetched_in_concurrent_ranges(self):
+        """
+        This test method checks that a large object is split in ranges fetched concurrently into one buffer.
+        """
+        # When
+        view, status = await self.bucket_manager.fetch_object('photos', 'face.jpg')
+
+        # Then
+        self.assertEqual(200, status)
+        self.assertIsInstance(view, memoryview)
+        self.assertEqual(self.data, view.tobytes())
+        self.assertEqual(9, len(self.s3_client.ranges))
+        self.assertEqual(4, self.s3_client.max_in_flight)
+
+    async def test_small_object_is_fetched_at_once(self):
+        """
+        This test method checks that an object below the multipart threshold is fetched with a single get.
+        """
+        # When
+        view, status = await self.bucket_manager.fetch_object('photos', 'small.jpg')
+
+        # Then
+        self.assertEqual(b'small picture', view.tobytes())
+        self.assertEqual(['bytes=0-131071'], self.s3_client.ranges)
+
+    async def test_object_overwritten_during_fetch_fails(self):
+        """
+        This test method checks that the ranges are not mixed from two versions of an object.
+        """
+        # Given
+        get_object = self.s3_client.get_object
+
+        def overwritten_get_object(**params):
+            response = get_object(**params)
+            self.s3_client.objects[params['Key']] = os.urandom(len(self.data))
+            return response
+        self.s3_client.get_object = overwritten_get_object
+
+        # When
+        _, status = await self.bucket_manager.fetch_object('photos', 'face.jpg')
+
+        # Then
+        self.assertEqual(500, status)
+
+    async def test_missing_object(self):
+        """
+        This test method checks that a missing object is not found.
+        """
+        # When
+        _, status = await self.bucket_manager.fetch_object('photos', 'missing.jpg')
+
+        # Then
+        self.assertEqual(404, status)
+
+    async def test_buffer_is_sent_to_rekognition_without_copy(self):
+        """
+        This test method checks that the fetched buffer itself is sent to rekognition.
+        """
+        # Given
+        view, _ = await self.bucket_manager.fetch_object('photos', 'face.jpg')
+        rekognition_client = RecordingRekognitionClient()
+
+        class Image(RekognitionImage):
+            result_cache = None
+            single_flight = None
+            image_optimizer = None
+            rate_limiter = None
+            hedger = None
+
+        # When
+        Image.from_bytes(view, 'face.jpg', rekognition_client).detect_faces()
+
+        # Then
+        self.assertIs(view.obj, rekognition_client.images[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,153 @@
+import time
+import unittest
+
+from botocore.exceptions import ClientError
+
+from flaskr.api.helpers.rate_limiter import AdaptiveRateLimiter, RateLimitExceeded, TokenBucket, OPEN, CLOSED
+
+
+def client_error(code, status=400):
+    return ClientError({'Error': {'Code': code, 'Message': code},
+                        'ResponseMetadata': {'HTTPStatusCode': status}}, 'DetectFaces')
+
+
+class FlakyOperation:
+    """
+    Fake rekognition operation failing with the given errors before succeeding
+    """
+
+    def __init__(self, *errors):
+        self.errors = list(errors)
+        self.calls = 0
+
+    def __call__(self, **params):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return {'FaceDetails': []}
+
+
+class RateLimiterTestCase(unittest.TestCase):
+    """
+    This test class is designed to confirm that the rekognition calls are paced, retried and suspended
+    """
+
+    def setUp(self):
+        """
+        This test method initializes the context before each test method run.
+        """
+        self.limiter = AdaptiveRateLimiter(default_rate=100, rates={'recognize_celebrities': 5}, max_attempts=3,
+                                           base_delay=0.001, failure_threshold=2, reset_timeout=0.2)
+
+    def test_throttled_call_is_retried_and_slows_down(self):
+        """
+        This test method checks that a throttled call is retried and halves the rate of its operation.
+        """
+        # Given
+        operation = FlakyOperation(client_error('ThrottlingException'))
+
+        # When
+        response = self.limiter.call('detect_faces', operation, Image={})
+
+        # Then
+        stats = self.limiter.stats()['detect_faces']
+        self.assertEqual({'FaceDetails': []}, response)
+        self.assertEqual(2, operation.calls)
+        self.assertEqual(1, stats['throttled'])
+        self.assertLess(stats['rate'], 100)
+
+    def test_request_errors_are_not_retried(self):
+        """
+        This test method checks that an invalid request fails at once.
+        """
+        # Given
+        operation = FlakyOperation(client_error('InvalidParameterException'))
+
+        # When
+        with self.assertRaises(ClientError):
+            self.limiter.call('detect_faces', operation, Image={})
+
+        # Then
+        self.assertEqual(1, operation.calls)
+
+    def test_circuit_opens_then_recovers(self):
+        """
+        This test method checks that repeated failures suspend the calls until a trial call succeeds.
+        """
+        # Given the operation fails on every attempt of two calls
+        errors = [client_error('InternalServerError', 500)] * 6
+        operation = FlakyOperation(*errors)
+        for _ in range(2):
+            with self.assertRaises(ClientError):
+                self.limiter.call('detect_faces', operation, Image={})
+
+        # When
+        with self.assertRaises(RateLimitExceeded):
+            self.limiter.call('detect_faces', operation, Image={})
+        opened = self.limiter.stats()['detect_faces']['circuit']
+        time.sleep(0.25)
+        response = self.limiter.call('detect_faces', operation, Image={})
+
+        # Then
+        self.assertEqual(OPEN, opened)
+        self.assertEqual({'FaceDetails': []}, response)
+        self.assertEqual(CLOSED, self.limiter.stats()['detect_faces']['circuit'])
+
+    def test_trial_without_token_is_given_back(self):
+        """
+        This test method checks that a half open circuit still lets a trial through after a trial found no token.
+        """
+        # Given the circuit is open and the bucket of the operation is empty when the trial comes
+        limiter = AdaptiveRateLimiter(default_rate=5, max_attempts=1, acquire_timeout=0, failure_threshold=1,
+                                      reset_timeout=0.05)
+        with self.assertRaises(ClientError):
+            limiter.call('detect_faces', FlakyOperation(client_error('InternalServerError', 500)), Image={})
+        time.sleep(0.1)
+        limiter._operation('detect_faces').bucket._tokens = 0.0
+        with self.assertRaises(RateLimitExceeded) as context:
+            limiter.call('detect_faces', FlakyOperation(), Image={})
+
+        # When
+        time.sleep(0.25)
+        response = limiter.call('detect_faces', FlakyOperation(), Image={})
+
+        # Then
+        self.assertIn('waiting', str(context.exception))
+        self.assertEqual({'FaceDetails': []}, response)
+        self.assertEqual(CLOSED, limiter.stats()['detect_faces']['circuit'])
+
+    def test_limits_are_per_operation(self):
+        """
+        This test method checks that each operation gets the rate configured for it.
+        """
+        # When
+        self.limiter.call('recognize_celebrities', FlakyOperation(), Image={})
+        self.limiter.call('detect_labels', FlakyOperation(), Image={})
+
+        # Then
+        stats = self.limiter.stats()
+        self.assertEqual(5, stats['recognize_celebrities']['max_rate'])
+        self.assertEqual(100, stats['detect_labels']['max_rate'])
+
+    def test_bucket_paces_the_calls(self):
+        """
+        This test method checks that the token bucket waits for its tokens and gives up after the timeout.
+        """
+        # Given
+        bucket = TokenBucket(rate=10)
+        for _ in range(10):
+            bucket.acquire()
+
+        # When
+        start = time.perf_counter()
+        acquired = bucket.acquire()
+        elapsed = time.perf_counter() - start
+
+        # Then
+        self.assertTrue(acquired)
+        self.assertGreaterEqual(elapsed, 0.08)
+        self.assertFalse(bucket.acquire(timeout=0.01))
+
+
+if __name__ == '__main__':
+    unittest.main()
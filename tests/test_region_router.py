@@ -0,0 +1,211 @@
+import time
+import unittest
+from unittest import mock
+
+from botocore.exceptions import ClientError
+
+from flaskr.api.helpers.rate_limiter import AdaptiveRateLimiter, RateLimitExceeded
+from flaskr.api.helpers.region_router import BUCKET_REGION_RETRY_INTERVAL, RegionRouter, WEIGHTED_ROUND_ROBIN, parse_regions
+from flaskr.api.managers.rekognition_image_detection import RekognitionImage
+from flaskr.api.managers.bulk_analysis import S3ObjectReference
+
+
+def client_error(code, status):
+    return ClientError({'Error': {'Code': code, 'Message': code},
+                        'ResponseMetadata': {'HTTPStatusCode': status}}, 'DetectLabels')
+
+
+class RegionRekognitionClient:
+    """
+    Fake rekognition client of a region, failing with the given error if any
+    """
+
+    def __init__(self, region_name, error=None):
+        self.region_name = region_name
+        self.error = error
+        self.calls = 0
+
+    def detect_labels(self, Image, MaxLabels):
+        self.calls += 1
+        if self.error is not None:
+            raise self.error
+        return {'Labels': [{'Name': self.region_name, 'Confidence': 99.0}]}
+
+
+class RegionRouterTestCase(unittest.TestCase):
+    """
+    This test class is designed to confirm that the rekognition calls are spread over the regions
+    """
+
+    def setUp(self):
+        """
+        This test method initializes the context before each test method run.
+        """
+        self.clients = {name: RegionRekognitionClient(name)
+                        for name in ('us-east-1', 'eu-west-1', 'ap-south-1', 'sa-east-1')}
+        self.bucket_regions = {'photos-eu': 'eu-west-1', 'photos-sa': 'sa-east-1'}
+
+    def router(self, regions='us-east-1,eu-west-1,ap-south-1', **kwargs):
+        kwargs.setdefault('bucket_region', self.bucket_regions.get)
+        return RegionRouter('rekognition', parse_regions(regions),
+                            client_factory=lambda region_name, endpoint_url: self.clients[region_name], **kwargs)
+
+    def detect_labels(self, router, image=None):
+        return router.detect_labels(Image=image or {'Bytes': b'picture'}, MaxLabels=1)['Labels'][0]['Name']
+
+    def test_weighted_round_robin(self):
+        """
+        This test method checks that the calls are spread according to the weights of the regions.
+        """
+        # Given
+        router = self.router('us-east-1=3,eu-west-1=1', strategy=WEIGHTED_ROUND_ROBIN)
+
+        # When
+        for _ in range(8):
+            self.detect_labels(router)
+
+        # Then
+        self.assertEqual(6, self.clients['us-east-1'].calls)
+        self.assertEqual(2, self.clients['eu-west-1'].calls)
+
+    def test_failover_and_health(self):
+        """
+        This test method checks that a failing region is failed over, then left out once unhealthy.
+        """
+        # Given
+        self.clients['us-east-1'].error = client_error('InternalServerError', 500)
+        router = self.router('us-east-1=10,eu-west-1', failure_threshold=2)
+
+        # When
+        regions = [self.detect_labels(router) for _ in range(4)]
+
+        # Then
+        self.assertEqual(['eu-west-1'] * 4, regions)
+        self.assertEqual(2, self.clients['us-east-1'].calls)
+        self.assertFalse(router.stats()['regions']['us-east-1']['healthy'])
+        self.assertEqual(2, router.stats()['failovers'])
+
+    def test_throttled_region_stays_healthy(self):
+        """
+        This test method checks that a throttled call is failed over without leaving out its region.
+        """
+        # Given
+        self.clients['us-east-1'].error = client_error('ThrottlingException', 400)
+        router = self.router('us-east-1=10,eu-west-1', failure_threshold=1)
+
+        # When
+        region = self.detect_labels(router)
+
+        # Then
+        self.assertEqual('eu-west-1', region)
+        self.assertTrue(router.stats()['regions']['us-east-1']['healthy'])
+
+    def test_request_errors_are_not_failed_over(self):
+        """
+        This test method checks that an invalid request is not sent to the other regions.
+        """
+        # Given
+        self.clients['us-east-1'].error = client_error('InvalidParameterException', 400)
+        router = self.router('us-east-1=10,eu-west-1')
+
+        # When
+        with self.assertRaises(ClientError):
+            self.detect_labels(router)
+
+        # Then
+        self.assertEqual(0, self.clients['eu-west-1'].calls)
+
+    def test_bucket_region_is_preferred(self):
+        """
+        This test method checks that an image stored in S3 is analysed in the region of its bucket.
+        """
+        # Given
+        router = self.router('us-east-1=10,eu-west-1,ap-south-1')
+        image = RekognitionImage.from_bucket(S3ObjectReference('photos-eu', 'face.jpg'), router)
+        image.result_cache = None
+
+        # When
+        labels = image.detect_labels(1)
+
+        # Then
+        self.assertEqual('eu-west-1', labels[0].name)
+        self.assertEqual(0, self.clients['us-east-1'].calls)
+
+    def test_bucket_region_is_not_failed_over(self):
+        """
+        This test method checks that a throttled image stored in S3 is not sent to a region which can't read it.
+        """
+        # Given
+        self.clients['eu-west-1'].error = client_error('ThrottlingException', 400)
+        router = self.router()
+
+        # When
+        with self.assertRaises(ClientError) as context:
+            self.detect_labels(router, {'S3Object': {'Bucket': 'photos-eu', 'Name': 'face.jpg'}})
+
+        # Then
+        self.assertEqual('ThrottlingException', context.exception.response['Error']['Code'])
+        self.assertEqual(0, self.clients['us-east-1'].calls + self.clients['ap-south-1'].calls)
+
+    def test_bucket_outside_regions_is_analysed_in_its_region(self):
+        """
+        This test method checks that an image stored in a bucket outside the regions is analysed in its bucket region.
+        """
+        # Given
+        router = self.router()
+
+        # When
+        region = self.detect_labels(router, {'S3Object': {'Bucket': 'photos-sa', 'Name': 'face.jpg'}})
+
+        # Then
+        self.assertEqual('sa-east-1', region)
+        self.assertIn('sa-east-1', router.stats()['bucket_regions'])
+
+
+    def test_rate_limit_applies_to_each_region(self):
+        """
+        This test method checks that a region without token left sends its calls to the next region.
+        """
+        # Given a limit of 2 calls per second, which each region allows on its own
+        router = self.router('us-east-1,eu-west-1',
+                             rate_limiter=AdaptiveRateLimiter(default_rate=2, acquire_timeout=0))
+
+        # When
+        regions = [self.detect_labels(router) for _ in range(4)]
+
+        # Then
+        self.assertEqual(2, regions.count('us-east-1'))
+        self.assertEqual(2, regions.count('eu-west-1'))
+        with self.assertRaises(RateLimitExceeded):
+            self.detect_labels(router)
+
+    def test_failed_bucket_region_looked_up_again(self):
+        """
+        This test method checks that a bucket whose region couldn't be found is looked up again later.
+        """
+        # Given
+        lookups = []
+
+        def bucket_region(bucket_name):
+            lookups.append(bucket_name)
+            if len(lookups) == 1:
+                raise Exception('Access denied')
+            return self.bucket_regions[bucket_name]
+
+        self.clients[None] = RegionRekognitionClient('default')
+        router = self.router(bucket_region=bucket_region)
+        image = {'S3Object': {'Bucket': 'photos-eu', 'Name': 'face.jpg'}}
+        self.assertEqual('default', self.detect_labels(router, image))
+
+        # When
+        with mock.patch('flaskr.api.helpers.region_router.time.monotonic',
+                        return_value=time.monotonic() + BUCKET_REGION_RETRY_INTERVAL):
+            region = self.detect_labels(router, image)
+
+        # Then
+        self.assertEqual('eu-west-1', region)
+        self.assertEqual(2, len(lookups))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,126 @@
+import unittest
+
+from flaskr.api.managers.rekognition_image_detection import RekognitionImage
+from flaskr.api.managers.rekognition_pipeline import AnalysisPipeline, PipelineStats, default_pipeline
+
+
+class CountingRekognitionClient:
+    """
+    Fake rekognition client returning the given labels and counting the calls by operation
+    """
+
+    def __init__(self, labels, moderation_labels=()):
+        self.labels = labels
+        self.moderation_labels = moderation_labels
+        self.calls = []
+
+    def detect_labels(self, Image, MaxLabels):
+        self.calls.append('detect_labels')
+        return {'Labels': [{'Name': name, 'Confidence': confidence} for name, confidence in self.labels]}
+
+    def detect_moderation_labels(self, Image):
+        self.calls.append('detect_moderation_labels')
+        return {'ModerationLabels': [{'Name': name, 'Confidence': confidence}
+                                     for name, confidence in self.moderation_labels]}
+
+    def detect_faces(self, Image, Attributes):
+        self.calls.append('detect_faces')
+        return {'FaceDetails': [{'Confidence': 99.0}]}
+
+    def recognize_celebrities(self, Image):
+        self.calls.append('recognize_celebrities')
+        return {'CelebrityFaces': [], 'UnrecognizedFaces': [{'Confidence': 99.0}]}
+
+
+class RekognitionPipelineTestCase(unittest.IsolatedAsyncioTestCase):
+    """
+    This test class is designed to confirm the AnalysisPipeline class's behavior
+    """
+
+    def analyse(self, client, pipeline):
+        image = RekognitionImage({'Bytes': b'picture'}, 'image', client)
+        image.result_cache = None
+        return pipeline.run(image)
+
+    async def test_faces_skipped_without_person(self):
+        """
+        This test method checks that the face detections don't run on a picture without people
+        """
+        # Given
+        client = CountingRekognitionClient(labels=[('Tree', 99.0), ('Person', 40.0)])
+        pipeline = default_pipeline()
+        pipeline.stats = PipelineStats()
+
+        # When
+        report = await self.analyse(client, pipeline)
+
+        # Then
+        self.assertEqual(['detect_labels', 'detect_moderation_labels'], sorted(client.calls))
+        self.assertEqual({'detect_faces', 'recognize_celebrities'}, set(report['skipped']))
+        self.assertEqual(2, pipeline.stats.to_dict()['saved_calls'])
+
+    async def test_faces_detected_with_person(self):
+        """
+        This test method checks that the face detections run when a person is found
+        """
+        # Given
+        client = CountingRekognitionClient(labels=[('Person', 95.0)])
+
+        # When
+        report = await self.analyse(client, default_pipeline())
+
+        # Then
+        self.assertEqual(4, len(client.calls))
+        self.assertEqual([{'confidence': 99.0}], report['results']['detect_faces'])
+        self.assertEqual({}, report['skipped'])
+
+    async def test_flagged_image_stops_pipeline(self):
+        """
+        This test method checks that a flagged image stops the pipeline
+        """
+        # Given
+        client = CountingRekognitionClient(labels=[('Person', 95.0)], moderation_labels=[('Violence', 90.0)])
+
+        # When
+        report = await self.analyse(client, default_pipeline())
+
+        # Then
+        self.assertEqual('detect_moderation_labels', report['stopped_by'])
+        self.assertNotIn('detect_faces', client.calls)
+
+    async def test_stage_after_stop_waits_for_it(self):
+        """
+        This test method checks that a stage listed after a stop_if stage doesn't run on a flagged image
+        """
+        # Given
+        client = CountingRekognitionClient(labels=[], moderation_labels=[('Violence', 90.0)])
+        pipeline = AnalysisPipeline.from_config([
+            {'operation': 'detect_moderation_labels', 'stop_if': {'type': 'moderation'}},
+            {'operation': 'detect_faces'},
+        ])
+        pipeline.stats = PipelineStats()
+
+        # When
+        report = await self.analyse(client, pipeline)
+
+        # Then
+        self.assertEqual(['detect_moderation_labels'], client.calls)
+        self.assertEqual('stopped by detect_moderation_labels', report['skipped']['detect_faces'])
+
+    def test_stage_depending_on_later_stage_refused(self):
+        """
+        This test method checks that a pipeline whose dependencies are not listed first is refused
+        """
+        # Given
+        config = [
+            {'operation': 'detect_faces', 'when': {'type': 'label', 'name': 'Person'}},
+            {'operation': 'detect_labels'},
+        ]
+
+        # When / Then
+        with self.assertRaises(ValueError):
+            AnalysisPipeline.from_config(config)
+
+
+if __name__ == '__main__':
+    unittest.main()
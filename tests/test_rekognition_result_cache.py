@@ -0,0 +1,160 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from flaskr.api.managers.rekognition_image_detection import RekognitionImage
+from flaskr.api.managers.rekognition_result_cache import RekognitionResultCache
+
+
+class CountingRekognitionClient:
+    """
+    Fake rekognition client counting the calls it receives
+    """
+
+    def __init__(self):
+        self.calls = 0
+
+    def detect_faces(self, Image, Attributes):
+        self.calls += 1
+        return {'FaceDetails': [{'Confidence': 99.0}], 'ResponseMetadata': {'RequestId': str(self.calls)}}
+
+
+class CountingImageOptimizer:
+    """
+    Fake image optimizer counting the images it optimizes
+    """
+
+    def __init__(self):
+        self.images = 0
+
+    def optimize(self, image_bytes):
+        self.images += 1
+        return b'optimized', {}
+
+
+class RekognitionResultCacheTestCase(unittest.TestCase):
+    """
+    This test class is designed to confirm the RekognitionResultCache class's behavior
+    """
+
+    def setUp(self):
+        """
+        This test method initializes the context before each test method run.
+        """
+        self.folder = tempfile.mkdtemp()
+        self.disk_path = os.path.join(self.folder, 'cache.sqlite')
+        self.client = CountingRekognitionClient()
+        self.image_bytes = b'image bytes'
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def analyse(self, cache, source=None):
+        image = RekognitionImage({'Bytes': self.image_bytes}, 'image', self.client, source)
+        image.result_cache = cache
+        return image.detect_faces()
+
+    def test_same_image_analysed_once(self):
+        """
+        This test method checks that the second analysis of an image is served from memory
+        """
+        # Given
+        cache = RekognitionResultCache()
+        self.analyse(cache)
+
+        # When
+        faces = self.analyse(cache)
+
+        # Then
+        self.assertEqual(1, self.client.calls)
+        self.assertEqual(99.0, faces[0].confidence)
+        self.assertEqual(1, cache.stats()['hits'])
+        self.assertEqual(1, cache.stats()['misses'])
+
+    def test_cached_image_not_optimized(self):
+        """
+        This test method checks that an image is found in the cache by its original bytes, before it is optimized
+        """
+        # Given
+        cache = RekognitionResultCache()
+        optimizer = CountingImageOptimizer()
+        class_attributes = mock.patch.multiple(RekognitionImage, result_cache=cache, image_optimizer=optimizer,
+                                               single_flight=None)
+
+        # When
+        with class_attributes:
+            images = [RekognitionImage.from_bytes(self.image_bytes, 'image', self.client) for _ in range(2)]
+            for image in images:
+                image.detect_faces()
+
+        # Then
+        self.assertEqual(1, self.client.calls)
+        self.assertEqual(1, optimizer.images)
+        self.assertEqual({'Bytes': b'optimized'}, images[0].image)
+        self.assertEqual(images[0].digest, images[1].digest)
+
+    def test_disk_tier_survives_restart(self):
+        """
+        This test method checks that a new cache instance reuses the responses stored on disk
+        """
+        # Given
+        self.analyse(RekognitionResultCache(disk_path=self.disk_path))
+
+        # When
+        restarted_cache = RekognitionResultCache(disk_path=self.disk_path)
+        self.analyse(restarted_cache)
+
+        # Then
+        self.assertEqual(1, self.client.calls)
+        self.assertEqual(1, restarted_cache.stats()['disk_hits'])
+
+    def test_removed_object_invalidated(self):
+        """
+        This test method checks that removing the source object forgets its responses
+        """
+        # Given
+        cache = RekognitionResultCache(disk_path=self.disk_path)
+        self.analyse(cache, source=('bucket', 'image.jpg'))
+
+        # When
+        cache.invalidate('bucket', 'image.jpg')
+        self.analyse(cache, source=('bucket', 'image.jpg'))
+
+        # Then
+        self.assertEqual(2, self.client.calls)
+
+    def test_expired_response_not_used(self):
+        """
+        This test method checks that a response older than the ttl is not reused
+        """
+        # Given
+        cache = RekognitionResultCache(ttl=0, disk_path=self.disk_path)
+        self.analyse(cache)
+
+        # When
+        self.analyse(cache)
+
+        # Then
+        self.assertEqual(2, self.client.calls)
+
+    def test_least_recently_used_evicted(self):
+        """
+        This test method checks that the memory tier keeps at most max_entries responses
+        """
+        # Given
+        cache = RekognitionResultCache(max_entries=1)
+        self.analyse(cache)
+
+        # When
+        self.image_bytes = b'other image bytes'
+        self.analyse(cache)
+
+        # Then
+        self.assertEqual(1, cache.stats()['entries'])
+        self.assertEqual(1, cache.stats()['evictions'])
+
+
+if __name__ == '__main__':
+    unittest.main()
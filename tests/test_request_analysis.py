@@ -0,0 +1,140 @@
+import json
+import os
+import tempfile
+import threading
+import time
+import unittest
+from io import BytesIO
+from unittest import mock
+
+from flaskr import create_app
+from flaskr.api.managers.rekognition_image_detection import RekognitionImage
+
+
+class SlowS3Client:
+    """
+    Fake s3 client answering the uploads after a latency, or failing them
+    """
+
+    def __init__(self, latency, fail=False):
+        self.latency = latency
+        self.fail = fail
+        self.objects = {}
+        self._lock = threading.Lock()
+
+    def head_bucket(self, Bucket):
+        pass
+
+    def put_object(self, Bucket, Key, Body):
+        time.sleep(self.latency)
+        if self.fail:
+            raise Exception('Service unavailable')
+        with self._lock:
+            self.objects[Key] = Body
+
+    def generate_presigned_url(self, ClientMethod, Params, ExpiresIn=3600):
+        return 'https://%s.s3.local/%s' % (Params['Bucket'], Params['Key'])
+
+
+class SlowRekognitionClient:
+    """
+    Fake rekognition client detecting one face after a latency
+    """
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.images = []
+
+    def detect_faces(self, Image, Attributes):
+        time.sleep(self.latency)
+        self.images.append(bytes(Image['Bytes']))
+        return {'FaceDetails': [{'Confidence': 99.0}]}
+
+
+class RequestAnalysisTestCase(unittest.TestCase):
+    """
+    This test class is designed to confirm that an uploaded image is analysed while it is stored
+    """
+
+    def setUp(self):
+        """
+        This test method initializes the context before each test method run.
+        """
+        self.latency = 0.2
+        self.s3_client = SlowS3Client(self.latency)
+        self.rekognition_client = SlowRekognitionClient(self.latency)
+        self.folder = tempfile.TemporaryDirectory()
+
+        # the shared caches and the limiter would answer from, or pace, the other tests' calls
+        self.class_attributes = mock.patch.multiple(RekognitionImage, result_cache=None, image_optimizer=None,
+                                                    rate_limiter=None, hedger=None)
+        self.class_attributes.start()
+        self.rekognition = mock.patch('flaskr.api.managers.rekognition_image_detection.get_rekognition_client',
+                                      return_value=self.rekognition_client)
+        self.rekognition.start()
+
+        with mock.patch('flaskr.api.managers.aws_bucket_manager.get_client', return_value=self.s3_client):
+            app = create_app({'AWS_WARM_CLIENTS': False,
+                              'DATABASE': os.path.join(self.folder.name, 'flaskr.sqlite')})
+        self.client = app.test_client()
+
+    def tearDown(self):
+        """
+        This test method restores the shared state after each test method run.
+        """
+        self.rekognition.stop()
+        self.class_attributes.stop()
+        self.folder.cleanup()
+
+    def request_analysis(self):
+        return self.client.post('/api/request_analysis', data={
+            'bucket': 'photos',
+            'file': (BytesIO(b'picture'), 'face.jpg'),
+        }, content_type='multipart/form-data')
+
+    def test_upload_and_analysis_run_concurrently(self):
+        """
+        This test method checks that the same bytes are stored and analysed at the same time.
+        """
+        # When
+        start = time.perf_counter()
+        response = self.request_analysis()
+        elapsed = time.perf_counter() - start
+
+        # Then
+        self.assertEqual(200, response.status_code)
+        self.assertLess(elapsed, self.latency * 1.75)
+        self.assertEqual(b'picture', self.s3_client.objects['face.jpg'])
+        self.assertEqual([b'picture'], self.rekognition_client.images)
+
+    def test_server_timing_is_reported(self):
+        """
+        This test method checks that the duration of each stage is returned in the Server-Timing header.
+        """
+        # When
+        response = self.request_analysis()
+
+        # Then
+        stages = [metric.split(';')[0].strip() for metric in response.headers['Server-Timing'].split(',')]
+        for stage in ('read', 'hash', 'upload', 'analysis'):
+            self.assertIn(stage, stages)
+
+    def test_failed_upload_still_returns_analysis(self):
+        """
+        This test method checks that an upload failure is logged without losing the analysis.
+        """
+        # Given
+        self.s3_client.fail = True
+
+        # When
+        with self.assertLogs('flaskr', level='WARNING') as logs:
+            response = self.request_analysis()
+
+        # Then
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(99.0, json.loads(response.data)['confidence'])
+        self.assertIn("Couldn't upload face.jpg to photos", logs.output[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,204 @@
+import time
+import unittest
+from datetime import datetime, timedelta, timezone
+from unittest import mock
+
+from botocore.credentials import RefreshableCredentials
+
+from flaskr.api.managers.aws_bucket_manager import AwsBucketManager
+from flaskr.api.managers.s3_metadata_cache import S3MetadataCache
+
+
+class CountingS3Client:
+    """
+    Fake s3 client counting the bucket checks and the presigned urls
+    """
+
+    def __init__(self, buckets=('photos',)):
+        self.buckets = set(buckets)
+        self.head_buckets = 0
+        self.signatures = 0
+
+    def head_bucket(self, Bucket):
+        self.head_buckets += 1
+        if Bucket not in self.buckets:
+            raise Exception('Not found')
+
+    def create_bucket(self, Bucket, CreateBucketConfiguration=None):
+        self.buckets.add(Bucket)
+
+    def put_object(self, Bucket, Key, Body):
+        if Bucket not in self.buckets:
+            raise Exception('NoSuchBucket')
+
+    def delete_object(self, Bucket, Key):
+        pass
+
+    def get_paginator(self, operation_name):
+        return self
+
+    def paginate(self, **kwargs):
+        yield {}
+
+    def delete_bucket(self, Bucket):
+        self.buckets.discard(Bucket)
+
+    def generate_presigned_url(self, ClientMethod, Params, ExpiresIn=3600):
+        self.signatures += 1
+        return 'https://%s.s3.local/%s?signature=%s' % (Params['Bucket'], Params['Key'], self.signatures)
+
+
+class S3MetadataCacheTestCase(unittest.IsolatedAsyncioTestCase):
+    """
+    This test class is designed to confirm that the known buckets and the presigned urls are reused until invalidated
+    """
+
+    def setUp(self):
+        """
+        This test method initializes the context before each test method run.
+        """
+        self.s3_client = CountingS3Client()
+        self.bucket_manager = AwsBucketManager(s3_client=self.s3_client, metadata_cache=S3MetadataCache())
+        self.credentials = None
+        credentials_patch = mock.patch('flaskr.api.managers.aws_bucket_manager.get_credentials',
+                                       side_effect=lambda: self.credentials)
+        credentials_patch.start()
+        self.addCleanup(credentials_patch.stop)
+
+    async def test_known_bucket_is_checked_once(self):
+        """
+        This test method checks that the uploads to a known bucket don't check it again.
+        """
+        # When
+        for index in range(3):
+            await self.bucket_manager.upload_bytes('photos', 'face%s.jpg' % index, b'picture')
+
+        # Then
+        self.assertEqual(1, self.s3_client.head_buckets)
+
+    async def test_created_bucket_is_remembered(self):
+        """
+        This test method checks that a bucket created by an upload is not checked by the next one.
+        """
+        # When
+        await self.bucket_manager.upload_bytes('thumbnails', 'face.jpg', b'picture')
+        await self.bucket_manager.upload_bytes('thumbnails', 'other.jpg', b'picture')
+
+        # Then
+        self.assertEqual(1, self.s3_client.head_buckets)
+
+    async def test_bucket_is_checked_again_after_ttl(self):
+        """
+        This test method checks that a known bucket is checked again once its TTL expired.
+        """
+        # Given
+        self.bucket_manager.metadata_cache.bucket_ttl = 0.05
+        await self.bucket_manager.upload_bytes('photos', 'face.jpg', b'picture')
+
+        # When
+        time.sleep(0.1)
+        await self.bucket_manager.upload_bytes('photos', 'face.jpg', b'picture')
+
+        # Then
+        self.assertEqual(2, self.s3_client.head_buckets)
+
+    async def test_presigned_url_is_reused_until_removed(self):
+        """
+        This test method checks that the presigned url of an object is reused until the object is removed.
+        """
+        # Given
+        first_url, _ = await self.bucket_manager.upload_bytes('photos', 'face.jpg', b'picture')
+        second_url, _ = await self.bucket_manager.upload_bytes('photos', 'face.jpg', b'picture')
+
+        # When
+        await self.bucket_manager.remove_object('photos', 'face.jpg')
+        third_url, _ = await self.bucket_manager.upload_bytes('photos', 'face.jpg', b'picture')
+
+        # Then
+        self.assertEqual(first_url, second_url)
+        self.assertNotEqual(first_url, third_url)
+        self.assertEqual(2, self.s3_client.signatures)
+
+    async def test_presigned_url_close_to_expiry_is_signed_again(self):
+        """
+        This test method checks that a presigned url is not reused once it expires within the refresh margin.
+        """
+        # Given
+        self.bucket_manager.metadata_cache = S3MetadataCache(url_expires_in=600, url_refresh_margin=600)
+
+        # When
+        first_url, _ = await self.bucket_manager.upload_bytes('photos', 'face.jpg', b'picture')
+        second_url, _ = await self.bucket_manager.upload_bytes('photos', 'face.jpg', b'picture')
+
+        # Then
+        self.assertNotEqual(first_url, second_url)
+
+    async def test_presigned_url_is_not_reused_past_credentials_expiry(self):
+        """
+        This test method checks that a presigned url is signed again when the temporary credentials that signed it expire.
+        """
+        # Given
+        expiry_time = datetime.now(timezone.utc) + timedelta(seconds=300)
+        self.credentials = RefreshableCredentials('key', 'secret', 'token', expiry_time, dict, 'assume-role')
+
+        # When
+        first_url, _ = await self.bucket_manager.upload_bytes('photos', 'face.jpg', b'picture')
+        second_url, _ = await self.bucket_manager.upload_bytes('photos', 'face.jpg', b'picture')
+
+        # Then
+        self.assertNotEqual(first_url, second_url)
+        self.assertEqual(2, self.s3_client.signatures)
+
+    async def test_presigned_url_is_reused_when_credentials_expiry_is_unknown(self):
+        """
+        This test method checks that a presigned url is reused until its own expiry when the credentials expiry can't be read.
+        """
+        # Given refreshable credentials whose expiry is not where it is expected
+        expiry_time = datetime.now(timezone.utc) + timedelta(seconds=300)
+        self.credentials = RefreshableCredentials('key', 'secret', 'token', expiry_time, dict, 'assume-role')
+        del self.credentials._expiry_time
+
+        # When
+        with self.assertLogs('flaskr', level='WARNING'):
+            first_url, _ = await self.bucket_manager.upload_bytes('photos', 'face.jpg', b'picture')
+        second_url, _ = await self.bucket_manager.upload_bytes('photos', 'face.jpg', b'picture')
+
+        # Then
+        self.assertEqual(first_url, second_url)
+        self.assertEqual(1, self.s3_client.signatures)
+
+    async def test_removed_bucket_is_forgotten(self):
+        """
+        This test method checks that a removed bucket is checked and created again by the next upload.
+        """
+        # Given
+        await self.bucket_manager.upload_bytes('photos', 'face.jpg', b'picture')
+
+        # When
+        await self.bucket_manager.remove_object('photos')
+        _, status = await self.bucket_manager.upload_bytes('photos', 'face.jpg', b'picture')
+
+        # Then
+        self.assertEqual(200, status)
+        self.assertEqual(2, self.s3_client.head_buckets)
+        self.assertIn('photos', self.s3_client.buckets)
+
+    async def test_bucket_deleted_elsewhere_is_forgotten_after_failed_upload(self):
+        """
+        This test method checks that a known bucket deleted by another client is checked again after a failure.
+        """
+        # Given
+        await self.bucket_manager.upload_bytes('photos', 'face.jpg', b'picture')
+        self.s3_client.buckets.discard('photos')
+
+        # When
+        _, failed_status = await self.bucket_manager.upload_bytes('photos', 'face.jpg', b'picture')
+        _, status = await self.bucket_manager.upload_bytes('photos', 'face.jpg', b'picture')
+
+        # Then
+        self.assertEqual(500, failed_status)
+        self.assertEqual(200, status)
+
+
+if __name__ == '__main__':
+    unittest.main()
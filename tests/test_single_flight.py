@@ -0,0 +1,88 @@
+import threading
+import time
+import unittest
+
+from flaskr.api.helpers.single_flight import SingleFlight
+from flaskr.api.managers.rekognition_image_detection import RekognitionImage
+
+
+class SlowCountingRekognitionClient:
+    """
+    Fake rekognition client counting the calls it receives
+    """
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.calls = 0
+
+    def detect_faces(self, Image, Attributes):
+        self.calls += 1
+        time.sleep(self.latency)
+        return {'FaceDetails': [{'Confidence': 99.0}]}
+
+    def detect_text(self, Image):
+        self.calls += 1
+        time.sleep(self.latency)
+        raise RuntimeError('Service unavailable')
+
+
+class SingleFlightTestCase(unittest.TestCase):
+    """
+    This test class is designed to confirm that identical concurrent analyses call rekognition once
+    """
+
+    def setUp(self):
+        """
+        This test method initializes the context before each test method run.
+        """
+        self.client = SlowCountingRekognitionClient(latency=0.2)
+        self.single_flight = SingleFlight()
+        self.requests = 8
+
+    def analyse_concurrently(self, method_name):
+        results = []
+        errors = []
+
+        def analyse():
+            image = RekognitionImage({'Bytes': b'same picture'}, 'image', self.client)
+            image.result_cache = None
+            image.single_flight = self.single_flight
+            try:
+                results.append(getattr(image, method_name)())
+            except RuntimeError as error:
+                errors.append(error)
+
+        threads = [threading.Thread(target=analyse) for _ in range(self.requests)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        return results, errors
+
+    def test_concurrent_requests_coalesced(self):
+        """
+        This test method checks that a burst of identical requests shares one rekognition call
+        """
+        # When
+        results, errors = self.analyse_concurrently('detect_faces')
+
+        # Then
+        self.assertEqual(1, self.client.calls)
+        self.assertEqual(self.requests, len(results))
+        self.assertEqual(self.requests - 1, self.single_flight.stats()['coalesced'])
+
+    def test_error_shared_with_waiting_requests(self):
+        """
+        This test method checks that the waiting requests get the error of the shared call
+        """
+        # When
+        results, errors = self.analyse_concurrently('detect_text')
+
+        # Then
+        self.assertEqual(1, self.client.calls)
+        self.assertEqual(self.requests, len(errors))
+
+
+if __name__ == '__main__':
+    unittest.main()
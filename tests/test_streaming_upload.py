@@ -0,0 +1,113 @@
+import hashlib
+import io
+import os
+import unittest
+
+from flaskr.api.helpers.multipart_stream import MultipartFileReader
+from flaskr.api.managers.aws_bucket_manager import AwsBucketManager
+
+BOUNDARY = 'test-boundary'
+
+
+def multipart_body(fields, filename, content):
+    parts = [b'--%s\r\nContent-Disposition: form-data; name="%s"\r\n\r\n%s\r\n' % (
+        BOUNDARY.encode(), name.encode(), value.encode()) for name, value in fields.items()]
+    parts.append(b'--%s\r\nContent-Disposition: form-data; name="file"; filename="%s"\r\n'
+                 b'Content-Type: image/jpeg\r\n\r\n' % (BOUNDARY.encode(), filename.encode()))
+    parts.append(content)
+    parts.append(b'\r\n--%s--\r\n' % BOUNDARY.encode())
+    return b''.join(parts)
+
+
+class ChunkedS3Client:
+    """
+    Fake s3 client reading the uploaded file objects part by part, like a multipart upload
+    """
+
+    def __init__(self, part_size):
+        self.part_size = part_size
+        self.objects = {}
+        self.largest_read = 0
+
+    def head_bucket(self, Bucket):
+        pass
+
+    def upload_fileobj(self, Fileobj, Bucket, Key, Config=None):
+        parts = []
+        while True:
+            part = Fileobj.read(self.part_size)
+            if not part:
+                break
+            self.largest_read = max(self.largest_read, len(part))
+            parts.append(part)
+        self.objects[(Bucket, Key)] = b''.join(parts)
+
+    def generate_presigned_url(self, ClientMethod, Params, ExpiresIn=3600):
+        return 'https://%s.s3.local/%s' % (Params['Bucket'], Params['Key'])
+
+
+class StreamingUploadTestCase(unittest.IsolatedAsyncioTestCase):
+    """
+    This test class is designed to confirm that an upload is streamed to s3 part by part and hashed on the fly
+    """
+
+    def setUp(self):
+        """
+        This test method initializes the context before each test method run.
+        """
+        self.content = os.urandom(300 * 1024)
+        self.body = multipart_body({'bucket': 'photos'}, 'face.jpg', self.content)
+        self.s3_client = ChunkedS3Client(part_size=64 * 1024)
+        self.bucket_manager = AwsBucketManager(s3_client=self.s3_client)
+
+    def test_reader_parses_fields_and_file(self):
+        """
+        This test method checks that the fields before the file are parsed and the file is read as sent.
+        """
+        # Given
+        reader = MultipartFileReader(io.BytesIO(self.body), BOUNDARY, chunk_size=1000)
+
+        # When
+        opened = reader.open()
+        content = reader.read()
+
+        # Then
+        self.assertTrue(opened)
+        self.assertEqual('face.jpg', reader.filename)
+        self.assertEqual({'bucket': 'photos'}, reader.fields)
+        self.assertEqual(self.content, content)
+
+    def test_body_without_file(self):
+        """
+        This test method checks that a body without file is detected.
+        """
+        # Given
+        body = b'--%s\r\nContent-Disposition: form-data; name="bucket"\r\n\r\nphotos\r\n--%s--\r\n' % (
+            BOUNDARY.encode(), BOUNDARY.encode())
+
+        # When
+        opened = MultipartFileReader(io.BytesIO(body), BOUNDARY).open()
+
+        # Then
+        self.assertFalse(opened)
+
+    async def test_upload_is_streamed_and_hashed(self):
+        """
+        This test method checks that the file is sent part by part with its SHA-256.
+        """
+        # Given
+        reader = MultipartFileReader(io.BytesIO(self.body), BOUNDARY)
+        reader.open()
+
+        # When
+        url, status, headers = await self.bucket_manager.upload_stream('photos', 'face.jpg', reader)
+
+        # Then
+        self.assertEqual(200, status)
+        self.assertEqual(self.content, self.s3_client.objects[('photos', 'face.jpg')])
+        self.assertEqual(hashlib.sha256(self.content).hexdigest(), headers['X-Content-SHA256'])
+        self.assertLessEqual(self.s3_client.largest_read, 64 * 1024)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,292 @@
+import json
+import os
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+from flaskr import create_app
+from flaskr.api.managers.analysis_queue import AnalysisQueue, AnalysisQueueFull, COMPLETED
+from flaskr.api.managers.aws_bucket_manager import AwsBucketManager
+from flaskr.api.managers.upload_notifier import UploadNotifier, EVENTS, POLL
+
+
+class ArrivingS3Client:
+    """
+    Fake s3 client whose objects arrive after the presigned post is created
+    """
+
+    def __init__(self):
+        self.keys = {}
+
+    def head_bucket(self, Bucket):
+        pass
+
+    def generate_presigned_post(self, Bucket, Key, Conditions=None, ExpiresIn=3600):
+        return {'url': 'https://%s.s3.local/' % Bucket, 'fields': {'key': Key}, 'conditions': Conditions}
+
+    def get_paginator(self, operation_name):
+        return self
+
+    def paginate(self, Bucket, Prefix):
+        yield {'Contents': [{'Key': key, 'ETag': e_tag} for key, e_tag in self.keys.items() if key.startswith(Prefix)]}
+
+
+class FullOnceAnalysisQueue:
+    """
+    Fake analysis queue refusing its first job as if it was full
+    """
+
+    def __init__(self, analysis_queue):
+        self.analysis_queue = analysis_queue
+        self.refused = 0
+
+    def submit(self, function, callback_url=None):
+        if not self.refused:
+            self.refused += 1
+            raise AnalysisQueueFull(0)
+        return self.analysis_queue.submit(function, callback_url)
+
+    def status(self, job_id):
+        return self.analysis_queue.status(job_id)
+
+
+def object_created(bucket_name, key):
+    return {'Records': [{'eventName': 'ObjectCreated:Post',
+                         's3': {'bucket': {'name': bucket_name}, 'object': {'key': key, 'eTag': 'v1'}}}]}
+
+
+class UploadNotifierTestCase(unittest.IsolatedAsyncioTestCase):
+    """
+    This test class is designed to confirm that the objects uploaded with a presigned post are analysed on arrival
+    """
+
+    def setUp(self):
+        """
+        This test method initializes the context before each test method run.
+        """
+        self.s3_client = ArrivingS3Client()
+        self.bucket_manager = AwsBucketManager(s3_client=self.s3_client)
+        self.analysis_queue = AnalysisQueue(workers=1)
+        self.addCleanup(self.analysis_queue.stop)
+        self.analysed = []
+
+    def notifier(self, mode, analysis_queue=None):
+        def analyse(bucket_name, key, e_tag, operations):
+            self.analysed.append((bucket_name, key, e_tag))
+            return {'bucket': bucket_name, 'key': key, 'results': {}, 'errors': {}}
+
+        notifier = UploadNotifier(analysis_queue or self.analysis_queue, self.bucket_manager, mode=mode,
+                                  poll_interval=0.05, analyse=analyse)
+        self.addCleanup(notifier.stop)
+        return notifier
+
+    def wait_for_job(self, notifier, key, timeout=5):
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            job_id = notifier.job_id('photos', key)
+            if job_id is not None and self.analysis_queue.status(job_id)['status'] == COMPLETED:
+                return self.analysis_queue.status(job_id)
+            time.sleep(0.01)
+        self.fail('The upload %s was not analysed' % key)
+
+    async def test_presigned_post_accepts_images_only(self):
+        """
+        This test method checks that the presigned post restricts the uploads to images of a maximum size.
+        """
+        # When
+        presigned_post, status = await self.bucket_manager.presigned_post('photos', 'face.jpg', 1024)
+
+        # Then
+        self.assertEqual(200, status)
+        self.assertEqual({'key': 'face.jpg'}, presigned_post['fields'])
+        self.assertIn(['content-length-range', 1, 1024], presigned_post['conditions'])
+
+    def test_event_notification_queues_analysis(self):
+        """
+        This test method checks that an S3 event notification queues the analysis of the new object.
+        """
+        # Given
+        notifier = self.notifier(EVENTS)
+        notifier.watch('photos', 'my face.jpg')
+
+        # When
+        queued = notifier.receive(object_created('photos', 'my+face.jpg'))
+        job = self.wait_for_job(notifier, 'my face.jpg')
+
+        # Then
+        self.assertEqual(1, queued)
+        self.assertEqual([('photos', 'my face.jpg', 'v1')], self.analysed)
+        self.assertEqual('my face.jpg', job['result']['key'])
+
+    def test_polling_detects_awaited_upload(self):
+        """
+        This test method checks that the polled buckets queue the analysis of the awaited objects once they arrive.
+        """
+        # Given
+        notifier = self.notifier(POLL)
+        notifier.watch('photos', 'face.jpg')
+        time.sleep(0.1)
+
+        # When
+        self.s3_client.keys['face.jpg'] = '"v1"'
+        self.wait_for_job(notifier, 'face.jpg')
+
+        # Then
+        self.assertEqual([('photos', 'face.jpg', '"v1"')], self.analysed)
+        self.assertEqual(0, notifier.stats()['awaited_uploads'])
+
+    def test_notifier_starts_with_first_expected_upload(self):
+        """
+        This test method checks that the notifier thread is only started once an upload is expected, then stopped.
+        """
+        # Given
+        notifier = self.notifier(POLL)
+        started = notifier._thread
+
+        # When
+        notifier.watch('photos', 'face.jpg')
+        thread = notifier._thread
+        notifier.stop()
+
+        # Then
+        self.assertIsNone(started)
+        self.assertFalse(thread.is_alive())
+
+    def test_unexpected_upload_is_ignored(self):
+        """
+        This test method checks that the event of an object not uploaded with a presigned post is not analysed.
+        """
+        # Given
+        notifier = UploadNotifier(self.analysis_queue, self.bucket_manager)
+
+        # When
+        job_id = notifier.notify('photos', 'face.jpg')
+
+        # Then
+        self.assertIsNone(job_id)
+        self.assertEqual(0, notifier.stats()['detected'])
+
+    def test_refused_upload_is_queued_again(self):
+        """
+        This test method checks that an upload refused by a full analysis queue stays awaited and is queued again.
+        """
+        # Given
+        analysis_queue = FullOnceAnalysisQueue(self.analysis_queue)
+        notifier = self.notifier(EVENTS, analysis_queue)
+        notifier.watch('photos', 'face.jpg')
+
+        # When
+        notifier.receive(object_created('photos', 'face.jpg'))
+        self.wait_for_job(notifier, 'face.jpg')
+
+        # Then
+        self.assertEqual(1, analysis_queue.refused)
+        self.assertEqual([('photos', 'face.jpg', 'v1')], self.analysed)
+        self.assertEqual({'detected': 1, 'rejected': 1, 'awaited_uploads': 0},
+                         {name: notifier.stats()[name] for name in ('detected', 'rejected', 'awaited_uploads')})
+
+    def test_other_objects_are_ignored(self):
+        """
+        This test method checks that the objects that are not images are not analysed.
+        """
+        # Given
+        notifier = UploadNotifier(self.analysis_queue, self.bucket_manager)
+
+        # When
+        job_id = notifier.notify('photos', 'notes.txt')
+
+        # Then
+        self.assertIsNone(job_id)
+
+
+class S3EventsEndpointTestCase(unittest.TestCase):
+    """
+    This test class is designed to confirm that /api/s3_events only accepts authenticated notifications and SNS messages
+    """
+
+    def setUp(self):
+        """
+        This test method initializes the context before each test method run.
+        """
+        self.folder = tempfile.TemporaryDirectory()
+        self.addCleanup(self.folder.cleanup)
+        self.topic_arn = 'arn:aws:sns:eu-west-1:123456789012:uploads'
+
+        with mock.patch('flaskr.api.managers.aws_bucket_manager.get_client', return_value=ArrivingS3Client()):
+            app = create_app({'AWS_WARM_CLIENTS': False, 'DATABASE': os.path.join(self.folder.name, 'flaskr.sqlite'),
+                              'S3_EVENTS_TOKEN': 'secret', 'S3_EVENTS_TOPIC_ARNS': [self.topic_arn]})
+        self.client = app.test_client()
+
+    def post(self, message, token='secret'):
+        # SNS posts its messages as text/plain
+        return self.client.post('/api/s3_events', query_string={'token': token} if token else None,
+                                data=json.dumps(message), content_type='text/plain; charset=UTF-8')
+
+    def test_unauthenticated_notification_refused(self):
+        """
+        This test method checks that a notification without the shared secret is refused.
+        """
+        # When
+        responses = [self.post(object_created('photos', 'notes.txt'), token) for token in (None, 'guess')]
+
+        # Then
+        self.assertEqual([403, 403], [response.status_code for response in responses])
+
+    def test_sns_notification_queued(self):
+        """
+        This test method checks that an S3 event notification wrapped in an SNS message is queued.
+        """
+        # When
+        response = self.post({'Type': 'Notification', 'TopicArn': self.topic_arn,
+                              'Message': json.dumps(object_created('photos', 'notes.txt'))})
+
+        # Then
+        self.assertEqual(202, response.status_code)
+        self.assertEqual({'queued': 1}, response.get_json())
+
+    def test_subscription_confirmed(self):
+        """
+        This test method checks that the subscription to an SNS topic is confirmed with its SubscribeURL.
+        """
+        # Given
+        subscribe_url = 'https://sns.eu-west-1.amazonaws.com/?Action=ConfirmSubscription&Token=abc'
+
+        # When
+        with mock.patch('flaskr.api.managers.upload_notifier.requests.get') as get:
+            response = self.post({'Type': 'SubscriptionConfirmation', 'TopicArn': self.topic_arn,
+                                  'SubscribeURL': subscribe_url, 'Message': 'You have chosen to subscribe'})
+
+        # Then
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(subscribe_url, get.call_args[0][0])
+
+    def test_subscription_to_other_host_refused(self):
+        """
+        This test method checks that a SubscribeURL which is not an SNS url is never visited.
+        """
+        # When
+        with mock.patch('flaskr.api.managers.upload_notifier.requests.get') as get:
+            responses = [self.post({'Type': 'SubscriptionConfirmation', 'TopicArn': self.topic_arn,
+                                    'SubscribeURL': url})
+                         for url in ('http://169.254.169.254/latest', 'https://sns.eu-west-1.amazonaws.com.evil.io/',
+                                     'https://sns.eu-west-1.amazonaws.com@evil.io/')]
+
+        # Then
+        self.assertEqual([400, 400, 400], [response.status_code for response in responses])
+        get.assert_not_called()
+
+    def test_other_topic_refused(self):
+        """
+        This test method checks that the messages of a topic which is not allowed are refused.
+        """
+        # When
+        response = self.post({'Type': 'Notification', 'TopicArn': 'arn:aws:sns:eu-west-1:999999999999:other',
+                              'Message': json.dumps(object_created('photos', 'notes.txt'))})
+
+        # Then
+        self.assertEqual(403, response.status_code)
+
+
+if __name__ == '__main__':
+    unittest.main()